@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Compare wotan's biweight with tql's sliding-window biweight.
+
+Prints the wall times of wotan's flatten(method="biweight") and of
+tql.biweight.sliding_biweight (exact, stride=1, and strided) and the max and
+rms differences of their trends, in units of the standard error of the
+window mean, for 2-min (and 30-min) lightcurves of 1, 5 and 13 sectors and
+saves them as json in benchmarks/results:
+
+$ python benchmarks/bench_detrend.py
+$ python benchmarks/bench_detrend.py -n 13 -c short long -w 0.3
+"""
+
+import argparse
+
+from synthetic import make_synthetic_lc
+from bench_pipeline import save_results
+from tql.biweight import compare_biweight
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-n",
+        "--nsectors",
+        type=int,
+        nargs="+",
+        help="number of sectors (default=1 5 13)",
+        default=[1, 5, 13],
+    )
+    parser.add_argument(
+        "-c",
+        "--cadence",
+        type=str,
+        nargs="+",
+        choices=["short", "long"],
+        default=["short"],
+    )
+    parser.add_argument(
+        "-w",
+        "--window_length",
+        type=float,
+        help="window length in days (default=0.5)",
+        default=0.5,
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        help="cadences between evaluations (default=window/60 cadences)",
+        default=None,
+    )
+    parser.add_argument(
+        "-r",
+        "--nrepeat",
+        type=int,
+        help="best of nrepeat runs (default=3)",
+        default=3,
+    )
+    parser.add_argument(
+        "-l", "--label", type=str, help="run label (default=detrend)"
+    )
+    args = parser.parse_args()
+
+    # compile the numba kernels
+    time, flux, _ = make_synthetic_lc(nsectors=1, cadence="long")
+    _ = compare_biweight(time, flux, nrepeat=1)
+
+    rows = []
+    print(
+        f"{'cadence':<8}{'nsec':>5}{'ndata':>8}{'stride':>7}{'t wotan':>9}"
+        f"{'t exact':>9}{'t fast':>8}{'x exact':>8}{'x fast':>7}"
+        f"{'max exact':>10}{'max fast':>9}{'rms fast':>9}"
+    )
+    for cadence in args.cadence:
+        for nsectors in args.nsectors:
+            time, flux, _ = make_synthetic_lc(
+                nsectors=nsectors, cadence=cadence
+            )
+            row = compare_biweight(
+                time,
+                flux,
+                nrepeat=args.nrepeat,
+                window_length=args.window_length,
+                stride=args.stride,
+                edge_cutoff=0.1,
+                break_tolerance=0.1,
+                cval=5.0,
+            )
+            row.update(cadence=cadence, nsectors=nsectors)
+            print(
+                f"{cadence:<8}{nsectors:>5}{row['ndata']:>8}"
+                f"{row['stride']:>7}{row['time_wotan']:>9.3f}"
+                f"{row['time_exact']:>9.3f}{row['time_fast']:>8.3f}"
+                f"{row['speedup_exact']:>8.1f}{row['speedup_fast']:>7.1f}"
+                f"{row['max_diff_exact']:>10.3f}{row['max_diff_fast']:>9.3f}"
+                f"{row['rms_diff_fast']:>9.3f}"
+            )
+            rows.append(row)
+    label = "detrend" if args.label is None else args.label
+    fp = save_results(rows, label=label)
+    print(f"Saved: {fp}")
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Offline benchmark of the tql pipeline stages on synthetic lightcurves.
+
+Times detrend -> LS -> TLS -> fold/bin -> render (and the in-place
+render_fast of tql.template) for 2-min and 30-min lightcurves of 1, 5 and 13 sectors and saves the timings as json in
+benchmarks/results so that versions can be compared:
+
+$ python benchmarks/bench_pipeline.py --label before
+$ python benchmarks/bench_pipeline.py --label after
+$ python benchmarks/bench_pipeline.py --compare results/before_*.json results/after_*.json
+"""
+
+import os
+import io
+import sys
+import json
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import matplotlib
+import lightkurve as lk
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as pl  # noqa: E402
+
+from synthetic import make_synthetic_lc  # noqa: E402
+from tql import tql  # noqa: E402
+from tql.core import (  # noqa: E402
+    TqlResults,
+    flatten_lc,
+    detrend_rotation_lc,
+    get_ls_periodogram,
+    get_tls_results,
+)
+from tql.profiling import StageTimer  # noqa: E402
+from tql.detrend import Detrender  # noqa: E402
+from tql.fold import fold_and_bin as kernel_fold_and_bin  # noqa: E402
+from tql.template import get_template  # noqa: E402
+from chronos.utils import get_transit_mask  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+STAGES = [
+    "detrend",
+    "lomb_scargle",
+    "tls_power",
+    "fold_bin",
+    "render",
+    "render_fast",
+]
+BIN_HR = {"short": 0.5, "long": 4}
+
+
+def get_git_hash():
+    try:
+        cmd = ["git", "rev-parse", "--short", "HEAD"]
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except Exception:
+        return None
+
+
+def fold_and_bin(flat, period, t0, bin_hr, duration):
+    """
+    fold/bin stage as done in render_tql: one fold for the scatter and all,
+    even and odd transits binned in one pass by tql.fold
+    """
+    fold = flat.fold(period=period, t0=t0)
+    bins = kernel_fold_and_bin(
+        flat.time,
+        flat.flux,
+        period,
+        t0,
+        width=bin_hr / 24,
+        xlim=1.5 * duration / period,
+    )
+    return fold, bins
+
+
+def render(results, fold, bins=None):
+    """
+    render the lightcurve panels of the quick look figure
+    """
+    fig, axs = pl.subplots(3, 3, figsize=(15, 12), constrained_layout=True)
+    axs = axs.flatten()
+    tql.plot_raw_trend(results, ax=axs[0])
+    tql.plot_ls_periodogram(results, ax=axs[1])
+    tql.plot_rotation_fold(results, ax=axs[2])
+    tql.plot_flat_lc(results, ax=axs[3])
+    tql.plot_tls_periodogram(results, ax=axs[4])
+    tql.plot_folded_lc(results, ax=axs[5], fold=fold, bins=bins)
+    tql.plot_odd_even(results, ax=axs[6], fold=fold, bins=bins)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    pl.close(fig)
+    return buf.getbuffer().nbytes
+
+
+def render_fast(results):
+    """
+    render the lightcurve panels by updating the figure template in place
+    """
+    template = get_template()
+    template.update(results, summary="", title="")
+    buf = io.BytesIO()
+    template.savefig(buf)
+    return buf.getbuffer().nbytes
+
+
+def warmup():
+    """
+    trigger numba compilation of wotan and tls and lay out the figure
+    template outside of the timed stages
+    """
+    time, flux, flux_err = make_synthetic_lc(
+        nsectors=1, cadence="long", seed=0
+    )
+    lc = lk.LightCurve(time=time, flux=flux, flux_err=flux_err)
+    flat, _ = flatten_lc(lc)
+    _ = get_tls_results(flat, period_min=1, period_max=2)
+    _ = get_template()
+
+
+def run_benchmark(nsectors, cadence, stages=STAGES, period_max=None):
+    """
+    time each stage of the pipeline on one synthetic lightcurve
+
+    Returns
+    -------
+    row : dict
+    """
+    time, flux, flux_err = make_synthetic_lc(
+        nsectors=nsectors, cadence=cadence
+    )
+    lc = lk.LightCurve(time=time, flux=flux, flux_err=flux_err)
+    timings = StageTimer()
+    row = dict(cadence=cadence, nsectors=nsectors, ndata=len(lc.time))
+    rot_mask = np.zeros(len(lc.time), dtype=bool)
+    fold, bins = None, None
+
+    with timings.stage("detrend"):
+        detrender = Detrender(lc)
+        flat, trend = flatten_lc(lc, detrender=detrender)
+        dlc = detrend_rotation_lc(lc, mask=rot_mask, detrender=detrender)
+    if "lomb_scargle" in stages:
+        with timings.stage("lomb_scargle"):
+            ls_results = get_ls_periodogram(dlc, mask=rot_mask)
+        row["Prot_ls"] = ls_results["Prot_ls"]
+    if "tls_power" not in stages:
+        row["stages"] = timings.stages
+        return row
+    with timings.stage("tls_power"):
+        tls_results = get_tls_results(flat, period_max=period_max)
+    row.update(SDE=tls_results.SDE, period=tls_results.period)
+    if "fold_bin" in stages:
+        with timings.stage("fold_bin"):
+            fold, bins = fold_and_bin(
+                flat,
+                tls_results.period,
+                tls_results.T0,
+                BIN_HR[cadence],
+                tls_results.duration,
+            )
+    render_stages = {"render", "render_fast"}.intersection(stages)
+    if render_stages and ("lomb_scargle" in stages):
+        results = TqlResults(
+            cadence=cadence,
+            lc=lc,
+            flat=flat,
+            trend=trend,
+            rot_mask=rot_mask,
+            rot_masked=False,
+            transit_mask=get_transit_mask(
+                flat,
+                tls_results.period,
+                tls_results.T0,
+                tls_results.duration * 24,
+            ),
+            tls_results=tls_results,
+            period_min=0.1,
+            period_max=np.max(tls_results.periods),
+            bin_hr=BIN_HR[cadence],
+            cadence_days=np.median(np.diff(lc.time)),
+            **ls_results,
+        )
+        if "render" in stages:
+            with timings.stage("render"):
+                row["png_bytes"] = render(results, fold, bins)
+        if "render_fast" in stages:
+            with timings.stage("render_fast"):
+                row["png_bytes_fast"] = render_fast(results)
+    row["stages"] = timings.stages
+    return row
+
+
+def save_results(rows, label=None, outdir=RESULTS_DIR):
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    git = get_git_hash()
+    label = git if label is None else label
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    d = dict(
+        label=label,
+        git=git,
+        timestamp=timestamp,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        machine=platform.machine(),
+        ncpu=os.cpu_count(),
+        results=rows,
+    )
+    fp = os.path.join(outdir, f"{label}_{timestamp}.json")
+    with open(fp, "w") as f:
+        json.dump(d, f, indent=2, default=float)
+    return fp
+
+
+def compare(fp1, fp2):
+    """
+    print wall time of each stage in two benchmark files and their ratio
+    """
+    runs = []
+    for fp in [fp1, fp2]:
+        with open(fp) as f:
+            d = json.load(f)
+        runs.append(
+            {
+                (r["cadence"], r["nsectors"], k): v["wall"]
+                for r in d["results"]
+                for k, v in r["stages"].items()
+            }
+        )
+    print(
+        f"{'cadence':<8}{'nsec':>5} {'stage':<14}{'A [s]':>9}{'B [s]':>9}{'B/A':>7}"
+    )
+    for key in runs[0]:
+        if key not in runs[1]:
+            continue
+        a, b = runs[0][key], runs[1][key]
+        print(
+            f"{key[0]:<8}{key[1]:>5} {key[2]:<14}{a:>9.3f}{b:>9.3f}{b/a:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-n",
+        "--nsectors",
+        type=int,
+        nargs="+",
+        help="number of sectors (default=1 5 13)",
+        default=[1, 5, 13],
+    )
+    parser.add_argument(
+        "-c",
+        "--cadence",
+        type=str,
+        nargs="+",
+        choices=["short", "long"],
+        default=["short", "long"],
+    )
+    parser.add_argument(
+        "--stages", type=str, nargs="+", choices=STAGES, default=STAGES
+    )
+    parser.add_argument(
+        "--period_max",
+        type=float,
+        help="TLS period_max (default=baseline/2)",
+        default=None,
+    )
+    parser.add_argument(
+        "-l", "--label", type=str, help="run label (default=git hash)"
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        nargs=2,
+        help="compare two saved benchmark files",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        sys.exit(0)
+
+    warmup()
+    rows = []
+    for cadence in args.cadence:
+        for nsectors in args.nsectors:
+            row = run_benchmark(
+                nsectors, cadence, args.stages, period_max=args.period_max
+            )
+            stages = ", ".join(
+                f"{k}={v['wall']:.2f}s/{v['rss']:.0f}MB"
+                for k, v in row["stages"].items()
+            )
+            print(
+                f"{cadence} {nsectors} sectors ({row['ndata']} points): {stages}"
+            )
+            rows.append(row)
+    fp = save_results(rows, label=args.label)
+    print(f"Saved: {fp}")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Compare the coarse-to-fine and the full TLS search on synthetic lightcurves.
+
+Prints SDE, period and wall time of both searches for 2-min (and 30-min)
+lightcurves of 1, 5 and 13 sectors and saves them as json in
+benchmarks/results:
+
+$ python benchmarks/bench_search.py
+$ python benchmarks/bench_search.py -n 1 5 -c short --npeaks 5
+"""
+
+import argparse
+
+import lightkurve as lk
+
+from synthetic import make_synthetic_lc
+from bench_pipeline import warmup, save_results
+from tql.core import flatten_lc
+from tql.search import COARSE_BIN_MINUTES, compare_search
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-n",
+        "--nsectors",
+        type=int,
+        nargs="+",
+        help="number of sectors (default=1 5 13)",
+        default=[1, 5, 13],
+    )
+    parser.add_argument(
+        "-c",
+        "--cadence",
+        type=str,
+        nargs="+",
+        choices=["short", "long"],
+        default=["short"],
+    )
+    parser.add_argument(
+        "--npeaks",
+        type=int,
+        help="number of coarse peaks refined (default=3)",
+        default=3,
+    )
+    parser.add_argument(
+        "--bin_minutes",
+        type=float,
+        help=f"bin size of the coarse search (default={COARSE_BIN_MINUTES})",
+        default=COARSE_BIN_MINUTES,
+    )
+    parser.add_argument(
+        "-l", "--label", type=str, help="run label (default=search)"
+    )
+    args = parser.parse_args()
+
+    warmup()
+    rows = []
+    print(
+        f"{'cadence':<8}{'nsec':>5}{'ndata':>8}{'SDE full':>10}{'SDE fast':>10}"
+        f"{'P full':>10}{'P fast':>10}{'t full':>8}{'t fast':>8}{'x':>6}"
+    )
+    for cadence in args.cadence:
+        for nsectors in args.nsectors:
+            time, flux, flux_err = make_synthetic_lc(
+                nsectors=nsectors, cadence=cadence
+            )
+            lc = lk.LightCurve(time=time, flux=flux, flux_err=flux_err)
+            flat, _ = flatten_lc(lc)
+            row = compare_search(
+                flat, npeaks=args.npeaks, bin_minutes=args.bin_minutes
+            )
+            row.update(cadence=cadence, nsectors=nsectors)
+            print(
+                f"{cadence:<8}{nsectors:>5}{row['ndata']:>8}"
+                f"{row['SDE_full']:>10.2f}{row['SDE_fast']:>10.2f}"
+                f"{row['period_full']:>10.4f}{row['period_fast']:>10.4f}"
+                f"{row['time_full']:>8.2f}{row['time_fast']:>8.2f}"
+                f"{row['speedup']:>6.1f}"
+            )
+            rows.append(row)
+    label = "search" if args.label is None else args.label
+    fp = save_results(rows, label=label)
+    print(f"Saved: {fp}")
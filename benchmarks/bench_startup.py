@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Benchmark of the start-up time of tql.
+
+Times `tql -h` and the import of the package and of its modules in fresh
+interpreters, lists the heavy dependencies each of them loads and saves
+the timings as json in benchmarks/results so that versions can be compared:
+
+$ python benchmarks/bench_startup.py --label before
+$ python benchmarks/bench_startup.py --compare results/startup_before_*.json results/startup_after_*.json
+
+With --check, it exits with an error if `tql -h`, `import tql` or the
+batch/server modules load a heavy dependency or take longer than
+--max_seconds, e.g. to guard against regressions in CI.
+"""
+
+import os
+import sys
+import json
+import platform
+import argparse
+import subprocess
+from statistics import median
+from time import perf_counter
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SCRIPT = os.path.join(ROOT, "scripts", "tql")
+TARGETS = {
+    "tql -h": [SCRIPT, "-h"],
+    "import tql": ["-c", "import tql"],
+    "import tql.batch": ["-c", "import tql.batch"],
+    "import tql.server": ["-c", "import tql.server"],
+    "import tql.core": ["-c", "import tql.core"],
+    "import tql.tql": ["-c", "import tql.tql"],
+}
+# should start without the heavy dependencies
+LIGHT_TARGETS = [
+    "tql -h",
+    "import tql",
+    "import tql.batch",
+    "import tql.server",
+]
+HEAVY_MODULES = [
+    "matplotlib",
+    "astropy",
+    "lightkurve",
+    "scipy",
+    "pandas",
+    "tables",
+    "wotan",
+    "transitleastsquares",
+    "deepdish",
+    "tqdm",
+    "chronos",
+]
+
+
+def get_git_hash():
+    try:
+        cmd = ["git", "rev-parse", "--short", "HEAD"]
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except Exception:
+        return None
+
+
+def _run(args, importtime=False):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p]
+    )
+    env["MPLBACKEND"] = "Agg"
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    return subprocess.run(
+        cmd + args, env=env, capture_output=True, text=True, cwd=ROOT
+    )
+
+
+def get_loaded_modules(args):
+    """
+    top-level packages imported by a command, from python -X importtime
+
+    Returns
+    -------
+    modules : dict
+        cumulative import time in s of each top-level package
+    """
+    out = _run(args, importtime=True)
+    modules = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.split("|")
+        if (len(fields) != 3) or not fields[1].strip().isdigit():
+            # header
+            continue
+        name = fields[2].strip().split(".")[0]
+        # the outermost import of a package is listed last
+        modules[name] = int(fields[1]) / 1e6
+    return modules
+
+
+def run_benchmark(name, nrepeat=5):
+    """
+    wall time of a command in fresh interpreters
+
+    Returns
+    -------
+    row : dict
+    """
+    args = TARGETS[name]
+    walls = []
+    for _ in range(nrepeat):
+        start = perf_counter()
+        out = _run(args)
+        walls.append(perf_counter() - start)
+    modules = get_loaded_modules(args)
+    return dict(
+        target=name,
+        returncode=out.returncode,
+        error=out.stderr.strip().splitlines()[-1] if out.returncode else "",
+        min=min(walls),
+        median=median(walls),
+        heavy={k: modules[k] for k in HEAVY_MODULES if k in modules},
+    )
+
+
+def check(rows, max_seconds=1.0):
+    """
+    errors of the light targets (heavy dependencies loaded or too slow)
+    """
+    errors = []
+    for row in rows:
+        if row["target"] not in LIGHT_TARGETS:
+            continue
+        if row["returncode"] != 0:
+            errors.append(f"{row['target']} failed: {row['error']}")
+        if len(row["heavy"]) > 0:
+            heavy = ", ".join(row["heavy"])
+            errors.append(f"{row['target']} imports {heavy}")
+        if row["median"] > max_seconds:
+            errors.append(
+                f"{row['target']} takes {row['median']:.2f} s "
+                f"(> {max_seconds} s)"
+            )
+    return errors
+
+
+def save_results(rows, label=None, outdir=RESULTS_DIR):
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    git = get_git_hash()
+    label = git if label is None else label
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    d = dict(
+        label=label,
+        git=git,
+        timestamp=timestamp,
+        python=platform.python_version(),
+        machine=platform.machine(),
+        ncpu=os.cpu_count(),
+        results=rows,
+    )
+    fp = os.path.join(outdir, f"startup_{label}_{timestamp}.json")
+    with open(fp, "w") as f:
+        json.dump(d, f, indent=2)
+    return fp
+
+
+def compare(fp1, fp2):
+    """
+    print the median start-up time of each target in two benchmark files
+    """
+    runs = []
+    for fp in [fp1, fp2]:
+        with open(fp) as f:
+            d = json.load(f)
+        runs.append({r["target"]: r["median"] for r in d["results"]})
+    print(f"{'target':<20}{'A [s]':>9}{'B [s]':>9}{'B/A':>7}")
+    for key in runs[0]:
+        if key not in runs[1]:
+            continue
+        a, b = runs[0][key], runs[1][key]
+        print(f"{key:<20}{a:>9.3f}{b:>9.3f}{b/a:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-t",
+        "--targets",
+        type=str,
+        nargs="+",
+        choices=list(TARGETS),
+        default=list(TARGETS),
+    )
+    parser.add_argument(
+        "-n",
+        "--nrepeat",
+        type=int,
+        help="number of runs of each target (default=5)",
+        default=5,
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="fail if a light target loads heavy dependencies or is slow",
+        default=False,
+    )
+    parser.add_argument(
+        "--max_seconds",
+        type=float,
+        help="start-up time limit of light targets with --check (default=1)",
+        default=1.0,
+    )
+    parser.add_argument(
+        "-l", "--label", type=str, help="run label (default=git hash)"
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        nargs=2,
+        help="compare two saved benchmark files",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        sys.exit(0)
+
+    rows = []
+    for name in args.targets:
+        row = run_benchmark(name, nrepeat=args.nrepeat)
+        heavy = ", ".join(f"{k}={v:.2f}s" for k, v in row["heavy"].items())
+        status = "" if row["returncode"] == 0 else f" FAILED: {row['error']}"
+        print(f"{name:<20}{row['median']:>7.2f} s  {heavy}{status}")
+        rows.append(row)
+    fp = save_results(rows, label=args.label)
+    print(f"Saved: {fp}")
+    if args.check:
+        errors = check(rows, max_seconds=args.max_seconds)
+        for error in errors:
+            print(error)
+        sys.exit(1 if len(errors) > 0 else 0)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic TESS-like lightcurves with stellar rotation and injected transits
+"""
+
+import numpy as np
+
+SECTOR_LENGTH = 27.4  # days
+ORBIT_GAP = 1.0  # days, data downlink gap in the middle of each sector
+TSTART = 1325.3  # BTJD of sector 1
+CADENCES = {"short": 2 / 60 / 24, "long": 30 / 60 / 24}
+
+
+def make_time(nsectors=1, cadence="short", tstart=TSTART):
+    """
+    time stamps of nsectors consecutive sectors with orbit gaps; cadence is
+    short, long or in days
+    """
+    dt = CADENCES.get(cadence, cadence)
+    time = np.arange(tstart, tstart + nsectors * SECTOR_LENGTH, dt)
+    phase = (time - tstart) % SECTOR_LENGTH
+    mid = SECTOR_LENGTH / 2
+    in_gap = np.abs(phase - mid) < ORBIT_GAP / 2
+    return time[~in_gap]
+
+
+def transit_model(
+    time,
+    period,
+    t0,
+    depth,
+    duration,
+    ingress=0.1,
+    odd_depth=None,
+    single_cycle=None,
+):
+    """
+    trapezoid transit model; ingress is a fraction of the duration (0=box,
+    0.5=V-shaped), odd transits have odd_depth (default=depth) and only the
+    transit of single_cycle is kept if given
+    """
+    cycle = np.floor((time - t0) / period + 0.5)
+    dt = np.abs(time - t0 - cycle * period)
+    depths = np.full_like(time, depth)
+    if odd_depth is not None:
+        depths[cycle % 2 == 1] = odd_depth
+    if single_cycle is not None:
+        depths[cycle != single_cycle] = 0
+    t_flat = duration * (0.5 - ingress)
+    model = np.ones_like(time)
+    full = dt <= t_flat
+    model[full] -= depths[full]
+    partial = (dt > t_flat) & (dt < duration / 2)
+    model[partial] -= (
+        depths[partial] * (duration / 2 - dt[partial]) / (duration * ingress)
+    )
+    return model
+
+
+def rotation_model(time, Prot, amp, evolving=True, seed=None):
+    """
+    quasi-periodic spot modulation with evolving amplitude (or a sinusoid
+    if not evolving)
+    """
+    rng = np.random.default_rng(seed)
+    phases = rng.uniform(0, 2 * np.pi, 3)
+    t = time - time[0]
+    if not evolving:
+        return 1 + amp * np.sin(2 * np.pi * t / Prot + phases[1])
+    envelope = 1 + 0.3 * np.sin(2 * np.pi * t / (5 * Prot) + phases[0])
+    signal = np.sin(2 * np.pi * t / Prot + phases[1])
+    signal += 0.3 * np.sin(4 * np.pi * t / Prot + phases[2])
+    return 1 + amp * envelope * signal
+
+
+def make_synthetic_lc(
+    nsectors=1,
+    cadence="short",
+    tstart=TSTART,
+    Prot=3.7,
+    rot_amp=5e-3,
+    evolving_spots=True,
+    period=4.3,
+    t0=TSTART + 1.2,
+    depth=2e-3,
+    duration=0.12,
+    ingress=0.1,
+    odd_depth=None,
+    single_cycle=None,
+    secondary=0,
+    noise=None,
+    nflares=0,
+    nans=None,
+    seed=42,
+):
+    """
+    Make a TESS-like lightcurve with rotation signal and injected transits
+
+    Parameters
+    ----------
+    nsectors : int
+        number of consecutive sectors
+    cadence : str or float
+        short (2-min), long (30-min) or cadence in days
+    tstart : float
+        start time of the first sector
+    Prot, rot_amp : float
+        rotation period (days) and semi-amplitude (relative flux)
+    evolving_spots : bool
+        quasi-periodic rotation signal (False=sinusoid)
+    period, t0, depth, duration : float
+        transit ephemeris and shape (days, BTJD, relative flux, days)
+    ingress : float
+        ingress as fraction of the duration (0=box, 0.5=V-shaped)
+    odd_depth : float
+        depth of odd transits (default=depth)
+    single_cycle : int
+        keep only this transit
+    secondary : float
+        depth of the secondary eclipse at phase 0.5
+    noise : float
+        white noise per cadence (default=1e-3 short, 2e-4 long)
+    nflares : int
+        number of single-cadence flares of 2e-2
+    nans : slice or array
+        cadences set to nan
+    seed : int
+        random seed
+
+    Returns
+    -------
+    time, flux, flux_err : array
+    """
+    if noise is None:
+        noise = 1e-3 if cadence == "short" else 2e-4
+    rng = np.random.default_rng(seed)
+    time = make_time(nsectors=nsectors, cadence=cadence, tstart=tstart)
+    flux = rotation_model(
+        time, Prot, rot_amp, evolving=evolving_spots, seed=seed
+    )
+    flux *= transit_model(
+        time,
+        period,
+        t0,
+        depth,
+        duration,
+        ingress=ingress,
+        odd_depth=odd_depth,
+        single_cycle=single_cycle,
+    )
+    if secondary > 0:
+        flux *= transit_model(
+            time, period, t0 + period / 2, secondary, duration, ingress
+        )
+    flux += rng.normal(0, noise, len(time))
+    flux[rng.integers(0, len(time), nflares)] += 2e-2
+    if nans is not None:
+        flux[nans] = np.nan
+    flux_err = np.full_like(time, noise)
+    return time, flux, flux_err
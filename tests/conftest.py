@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+# render figures without a display
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+# the synthetic lightcurves of the benchmarks
+BENCHMARKS_DIR = os.path.join(os.path.dirname(__file__), "..", "benchmarks")
+sys.path.insert(0, BENCHMARKS_DIR)
+from synthetic import make_synthetic_lc  # noqa: E402
+
+
+@pytest.fixture
+def make_lc():
+    """
+    see benchmarks/synthetic.make_synthetic_lc
+    """
+    return make_synthetic_lc
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from astropy.wcs import WCS
+from tql.tpf import sum_apertures
+from tql.aperture import parse_aperture_spec, get_contratios
+
+
+class FakeTpf:
+    def __init__(self):
+        self.wcs = WCS(naxis=2)
+        self.wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        self.wcs.wcs.crpix = [5, 5]
+        self.wcs.wcs.crval = [30.0, -20.0]
+        self.wcs.wcs.cdelt = [-21 / 3600, 21 / 3600]
+
+
+def test_parse_aperture_spec():
+    assert parse_aperture_spec("square:2") == {
+        "sap_mask": "square",
+        "aper_radius": 2,
+    }
+    assert parse_aperture_spec("percentile:90") == {
+        "sap_mask": "percentile",
+        "percentile": 90.0,
+    }
+    assert parse_aperture_spec("pipeline") == {"sap_mask": "pipeline"}
+
+
+def test_sum_apertures():
+    rng = np.random.default_rng(0)
+    flux = rng.normal(100, 5, (50, 7, 9))
+    flux[3, 2, 2] = np.nan
+    flux_err = np.ones_like(flux)
+    masks = rng.uniform(size=(4, 7, 9)) > 0.5
+    f, e = sum_apertures(flux, flux_err, masks)
+    assert f.shape == (4, 50)
+    for n, mask in enumerate(masks):
+        assert np.allclose(f[n], np.nansum(flux[:, mask], axis=1))
+        assert np.allclose(e[n], np.sqrt(mask.sum()))
+    bkg_masks = ~masks
+    f, _ = sum_apertures(flux, flux_err, masks, bkg_masks)
+    bkg = np.nanmedian(flux[:, bkg_masks[0]], axis=1)
+    expected = np.nansum(flux[:, masks[0]], axis=1) - masks[0].sum() * bkg
+    assert np.allclose(f[0], expected)
+
+
+def test_contratios():
+    tpf = FakeTpf()
+    # target, a source 2 mag fainter 1 pix away and one off the tpf
+    pix = np.array([[4.0, 4.0], [5.1, 3.9], [40.0, 40.0]])
+    ra, dec = tpf.wcs.all_pix2world(pix, 0).T
+    gaia_sources = pd.DataFrame(
+        {"ra": ra, "dec": dec, "phot_g_mean_mag": [10.0, 12.0, 8.0]}
+    )
+    masks = np.zeros((2, 9, 9), dtype=bool)
+    masks[0, 4, 4] = True
+    masks[1, 3:6, 3:6] = True
+    contratio = get_contratios(tpf, masks, gaia_sources)
+    assert np.allclose(contratio, [0, 10 ** (-0.8)])
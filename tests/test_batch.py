@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from tql.batch import read_target_list, get_target_key, read_status
+
+
+def test_read_target_list(tmp_path):
+    fp = tmp_path / "targets.txt"
+    fp.write_text(
+        "# header\n"
+        "52368076\n"
+        "toi 125.01\n"
+        "gaia 2382520826218346240\n"
+        "22.5 -12.56\n"
+        "08:09:10, -05:04:23\n"
+    )
+    targets = read_target_list(str(fp))
+    assert targets[0] == {"ticid": 52368076}
+    assert targets[1] == {"toiid": 125.01}
+    assert targets[2] == {"gaiaid": 2382520826218346240}
+    assert targets[3] == {"coords": ("22.5", "-12.56")}
+    assert get_target_key(targets[4]) == "coords 08:09:10 -05:04:23"
+
+
+def test_read_status(tmp_path):
+    fp = tmp_path / "tql_status.csv"
+    fp.write_text(
+        "target,status,runtime,message\n"
+        "tic 1,failed,1.00,error\n"
+        "tic 1,ok,2.00,\n"
+        "tic 2,failed,1.00,error\n"
+    )
+    status = read_status(str(fp))
+    assert status == {"tic 1": "ok", "tic 2": "failed"}
+
+
+class FakeResults(dict):
+    def __getattr__(self, key):
+        return self[key]
+
+
+def test_index_filename(monkeypatch, tmp_path):
+    from tql import tql, core, index
+    from tql.batch import _run_target
+
+    prefix = str(tmp_path / "tic1_s1")
+    monkeypatch.setattr(core, "get_output_prefix", lambda r, o: prefix)
+    monkeypatch.setattr(core, "save_timings", lambda r, o: None)
+    monkeypatch.setattr(index, "get_index_row", lambda r, fp: {"fp": fp})
+    ok = FakeResults(tls_results={}, SDE=10.0)
+    rejected = FakeResults(
+        tls_results=None, bls_results=dict(bls_SDE=3.0, bls_snr=2.0)
+    )
+    for results, savetls, fp in [
+        (ok, True, prefix + "_tls.h5"),
+        (ok, False, None),
+        (rejected, True, None),
+    ]:
+        monkeypatch.setattr(tql, "run_tql", lambda **kw: results)
+        kwargs = dict(outdir=str(tmp_path), verbose=False, savetls=savetls)
+        row = _run_target(({"ticid": 1}, kwargs, None, False))
+        assert row["index"] == {"fp": fp}
+
+
+def test_index_rejected(monkeypatch, tmp_path):
+    from tql import tql, core
+    from tql.batch import _run_target
+    from tql.index import append_to_index, load_index
+
+    monkeypatch.setattr(core, "save_timings", lambda r, o: None)
+    index_fp = str(tmp_path / "tql_index.h5")
+    for ticid in [1, 2, 3]:
+        rejected = FakeResults(
+            ticid=ticid,
+            gaiaid=-1,
+            sector=1,
+            lctype="pdcsap",
+            cadence="short",
+            tls_results=None,
+            bls_results=dict(bls_SDE=ticid, bls_snr=2.0),
+        )
+        monkeypatch.setattr(tql, "run_tql", lambda **kw: rejected)
+        kwargs = dict(outdir=str(tmp_path), verbose=False, savetls=True)
+        row = _run_target(({"ticid": ticid}, kwargs, None, False))
+        assert row["status"] == "rejected"
+        append_to_index([row["index"]], index_fp)
+    # the BLS summary of every rejected target is kept
+    df = load_index(index_fp)
+    assert df.ticid.tolist() == [1, 2, 3]
+    assert df.bls_SDE.tolist() == [1.0, 2.0, 3.0]
+    assert (df.filename == "").all()
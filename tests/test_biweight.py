@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from wotan import flatten
+
+from tql.fold import fold_phase
+from tql.biweight import sliding_biweight, get_stride, compare_biweight
+
+# rotation, an orbit gap, flares, box transits and nans
+BIWEIGHT_LC = dict(
+    tstart=0,
+    Prot=2.3,
+    evolving_spots=False,
+    period=3.0,
+    t0=0.05,
+    duration=0.1,
+    depth=1e-2,
+    ingress=0,
+    nflares=20,
+    nans=slice(100, 110),
+)
+
+
+def test_matches_wotan(make_lc):
+    time, flux, _ = make_lc(**BIWEIGHT_LC)
+    phase, _ = fold_phase(time, 3.0, 0.05)
+    transits = np.abs(phase) * 3.0 < 0.05
+    kwargs = dict(window_length=0.5, edge_cutoff=0.1, break_tolerance=0.1)
+    # the standard error of the window mean
+    error = 1e-3 / np.sqrt(0.5 / (2 / 60 / 24))
+    for mask in [None, transits]:
+        _, trend = flatten(
+            time,
+            flux,
+            method="biweight",
+            return_trend=True,
+            mask=mask,
+            **kwargs
+        )
+        exact = sliding_biweight(time, flux, mask=mask, stride=1, **kwargs)
+        assert np.array_equal(np.isnan(exact), np.isnan(trend))
+        assert np.nanmax(np.abs(exact - trend)) < 1e-5
+        fast = sliding_biweight(time, flux, mask=mask, **kwargs)
+        assert np.array_equal(np.isnan(fast), np.isnan(trend))
+        diff = fast - trend
+        assert np.nanmax(np.abs(diff)) < 3 * error
+        assert np.sqrt(np.nanmean(diff**2)) < 0.3 * error
+
+
+def test_segments(make_lc):
+    time, flux, _ = make_lc(**BIWEIGHT_LC)
+    trend = sliding_biweight(time, flux, edge_cutoff=0.1, break_tolerance=0.1)
+    # nan within edge_cutoff of both edges of both segments
+    gap = np.argmax(np.diff(time))
+    for t in [time[0], time[gap], time[gap + 1], time[-1]]:
+        assert np.all(np.isnan(trend[np.abs(time - t) < 0.09]))
+    assert np.isnan(trend).sum() < 0.1 * len(time)
+    # unsorted input
+    order = np.random.default_rng(1).permutation(len(time))
+    shuffled = sliding_biweight(time[order], flux[order], stride=1)
+    assert np.allclose(
+        shuffled, sliding_biweight(time, flux, stride=1)[order], equal_nan=True
+    )
+    assert len(sliding_biweight([], [])) == 0
+    assert np.isnan(sliding_biweight([1.0, 1.1], [np.nan, 1.0])[0])
+
+
+def test_stride():
+    time = np.arange(0, 10, 2 / 60 / 24)
+    assert get_stride(time, 0.5) == 6
+    # every cadence of 30-min data
+    assert get_stride(time[::15], 0.5) == 1
+
+
+def test_compare_biweight(make_lc):
+    time, flux, _ = make_lc(**BIWEIGHT_LC)
+    d = compare_biweight(time, flux, nrepeat=1, window_length=0.5)
+    assert d["stride"] == 6
+    assert d["max_diff_exact"] < 0.1
+    assert d["nan_mismatch_fast"] == 0
+    assert d["time_fast"] > 0
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import os
+import inspect
+import pytest
+from tql.cache import (
+    RESULTS_KEY_PACKAGES,
+    CatalogCache,
+    get_results_key,
+    get_results_cache,
+    get_code_version,
+    is_resolved,
+)
+
+
+def test_cache_query(tmp_path):
+    cache = CatalogCache(cache_dir=str(tmp_path))
+    calls = []
+
+    def query(radius):
+        calls.append(radius)
+        return {"radius": radius}
+
+    key = ("gaia_dr2", "tic 52368076", 120)
+    assert cache.query(key, query, radius=120) == {"radius": 120}
+    assert cache.query(key, query, radius=120) == {"radius": 120}
+    assert len(calls) == 1
+    # new instance reads from disk
+    cache2 = CatalogCache(cache_dir=str(tmp_path))
+    assert cache2.get(key) == {"radius": 120}
+
+
+def test_cache_ttl_and_offline(tmp_path):
+    key = ("tic_xmatch", "tic 1", 3)
+    cache = CatalogCache(cache_dir=str(tmp_path), ttl=-1)
+    cache.set(key, 1)
+    # expired
+    assert cache.get(key) is None
+    offline = CatalogCache(cache_dir=str(tmp_path), ttl=-1, offline=True)
+    # expired entries are still served offline
+    assert offline.get(key) == 1
+    with pytest.raises(KeyError):
+        offline.query(("vizier", "tic 1", None), lambda: 1)
+
+
+def test_cache_eviction(tmp_path):
+    cache = CatalogCache(cache_dir=str(tmp_path), max_size=0.15)
+    for i in range(3):
+        cache.set(("gaia_dr2", f"tic {i}", 120), os.urandom(60 * 1024))
+    assert cache.get_size() <= 0.15
+    # least recently used entry is evicted first
+    assert cache.get(("gaia_dr2", "tic 0", 120)) is None
+    assert cache.get(("gaia_dr2", "tic 2", 120)) is not None
+
+
+def test_cache_scans(tmp_path, monkeypatch):
+    cache = CatalogCache(cache_dir=str(tmp_path), max_size=1, scan_every=50)
+    scans = []
+    files = cache._files
+    monkeypatch.setattr(cache, "_files", lambda: scans.append(1) or files())
+    for i in range(100):
+        cache.set(("gaia_dr2", f"tic {i}", 120), os.urandom(1024))
+    # the first write and every 50 writes
+    assert len(scans) == 2
+    # running total of the size
+    assert abs(cache._size - cache.get_size() * 1024**2) < 1
+    for i in range(100):
+        cache.set(("gaia_dr2", f"tic {i}", 120), os.urandom(20 * 1024))
+    assert cache.get_size() <= 1
+    assert abs(cache._size - cache.get_size() * 1024**2) < 1
+
+
+def test_results_key(tmp_path):
+    params = dict(ticid=52368076, sector=1, lctype="pdcsap", savetls=True)
+    key = get_results_key(params)
+    # outputs do not change the results
+    assert get_results_key(dict(params, savetls=False, outdir="..")) == key
+    assert get_results_key(dict(params, window_length=0.3)) != key
+    assert get_results_key(dict(params, Porb_limits=(1, 5))) != key
+    assert key[1] == get_code_version()
+    cache = get_results_cache(str(tmp_path))
+    cache.set(key, {"SDE": 12.0})
+    # large results are read from disk only
+    assert cache._memory == {}
+    assert cache.get(key) == {"SDE": 12.0}
+    assert cache.get(get_results_key(dict(params, sector=2))) is None
+
+
+def test_results_cache_opt_in():
+    from tql.core import run_tql
+    from tql.tql import plot_tql
+
+    # the library functions do not write to the results cache by default
+    for func in [run_tql, plot_tql]:
+        params = inspect.signature(func).parameters
+        assert params["results_cache_dir"].default is None
+    # both change the downloaded lightcurves and catalog values
+    assert "chronos" in RESULTS_KEY_PACKAGES
+    assert "astropy" in RESULTS_KEY_PACKAGES
+
+
+def test_results_key_sectors():
+    assert is_resolved({"ticid": 1, "sector": 1})
+    assert is_resolved({"ticid": 1, "sectors": [1, 2]})
+    assert not is_resolved({"ticid": 1, "sector": None})
+    assert not is_resolved({"ticid": 1, "sectors": "all"})
+    key = get_results_key({"ticid": 1, "sectors": [2, 1]})
+    assert get_results_key({"ticid": 1, "sectors": [1, 2]}) == key
+
+
+def test_cached_target_not_loaded(tmp_path):
+    import inspect
+    from tql.core import TqlResults, run_tql
+
+    params = {
+        k: p.default for k, p in inspect.signature(run_tql).parameters.items()
+    }
+    params.update(ticid=52368076, sector=1, lctype="pdcsap")
+    cache = get_results_cache(str(tmp_path))
+    cache.set(get_results_key(params), TqlResults(ticid=52368076, SDE=12.0))
+
+    def load():
+        raise AssertionError("target loaded")
+
+    results = run_tql(
+        ticid=52368076,
+        sector=1,
+        lctype="pdcsap",
+        target=load,
+        results_cache_dir=str(tmp_path),
+        verbose=False,
+    )
+    assert results.cached
+    assert results.SDE == 12.0
+
+
+def test_unresolved_not_cached(tmp_path):
+    import inspect
+    from tql.core import TqlResults, run_tql
+
+    params = {
+        k: p.default for k, p in inspect.signature(run_tql).parameters.items()
+    }
+    # cached by an earlier version without resolving the sector
+    params.update(ticid=52368076, lctype="pdcsap")
+    cache = get_results_cache(str(tmp_path))
+    cache.set(get_results_key(params), TqlResults(ticid=52368076, SDE=12.0))
+
+    def load():
+        raise RuntimeError("target loaded")
+
+    with pytest.raises(RuntimeError):
+        run_tql(
+            ticid=52368076,
+            lctype="pdcsap",
+            target=load,
+            results_cache_dir=str(tmp_path),
+            verbose=False,
+        )
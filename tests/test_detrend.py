@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import lightkurve as lk
+from tql.detrend import Detrender
+from tql.core import stitch_lcs
+
+
+def test_detrender_memoized():
+    time = np.arange(0, 10, 2 / 60 / 24)
+    flux = 1 + 1e-2 * np.sin(2 * np.pi * time / 3.0)
+    lc = lk.LightCurve(time=time, flux=flux, flux_err=np.full_like(time, 1e-3))
+    detrender = Detrender(lc)
+    flat, trend = detrender.flatten("biweight", 0.5)
+    assert np.nanstd(flat.flux) < 1e-3
+    _ = detrender.flatten("biweight", 0.5)
+    assert detrender.ncomputed == 1
+    # empty mask is the same as no mask
+    mask = np.zeros(len(time), dtype=bool)
+    _ = detrender.flatten("lk_savgol", 1001, mask=mask, polyorder=2)
+    _ = detrender.flatten("lk_savgol", 1001, polyorder=2)
+    assert detrender.ncomputed == 2
+    mask[100:200] = True
+    _ = detrender.flatten("lk_savgol", 1001, mask=mask, polyorder=2)
+    assert detrender.ncomputed == 3
+
+
+def test_stitched_segments():
+    lcs = {}
+    for sector in [2, 1]:
+        time = np.arange(0, 10, 10 / 60 / 24) + 30 * sector
+        flux = sector * (1 + 1e-2 * np.sin(2 * np.pi * time / 3.0))
+        lcs[sector] = lk.LightCurve(
+            time=time, flux=flux, flux_err=np.full_like(time, 1e-3)
+        )
+    lc, segments = stitch_lcs(lcs)
+    assert np.all(np.diff(lc.time) > 0)
+    assert np.all(segments[: len(segments) // 2] == 1)
+    # each sector is normalized
+    assert np.allclose(np.median(lc.flux[segments == 2]), 1, atol=1e-2)
+    detrender = Detrender(lc, segments=segments)
+    flat, _ = detrender.flatten("biweight", 0.5)
+    assert np.nanstd(flat.flux) < 1e-3
+
+
+def test_fast_biweight():
+    time = np.arange(0, 10, 2 / 60 / 24)
+    flux = 1 + 1e-2 * np.sin(2 * np.pi * time / 3.0)
+    lc = lk.LightCurve(time=time, flux=flux, flux_err=np.full_like(time, 1e-3))
+    detrender = Detrender(lc)
+    flat, _ = detrender.flatten("fast_biweight", 0.5, edge_cutoff=0.1)
+    assert np.nanstd(flat.flux) < 1e-3
+    # different trend than wotan's biweight
+    _ = detrender.flatten("biweight", 0.5, edge_cutoff=0.1)
+    assert detrender.ncomputed == 2
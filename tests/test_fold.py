@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from tql.fold import fold_phase, fold_and_bin, get_binned
+
+# box transits without rotation; odd transits are deeper
+FOLD_LC = dict(
+    nsectors=2,
+    cadence=10 / 60 / 24,
+    tstart=0,
+    rot_amp=0,
+    period=3.0,
+    t0=1.0,
+    duration=0.1,
+    depth=5e-3,
+    odd_depth=1e-2,
+    secondary=1e-3,
+    ingress=0,
+    noise=1e-4,
+)
+
+
+def test_fold_phase():
+    time = np.arange(0, 10, 0.01)
+    phase, cycle = fold_phase(time, 2.0, 1.0)
+    assert np.all((phase >= -0.5) & (phase < 0.5))
+    # the transit at t0 is even
+    assert cycle[np.argmin(np.abs(time - 1.0))] == 0
+    assert cycle[np.argmin(np.abs(time - 3.0))] == 1
+    phase, cycle = fold_phase(time, [2.0, 3.0], [1.0, 1.0])
+    assert phase.shape == (2, len(time))
+
+
+def test_fold_and_bin(make_lc):
+    time, flux, _ = make_lc(**FOLD_LC)
+    width = 0.5 / 24
+    xlim = 0.15 / 3.0
+    bins = fold_and_bin(time, flux, 3.0, 1.0, width, xlim=xlim, median=True)
+    assert bins["mean"].shape == (4, 1, bins["phase"].shape[1])
+    x, y, yerr = get_binned(bins, "all")
+    assert np.all(np.abs(x) < xlim + width / 3.0)
+    assert np.all(yerr > 0)
+    assert np.isclose(y.min(), 1 - 7.5e-3, atol=1e-3)
+    _, even, _ = get_binned(bins, "even")
+    _, odd, _ = get_binned(bins, "odd")
+    assert np.isclose(even.min(), 1 - 5e-3, atol=5e-4)
+    assert np.isclose(odd.min(), 1 - 1e-2, atol=5e-4)
+    _, sec, _ = get_binned(bins, "secondary")
+    assert np.isclose(sec.min(), 1 - 1e-3, atol=3e-4)
+    # same as numpy in each bin
+    phase, _ = fold_phase(time, 3.0, 1.0)
+    step = width / 3.0
+    idx = np.floor((phase + xlim) / step).astype(int)
+    for b in [0, 5]:
+        assert np.isclose(bins["mean"][0, 0, b], flux[idx == b].mean())
+        assert np.isclose(bins["median"][0, 0, b], np.median(flux[idx == b]))
+
+
+def test_fold_and_bin_periods(make_lc):
+    time, flux, _ = make_lc(**FOLD_LC)
+    periods = np.array([3.0, 4.1, 7.3])
+    bins = fold_and_bin(
+        time, flux, periods, [1.0, 1.0, 1.0], 0.5 / 24, xlim=0.2 / periods
+    )
+    for i, period in enumerate(periods):
+        single = fold_and_bin(time, flux, period, 1.0, 0.5 / 24, 0.2 / period)
+        x, y, _ = get_binned(bins, "odd", i)
+        x1, y1, _ = get_binned(single, "odd")
+        assert np.allclose(x, x1) and np.allclose(y, y1)
+    # only the true period shows a transit
+    depths = [1 - get_binned(bins, "all", i)[1].min() for i in range(3)]
+    assert np.argmax(depths) == 0
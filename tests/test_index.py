@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from glob import glob
+import numpy as np
+from tql.core import TqlResults, get_sector_label
+from tql.index import (
+    read_tls_scalars,
+    build_index,
+    load_index,
+    get_index_row,
+    append_to_index,
+)
+
+PLOTS_DIR = os.path.join(os.path.dirname(__file__), "..", "plots")
+
+
+def test_read_tls_scalars():
+    fp = os.path.join(PLOTS_DIR, "tic52368076_s1_pdcsap_sc_tls.h5")
+    row = read_tls_scalars(fp)
+    assert row["filename"] == fp
+    assert row["ticid"] == 52368076
+    assert row["sectors"] == "1"
+    assert row["lctype"] == "pdcsap" and row["cadence"] == "short"
+    assert np.isfinite(row["SDE"])
+    assert row["period"] > 0
+
+
+def test_build_index(tmp_path):
+    for fp in glob(os.path.join(PLOTS_DIR, "*_tls.h5")):
+        shutil.copy(fp, tmp_path)
+    df = build_index(str(tmp_path), verbose=False)
+    assert len(df) == 2
+    # incremental: nothing new to read
+    df = build_index(str(tmp_path), verbose=False)
+    assert len(df) == 2
+    index_fp = os.path.join(str(tmp_path), "tql_index.h5")
+    df = load_index(index_fp, where="SDE > 20")
+    assert len(df) == 1
+    assert df.ticid[0] == 192826603
+
+
+def test_index_row_rejected(tmp_path):
+    # targets rejected by the BLS triage: no tls_results and no h5 file
+    rows = []
+    for ticid in [1, 2, 3]:
+        results = TqlResults(
+            ticid=ticid,
+            gaiaid=2,
+            sector=3,
+            lctype="pdcsap",
+            cadence="short",
+            tls_results=None,
+            bls_results={"bls_SDE": 5.0, "bls_period": 2.5 * ticid},
+        )
+        rows.append(get_index_row(results, None))
+    row = rows[0]
+    assert np.isnan(row["SDE"]) and row["bls_SDE"] == 5.0
+    assert row["filename"] == ""
+    assert row["nsectors"] == 1 and row["sectors"] == "3"
+    index_fp = os.path.join(str(tmp_path), "tql_index.h5")
+    append_to_index(rows, index_fp)
+    df = load_index(index_fp, where="bls_SDE < 7")
+    assert df.ticid.tolist() == [1, 2, 3]
+    assert df.bls_period.tolist() == [2.5, 5.0, 7.5]
+    # a target run again keeps only its latest row
+    append_to_index([dict(rows[0], bls_period=3.0)], index_fp)
+    df = load_index(index_fp, columns=["ticid", "bls_period"])
+    assert df.columns.tolist() == ["ticid", "bls_period"]
+    assert sorted(df.bls_period) == [3.0, 5.0, 7.5]
+
+
+def test_sector_label():
+    results = TqlResults(
+        ticid=1, gaiaid=2, sector=1, tls_results=None, bls_results={}
+    )
+    assert get_sector_label(results) == 1
+    results.update(sectors=list(range(1, 14)))
+    assert get_sector_label(results) == "1-13"
+    assert get_index_row(results)["nsectors"] == 13
+    results.update(sectors=[13, 1])
+    assert get_sector_label(results) == "1,13"
+    results.update(sectors=[1, 2, 3, 5, 7, 8])
+    assert get_sector_label(results) == "1-3,5,7-8"
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import zipfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+from tql.prefetch import Download, Prefetcher, fetch
+
+NBYTES = 1000
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """
+    local stand-in of the archive which records concurrent requests
+    """
+
+    lock = threading.Lock()
+    nactive = 0
+    max_active = 0
+
+    def do_GET(self):
+        with Handler.lock:
+            Handler.nactive += 1
+            Handler.max_active = max(Handler.max_active, Handler.nactive)
+        time.sleep(0.05)
+        try:
+            super().do_GET()
+        finally:
+            with Handler.lock:
+                Handler.nactive -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "archive"
+    root.mkdir()
+    for n in range(6):
+        for kind in ["lc", "tp"]:
+            (root / f"tic{n}_{kind}.fits").write_bytes(os.urandom(NBYTES))
+    with zipfile.ZipFile(root / "cutout.zip", "w") as archive:
+        archive.writestr("tess-s0001-1-1_1.0_2.0_12x12_astrocut.fits", "x")
+    Handler.max_active = 0
+    httpd = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(Handler, directory=str(root))
+    )
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_fetch(server, tmp_path):
+    fp = str(tmp_path / "cache" / "a" / "tic0_lc.fits")
+    assert fetch(f"{server}/tic0_lc.fits", fp) == [fp]
+    assert os.path.getsize(fp) == NBYTES
+    # cached
+    assert fetch(f"{server}/tic0_lc.fits", fp) == []
+    outdir = str(tmp_path / "cache" / "tesscut")
+    paths = fetch(f"{server}/cutout.zip", outdir, unzip=True)
+    assert [os.path.basename(p) for p in paths] == [
+        "tess-s0001-1-1_1.0_2.0_12x12_astrocut.fits"
+    ]
+    assert not any(f.endswith(".part") for f in os.listdir(outdir))
+
+
+def test_prefetcher(server, tmp_path):
+    targets = [{"ticid": n} for n in range(6)]
+
+    def resolver(target):
+        n = target["ticid"]
+        return [
+            Download(f"{server}/tic{n}_{kind}.fits", f"{kind}/tic{n}.fits")
+            for kind in ["lc", "tp"]
+        ]
+
+    cache = str(tmp_path / "cache")
+    with Prefetcher(
+        resolver,
+        download_dir=cache,
+        ahead=2,
+        max_workers=2,
+        max_bytes=NBYTES,
+        delete_released=True,
+        key=lambda target: target["ticid"],
+    ) as prefetcher:
+        prefetcher.start(targets[1:])
+        assert prefetcher.wait(timeout=10)
+        # only the next two targets are fetched, and downloads wait once
+        # the budget is exceeded (by at most one file per worker)
+        assert prefetcher.nscheduled == 2
+        assert prefetcher.ndownloaded < 4
+        assert prefetcher.pending_bytes <= 3 * NBYTES
+        assert Handler.max_active <= 2
+        for target in targets:
+            prefetcher.release(target["ticid"])
+            assert prefetcher.wait(timeout=10)
+    assert prefetcher.errors == []
+    assert prefetcher.nscheduled == 5
+    assert prefetcher.pending_bytes == 0
+    # released files are deleted
+    assert os.listdir(os.path.join(cache, "lc")) == []
+
+
+def test_resolve_object_fallback(monkeypatch):
+    import lightkurve.search
+    from astroquery.mast import Observations
+    from tql import prefetch
+
+    monkeypatch.delattr(lightkurve.search, "_resolve_object", raising=False)
+    monkeypatch.setattr(Observations, "resolve_object", lambda name: name)
+    assert prefetch.resolve_object("TIC 1") == "TIC 1"
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+from glob import glob
+
+from tql.profiling import STAGES
+
+TQL_DIR = os.path.join(os.path.dirname(__file__), "..", "tql")
+
+
+def test_stages():
+    # every timed stage can be profiled (choices of tql --profile)
+    stages = set()
+    for fp in glob(os.path.join(TQL_DIR, "*.py")):
+        with open(fp) as f:
+            stages.update(re.findall(r"\.stage\(\"(\w+)\"", f.read()))
+    assert {"bls", "stitch"} <= stages
+    assert stages <= set(STAGES)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import lightkurve as lk
+from astropy.timeseries import LombScargle
+from tql.rotation import (
+    get_frequency_grid,
+    get_rotation_periodogram,
+    get_rotation_periodograms,
+    get_shared_time_powers,
+)
+
+# sinusoidal rotation signal without transits
+ROTATION_LC = dict(
+    cadence=10 / 60 / 24,
+    rot_amp=5e-3,
+    evolving_spots=False,
+    depth=0,
+    noise=1e-3,
+)
+
+
+def test_rotation_periodogram(make_lc):
+    time, flux, _ = make_lc(Prot=3.7, **ROTATION_LC)
+    ls_results = get_rotation_periodogram(time, flux)
+    assert abs(ls_results["Prot_ls"] - 3.7) < 3 * ls_results["Prot_ls_err"]
+    assert abs(ls_results["amp_ls"] - 5e-3) < 3 * ls_results["amp_ls_err"]
+
+
+def test_shared_time_powers(make_lc):
+    fluxes, lcs = [], []
+    for n, Prot in enumerate([1.3, 3.7, 6.1]):
+        time, flux, _ = make_lc(Prot=Prot, seed=n, **ROTATION_LC)
+        fluxes.append(flux)
+        lcs.append(lk.LightCurve(time=time, flux=flux))
+    frequency = get_frequency_grid(int(time[-1] - time[0]))
+    powers = get_shared_time_powers(time, fluxes, frequency)
+    for flux, power in zip(fluxes, powers):
+        expected = LombScargle(time, flux).power(
+            frequency, method="fast", assume_regular_frequency=True
+        )
+        assert np.allclose(power, expected)
+    # lightcurves with different masks are also supported
+    mask = np.zeros(len(time), dtype=bool)
+    mask[:100] = True
+    ls_results = get_rotation_periodograms(lcs, masks=[None, mask, None])
+    Prots = [r["Prot_ls"] for r in ls_results]
+    assert np.allclose(Prots, [1.3, 3.7, 6.1], rtol=0.05)
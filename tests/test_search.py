@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import lightkurve as lk
+from tql.index import BLS_COLUMNS
+from tql.search import (
+    bin_lc,
+    get_peak_indices,
+    get_tls_results_fast,
+    get_bls_results,
+    passes_triage,
+)
+
+
+def make_flat(period=3.1):
+    rng = np.random.default_rng(1)
+    time = np.arange(0, 13, 2 / 60 / 24)
+    flux = 1 + rng.normal(0, 1e-3, len(time))
+    flux[
+        np.abs((time - 0.5 + period / 2) % period - period / 2) < 0.06
+    ] -= 3e-3
+    return lk.LightCurve(
+        time=time, flux=flux, flux_err=np.full_like(time, 1e-3)
+    )
+
+
+def test_bin_lc():
+    flat = make_flat()
+    binned = bin_lc(flat, bin_minutes=10)
+    assert len(binned.time) == int(np.ceil(len(flat.time) / 5))
+    assert np.allclose(binned.flux_err, 1e-3 / np.sqrt(5))
+    # long cadence is not binned further
+    assert bin_lc(binned, bin_minutes=10) is binned
+
+
+def test_get_peak_indices():
+    power = np.array([0, 5, 4, 0, 1, 0, 0, 3, 0])
+    assert get_peak_indices(power, npeaks=2, width=1) == [1, 7]
+    assert get_peak_indices(power, npeaks=3, width=1) == [1, 7, 4]
+
+
+def test_fast_search():
+    tls_results = get_tls_results_fast(make_flat(), npeaks=2)
+    assert abs(tls_results.period - 3.1) < 0.01
+    assert tls_results.SDE > 9
+
+
+def test_bls_triage():
+    bls_results = get_bls_results(make_flat(), period_min=0.5)
+    assert list(bls_results) == BLS_COLUMNS
+    assert abs(bls_results["bls_period"] - 3.1) < 0.02
+    assert bls_results["bls_SDE"] > 7
+    assert bls_results["bls_depth"] > 0
+
+
+def test_degenerate_triage():
+    # no dimming box: all-zero periodogram
+    time = np.arange(0, 13, 10 / 60 / 24)
+    flat = lk.LightCurve(
+        time=time, flux=np.ones_like(time), flux_err=np.full_like(time, 1e-3)
+    )
+    bls_results = get_bls_results(flat, period_min=0.5)
+    assert np.isnan(bls_results["bls_SDE"])
+    assert not passes_triage(bls_results)
+    assert not passes_triage(dict(bls_SDE=10, bls_snr=np.nan))
+    assert passes_triage(dict(bls_SDE=10, bls_snr=8))
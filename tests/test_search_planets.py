@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import numpy as np
+import lightkurve as lk
+from tql import core
+from tql.core import search_planets, get_candidate_row, CANDIDATE_COLUMNS
+
+
+def test_search_planets():
+    rng = np.random.default_rng(1)
+    time = np.arange(0, 27, 30 / 60 / 24)
+    flux = 1 + rng.normal(0, 3e-4, len(time))
+    for P, t0, dur, depth in [(3.1, 0.5, 0.12, 3e-3), (7.3, 2.0, 0.15, 2e-3)]:
+        flux[np.abs((time - t0 + P / 2) % P - P / 2) < dur / 2] -= depth
+    flat = lk.LightCurve(
+        time=time, flux=flux, flux_err=np.full_like(time, 3e-4)
+    )
+    grid_cache = {}
+    candidates = search_planets(
+        flat, max_planets=4, grid_cache=grid_cache, verbose=False
+    )
+    periods = sorted(c.period for c in candidates)
+    assert len(periods) == 2
+    assert np.allclose(periods, [3.1, 7.3], atol=0.05)
+    # all searches share the period grid of the first one
+    assert len(grid_cache["periods"]) > 0
+    row = get_candidate_row(candidates[0])
+    assert list(row) == CANDIDATE_COLUMNS
+
+
+def test_grid_cache(monkeypatch):
+    assert core.HAS_TLS_GRIDS
+    rng = np.random.default_rng(2)
+    time = np.arange(0, 10, 30 / 60 / 24)
+    flux = 1 + rng.normal(0, 3e-4, len(time))
+    flat = SimpleNamespace(
+        time=time, flux=flux, flux_err=np.full_like(time, 3e-4)
+    )
+    calls = []
+
+    def duration_grid(periods, shortest, **kwargs):
+        calls.append(shortest)
+        return core_duration_grid(periods, shortest, **kwargs)
+
+    core_duration_grid = core.duration_grid
+    monkeypatch.setattr(core, "duration_grid", duration_grid)
+    grid_cache = {}
+    kwargs = dict(period_min=1, period_max=3, grid_cache=grid_cache)
+    _ = core.get_tls_results(flat, **kwargs)
+    periods = grid_cache["periods"]
+    half = SimpleNamespace(
+        time=time[::2], flux=flux[::2], flux_err=flat.flux_err[::2]
+    )
+    _ = core.get_tls_results(half, **kwargs)
+    assert grid_cache["periods"] is periods
+    # durations of the lightcurve searched
+    assert calls == [1 / len(half.time)]
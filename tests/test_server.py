@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from tql import server as tql_server
+from tql.server import TqlServer, _to_builtin
+
+
+def test_to_builtin():
+    assert _to_builtin(np.int64(3)) == 3
+    assert type(_to_builtin(np.float32(0.5))) is float
+    assert _to_builtin(np.nan) is None
+    assert _to_builtin("pdcsap") == "pdcsap"
+
+
+def test_server_round_trip(tmp_path):
+    socket_path = str(tmp_path / "tql.sock")
+    server = TqlServer(
+        outdir=str(tmp_path), results_cache_dir=None, warmup=False, verbose=0
+    )
+    with pytest.raises(ValueError):
+        server.parse_request({"ticid": 1, "unknown": 2})
+    with pytest.raises(ValueError):
+        server.parse_request({"sector": 1})
+    request = server.parse_request({"ticid": 1, "savefig": True})
+    assert request["outdir"] == str(tmp_path)
+
+    thread = threading.Thread(
+        target=server.serve, kwargs=dict(socket_path=socket_path)
+    )
+    thread.start()
+    for _ in range(100):
+        try:
+            status = tql_server.get_status(socket_path=socket_path)
+            break
+        except OSError:
+            time.sleep(0.1)
+    assert status["ncores"] == 1
+    assert status["served"] == 0
+    # rejected before reaching the workers
+    response = tql_server.submit(socket_path=socket_path, window=0.5)
+    assert response["status"] == "failed"
+    assert "unknown" in response["message"]
+    _ = tql_server.shutdown(socket_path=socket_path)
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+
+
+def _exit_worker(request):
+    if request.get("name") == "crash":
+        os._exit(1)
+    return {"target": request["name"], "status": "ok"}
+
+
+def test_worker_died(tmp_path, monkeypatch):
+    # the workers are forked after the patch
+    monkeypatch.setattr(tql_server, "_serve_target", _exit_worker)
+    server = TqlServer(
+        outdir=str(tmp_path), results_cache_dir=None, warmup=False, verbose=0
+    )
+    try:
+        response = server.run(server.parse_request({"name": "crash"}))
+        assert response["status"] == "failed"
+        assert response["target"] == "name crash"
+        assert "worker died" in response["message"]
+        # the pool is restarted
+        response = server.run(server.parse_request({"name": "ok"}))
+        assert response["status"] == "ok"
+        assert server.get_status()["served"] == 2
+    finally:
+        server.close()
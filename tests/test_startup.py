@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import subprocess
+
+import tql
+
+HEAVY_MODULES = [
+    "matplotlib",
+    "astropy",
+    "lightkurve",
+    "pandas",
+    "wotan",
+    "transitleastsquares",
+    "deepdish",
+    "chronos",
+]
+
+
+def test_light_imports():
+    # in a fresh interpreter: modules imported by the tests stay loaded
+    code = (
+        "import sys, json, tql, tql.batch, tql.server, tql.cache;"
+        f"print(json.dumps([m for m in {HEAVY_MODULES} if m in sys.modules]))"
+    )
+    root = os.path.dirname(os.path.dirname(tql.__file__))
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=root)
+    assert json.loads(out) == []
+
+
+def test_lazy_names():
+    assert "plot_tql" in dir(tql)
+    assert "run_tql" in tql.__all__
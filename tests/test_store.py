@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import warnings
+
+import numpy as np
+import pytest
+import tables
+from tql.store import ResultStore
+
+
+def test_store(tmp_path):
+    fp = str(tmp_path / "tql_results.h5")
+    periods = np.linspace(1, 10, 1000)
+    arrays = {
+        "periods": periods,
+        "power": np.sin(periods),
+        "time_raw": periods,
+    }
+    with ResultStore(fp, float32=True) as store:
+        for n, sde in enumerate([5, 15]):
+            row = {"ticid": n, "SDE": sde, "period": 2.0}
+            store.append(f"tic{n}_s1_pdcsap_sc", row, arrays)
+        # overwrite
+        store.append("tic1_s1_pdcsap_sc", {"ticid": 1, "SDE": 20}, arrays)
+    with ResultStore(fp, mode="r") as store:
+        assert len(store) == 2
+        df = store.get_scalars("SDE > 10 & ticid == 1")
+        assert len(df) == 1
+        assert df.name[0] == "tic1_s1_pdcsap_sc"
+        assert np.isnan(df.period[0])
+        power = store.get_array("tic1_s1_pdcsap_sc", "power", 0, 10)
+        assert power.dtype == np.float32
+        assert len(power) == 10
+        d = store.get("tic0_s1_pdcsap_sc")
+        # times are kept in float64
+        assert d["time_raw"].dtype == np.float64
+
+
+def test_store_stitched_names(tmp_path):
+    fp = str(tmp_path / "tql_results.h5")
+    sectors = ",".join(f"{s}-{s + 1}" for s in range(1, 40, 3))
+    name = f"tic52368076_s{sectors}_pdcsap_sc"
+    assert len(name) > 64
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", tables.NaturalNameWarning)
+        with ResultStore(fp) as store:
+            store.append(name, {"SDE": 5}, {"power": np.ones(10)})
+            store.append(name, {"SDE": 20}, {"power": np.zeros(10)})
+            store.append("tic1_s1_pdcsap_sc", {"SDE": 5}, {})
+            assert len(store) == 2
+            assert name in store
+            assert sorted(store.names()) == sorted([name, "tic1_s1_pdcsap_sc"])
+            df = store.get_scalars("SDE > 10")
+            assert list(df.name) == [name]
+            assert np.all(store.get_array(name, "power") == 0)
+            store.remove(name)
+            assert name not in store
+            assert len(store) == 1
+            with pytest.raises(ValueError):
+                store.append("tic1_s" + "1," * 200 + "_pdcsap_sc", {}, {})
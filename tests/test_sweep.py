@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from tql import sweep
+from tql.core import TqlResults
+from tql.sweep import parse_sweep_args, get_param_grid, run_sweep
+
+
+def test_parse_sweep_args():
+    grid = parse_sweep_args(
+        [
+            "flatten_method=biweight,median",
+            "window_length=0.3,0.5",
+            "sigma=10:3",
+        ]
+    )
+    assert grid["flatten_method"] == ["biweight", "median"]
+    assert grid["window_length"] == [0.3, 0.5]
+    assert grid["sigma"] == [(10.0, 3.0)]
+    with pytest.raises(AssertionError):
+        parse_sweep_args(["period=1,2"])
+
+
+def test_get_param_grid():
+    settings = get_param_grid({"aper_radius": [1, 2, 3], "sigma": [(10, 3)]})
+    assert len(settings) == 3
+    assert settings[0] == {"aper_radius": 1, "sigma": (10, 3)}
+
+
+def test_sweep_sectors():
+    with pytest.raises(ValueError):
+        run_sweep({"window_length": [0.3, 0.5]}, ticid=1, sectors="all")
+
+
+def test_run_sweep(tmp_path, monkeypatch):
+    calls = {"load_target": 0, "get_raw_lc": 0, "run_tql": []}
+    l = SimpleNamespace(ticid=1, sector=2)
+
+    def load_target(**kwargs):
+        calls["load_target"] += 1
+        return l, "pdcsap"
+
+    def get_raw_lc(l, lctype):
+        calls["get_raw_lc"] += 1
+        return "raw_lc"
+
+    def run_tql(target, raw_lc, **kwargs):
+        assert target == (l, "pdcsap") and raw_lc == "raw_lc"
+        calls["run_tql"].append(kwargs)
+        return TqlResults(SDE=10 * kwargs["window_length"], period=3.0)
+
+    monkeypatch.setattr(sweep, "load_target", load_target)
+    monkeypatch.setattr(sweep, "get_raw_lc", get_raw_lc)
+    monkeypatch.setattr(sweep, "run_tql", run_tql)
+    grid = {
+        "flatten_method": ["biweight", "median"],
+        "window_length": [0.5, 1],
+    }
+    df = run_sweep(
+        grid, outdir=str(tmp_path), verbose=False, ticid=1, lctype="pdcsap"
+    )
+    # the target and its lightcurve are loaded once
+    assert calls["load_target"] == 1
+    assert calls["get_raw_lc"] == 1
+    assert len(calls["run_tql"]) == 4
+    fp = tmp_path / "tic1_s2_pdcsap_sc_sweep.csv"
+    saved = pd.read_csv(fp)
+    assert len(saved) == 4
+    assert (saved.status == "ok").all()
+    assert saved.SDE.tolist() == df.SDE.tolist() == [5.0, 10.0, 5.0, 10.0]
+    assert saved.flatten_method.tolist() == ["biweight"] * 2 + ["median"] * 2
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import lightkurve as lk
+
+from tql.core import TqlResults
+from tql.fold import fold_phase
+from tql.template import FigureTemplate, decimate
+
+
+def make_results(seed, period, ndays=27):
+    rng = np.random.default_rng(seed)
+    time = np.arange(1325.3, 1325.3 + ndays, 2 / 60 / 24)
+    flux = rng.normal(1, 1e-3, len(time))
+    phase, _ = fold_phase(time, period, 1326.0)
+    in_transit = np.abs(phase) < 0.05 / period
+    flux[in_transit] -= 5e-3
+    lc = lk.LightCurve(time=time, flux=flux, flux_err=np.full_like(time, 1e-3))
+    periods = np.linspace(0.5, 13, 500)
+    tls_results = TqlResults(
+        period=period,
+        T0=1326.0,
+        duration=0.1,
+        depth=1 - 5e-3,
+        periods=periods,
+        power=np.exp(-((periods - period) ** 2)) * 20,
+        model_folded_phase=np.linspace(0, 1, 1000),
+        model_folded_model=np.ones(1000),
+    )
+    return TqlResults(
+        ticid=seed,
+        sector=1,
+        lctype="pdcsap",
+        cadence="short",
+        lc=lc,
+        flat=lc,
+        trend=lc,
+        rot_mask=np.zeros(len(time), dtype=bool),
+        rot_masked=False,
+        transit_mask=in_transit,
+        ls_periods=periods,
+        ls_powers=np.exp(-((periods - 5) ** 2)),
+        ls_model=(np.linspace(-0.5, 0.5, 100), np.ones(100)),
+        Prot_ls=5.0,
+        tls_results=tls_results,
+        period_min=0.5,
+        period_max=13,
+        bin_hr=0.5,
+    )
+
+
+def test_decimate():
+    (x,) = decimate(np.arange(100), max_points=10)
+    assert len(x) == 10
+
+
+def test_template_reused(tmp_path):
+    template = FigureTemplate(max_points=5000)
+    for seed, period in [(1, 3.0), (2, 7.5)]:
+        results = make_results(seed, period)
+        # summary and title need the stellar parameters
+        template.update(results, summary="summary", title=f"TIC {seed}")
+        template.savefig(str(tmp_path / f"tic{seed}.png"))
+        # decimated
+        assert len(template.raw.get_xdata()) <= 5000
+        assert template.tls_peak.get_xdata()[0] == period
+        assert template.title.get_text() == f"TIC {seed}"
+    assert template.nrendered == 2
+    assert (tmp_path / "tic2.png").exists()
+    # only the folded window is drawn
+    xlim = 1.5 * 0.1 / 7.5
+    assert np.all(np.abs(template.fold.get_xdata()) <= xlim)
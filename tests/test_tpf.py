@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from tql.tpf import (
+    TpfCube,
+    get_threshold_mask,
+    get_aperture_mask,
+    get_background_mask,
+)
+from tql.aperture import get_contratios
+
+NCADENCES, NY, NX = 500, 7, 9
+# WCS of the FLUX column (3), 21 arcsec pixels
+WCS_HEADER = {
+    "1CTYP3": "RA---TAN",
+    "2CTYP3": "DEC--TAN",
+    "1CRPX3": 5.0,
+    "2CRPX3": 4.0,
+    "1CRVL3": 30.0,
+    "2CRVL3": -20.0,
+    "1CDLT3": -21 / 3600,
+    "2CDLT3": 21 / 3600,
+}
+
+
+def make_tpf_file(fp, ncadences=NCADENCES, ny=NY, nx=NX):
+    rng = np.random.default_rng(0)
+    shape = (ncadences, ny, nx)
+    flux = rng.normal(100, 5, shape).astype(np.float32)
+    flux[:, 3, 4] += 1000
+    flux[10, 0, 0] = np.nan
+    flux_err = np.full(shape, 2, dtype=np.float32)
+    time = 1325.3 + np.arange(ncadences) * 2 / 60 / 24
+    fmt, dim = f"{ny * nx}E", f"({nx},{ny})"
+    cols = [
+        fits.Column("TIME", "D", array=time),
+        fits.Column("QUALITY", "J", array=np.zeros(ncadences, dtype=int)),
+        fits.Column("FLUX", fmt, dim=dim, array=flux),
+        fits.Column("FLUX_ERR", fmt, dim=dim, array=flux_err),
+    ]
+    table = fits.BinTableHDU.from_columns(cols)
+    table.header.update(WCS_HEADER)
+    hdul = fits.HDUList([fits.PrimaryHDU(), table])
+    hdul.writeto(fp)
+    return time, flux, flux_err
+
+
+def test_tpf_cube(tmp_path):
+    fp = str(tmp_path / "tpf.fits")
+    time, flux, flux_err = make_tpf_file(fp)
+    quality_mask = np.ones(NCADENCES, dtype=bool)
+    quality_mask[::7] = False
+    # a few cadences per chunk
+    cube = TpfCube(fp, quality_mask=quality_mask, chunk_bytes=5000)
+    assert cube.shape == (quality_mask.sum(), NY, NX)
+    aper_mask = np.zeros((NY, NX), dtype=bool)
+    aper_mask[2:5, 3:6] = True
+    t, f, e = cube.get_aperture_lc(aper_mask)
+    assert np.allclose(t, time[quality_mask])
+    expected = np.nansum(flux[quality_mask][:, aper_mask], axis=1)
+    assert np.allclose(f, expected, rtol=1e-6)
+    assert np.allclose(e, 2 * 3)
+    median_image = cube.get_median_image()
+    assert np.allclose(median_image, np.nanmedian(flux[quality_mask], axis=0))
+    assert np.allclose(cube.get_frame(0), flux[1])
+    mask = get_threshold_mask(median_image, threshold_sigma=5)
+    assert np.argwhere(mask).tolist() == [[3, 4]]
+    # lightkurve's convention is 1-based
+    assert np.allclose(cube.wcs.wcs.crpix, [5, 4])
+
+
+def test_cube_peak_memory(tmp_path):
+    fp = str(tmp_path / "tesscut.fits")
+    _ = make_tpf_file(fp, ncadences=4000, ny=30, nx=30)
+    chunk_bytes = 2**20
+    cube = TpfCube(fp, chunk_bytes=chunk_bytes)
+    # target and a source 2 mag fainter in the same pixel
+    ra, dec = cube.wcs.all_pix2world([[4.0, 3.0], [4.2, 3.1]], 0).T
+    gaia_sources = pd.DataFrame(
+        {"ra": ra, "dec": dec, "phot_g_mean_mag": [10.0, 12.0]}
+    )
+    tracemalloc.start()
+    # aperture, contamination and background-subtracted lightcurve as in
+    # core.get_custom_lc and core.get_contratio
+    mask = get_aperture_mask(None, sap_mask="threshold", cube=cube)
+    contratio = get_contratios(cube, [mask], gaia_sources)[0]
+    bkg_mask = get_background_mask(cube.get_median_image(), mask)
+    _ = cube.get_aperture_lc(mask, bkg_mask)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert np.argwhere(mask).tolist() == [[3, 4]]
+    assert np.isclose(contratio, 10 ** (-0.8))
+    # a few chunks, not the float cube
+    assert peak < 4000 * 30 * 30 * 8 / 3
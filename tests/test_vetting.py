@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from glob import glob
+
+import numpy as np
+
+from tql.vetting import (
+    get_vetting_metrics,
+    get_rotation_harmonic,
+    vet_tls_results,
+    vet_files,
+    run_vetting,
+)
+
+PLOTS_DIR = os.path.join(os.path.dirname(__file__), "..", "plots")
+PERIOD, T0, DURATION = 3.0, 1.0, 0.12
+# box transits without rotation
+VETTING_LC = dict(
+    tstart=0,
+    rot_amp=0,
+    period=PERIOD,
+    t0=T0,
+    duration=DURATION,
+    depth=5e-3,
+    ingress=0,
+)
+
+
+def test_planet(make_lc):
+    time, flux, _ = make_lc(**VETTING_LC)
+    d = get_vetting_metrics(time, flux, PERIOD, T0, DURATION)[0]
+    assert np.isclose(d["depth_even"], 5e-3, rtol=0.1)
+    assert d["odd_even_sigma"] < 3
+    assert abs(d["secondary_snr"]) < 3
+    assert d["shape"] > 0.8
+    assert d["ntransits"] == 9
+    assert d["transit_snr_max_frac"] < 0.3
+    assert d["flags"] == ""
+
+
+def test_eclipsing_binary(make_lc):
+    time, flux, _ = make_lc(**VETTING_LC, odd_depth=1e-2, secondary=2e-3)
+    d = get_vetting_metrics(time, flux, PERIOD, T0, DURATION)[0]
+    assert np.isclose(d["depth_odd"], 1e-2, rtol=0.1)
+    assert d["odd_even_sigma"] > 10
+    assert d["secondary_snr"] > 10
+    assert "odd_even" in d["flags"]
+    assert "secondary" in d["flags"]
+    time, flux, _ = make_lc(**dict(VETTING_LC, ingress=0.5))
+    d = get_vetting_metrics(time, flux, PERIOD, T0, DURATION)[0]
+    assert d["shape"] < 0.5
+    assert "v_shape" in d["flags"]
+
+
+def test_single_event(make_lc):
+    time, flux, _ = make_lc(**dict(VETTING_LC, depth=2e-2), single_cycle=3)
+    d = get_vetting_metrics(time, flux, PERIOD, T0, DURATION)[0]
+    assert d["transit_snr_max_frac"] > 0.7
+    assert d["transit_snr_chi2"] > 10
+    assert "single_event" in d["flags"]
+
+
+def test_rotation_harmonic(make_lc):
+    ratio, harmonic = get_rotation_harmonic([3.0, 6.03, 1.5, 4.1], 3.0)
+    assert np.allclose(ratio, [1, 2.01, 0.5, 4.1 / 3])
+    assert harmonic.tolist() == [True, True, True, False]
+    time, flux, _ = make_lc(**VETTING_LC)
+    d = get_vetting_metrics(time, flux, PERIOD, T0, DURATION, Prot=1.5)[0]
+    assert d["rotation_harmonic"]
+    assert "rotation" in d["flags"]
+
+
+def test_vet_tls_results(make_lc):
+    time, flux, _ = make_lc(**VETTING_LC, odd_depth=1e-2)
+    candidates = [
+        dict(SDE=20, period=PERIOD, T0=T0, duration=DURATION, depth=0.995),
+        dict(SDE=8, period=5.0, T0=2.0, duration=0.1, depth=0.999),
+    ]
+    tls_results = dict(
+        ticid=1,
+        sector=2,
+        time_flat=time,
+        flux_flat=flux,
+        Prot_ls=(10.0, 0.5),
+        candidates=candidates,
+    )
+    rows = vet_tls_results(tls_results)
+    assert [r["candidate"] for r in rows] == [0, 1]
+    assert rows[0]["Prot_ls"] == 10
+    assert "odd_even" in rows[0]["flags"]
+    assert rows[1]["SDE"] == 8
+
+
+def test_vet_files(tmp_path):
+    # saved without the flattened lightcurve
+    files = sorted(glob(os.path.join(PLOTS_DIR, "*_tls.h5")))
+    df = vet_files(files)
+    assert len(df) == len(files)
+    assert np.all(np.isfinite(df.odd_even_sigma))
+    assert np.all(np.isfinite(df.shape))
+    for fp in files:
+        shutil.copy(fp, tmp_path)
+    df = run_vetting(str(tmp_path), ncores=2, verbose=False)
+    assert len(df) == len(files)
+    assert os.path.exists(os.path.join(str(tmp_path), "tql_vetting.csv"))
+
+
+def test_vet_store(tmp_path, make_lc):
+    from tql.store import ResultStore
+
+    fp = str(tmp_path / "tql_results.h5")
+    time, flux, _ = make_lc(**VETTING_LC, odd_depth=1e-2)
+    row = dict(ticid=1, SDE=20, period=PERIOD, T0=T0, duration=DURATION)
+    with ResultStore(fp) as store:
+        store.append(
+            "tic1_s1_pdcsap_sc", row, dict(time_flat=time, flux_flat=flux)
+        )
+    df = run_vetting(str(tmp_path), verbose=False)
+    assert len(df) == 1
+    assert df.ticid[0] == 1
+    assert "odd_even" in df["flags"][0]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import time
+from tql.writers import WriterPool
+from tql.profiling import StageTimer
+
+
+def write_file(task):
+    fp, text = task
+    time.sleep(0.01)
+    with open(fp, "w") as f:
+        f.write(text)
+    return {"fp": fp, "pid": os.getpid()}
+
+
+def test_writer_pool(tmp_path):
+    rows = []
+    pool = WriterPool(write_file, callback=rows.append, nworkers=2, maxsize=1)
+    for n in range(10):
+        # blocks while a task is waiting
+        pool.put((str(tmp_path / f"{n}.txt"), str(n)))
+    pool.close()
+    assert len(rows) == pool.ndone == 10
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        f"{n}.txt" for n in range(10)
+    )
+    assert all(row["pid"] != os.getpid() for row in rows)
+
+
+def test_stage_timer_pickled():
+    timings = StageTimer(profile_stage="tls_power")
+    with timings.stage("tls_power"):
+        _ = sum(range(1000))
+    timings = pickle.loads(pickle.dumps(timings))
+    with timings.stage("plotting"):
+        pass
+    d = timings.to_dict()
+    assert list(d["stages"]) == ["tls_power", "plotting"]
+    assert "sum" in d["profile"]
+    assert d["total_wall"] >= d["stages"]["tls_power"]["wall"]
@@ -1,3 +1,45 @@
 # -*- coding: utf-8 -*-
+"""
+TESS QuickLook. The analysis (tql.core) and plotting (tql.tql) functions
+are imported on first access, so that importing the package or one of its
+light modules (e.g. tql.batch, tql.server) does not load matplotlib,
+astropy, lightkurve, wotan, tls or chronos.
+"""
 
-from .tql import *
+import importlib
+
+# public names of the package and the module defining them
+_LAZY = {
+    "run_tql": "tql.core",
+    "get_output_prefix": "tql.core",
+    "save_timings": "tql.core",
+    "get_results_gls": "tql.core",
+    "plot_tql": "tql.tql",
+    "render_tql": "tql.tql",
+    "plot_raw_trend": "tql.tql",
+    "plot_ls_periodogram": "tql.tql",
+    "plot_rotation_fold": "tql.tql",
+    "plot_tls_periodogram": "tql.tql",
+    "plot_flat_lc": "tql.tql",
+    "plot_folded_lc": "tql.tql",
+    "plot_odd_even": "tql.tql",
+    "plot_tpf": "tql.tql",
+    "plot_summary": "tql.tql",
+    "get_summary_text": "tql.tql",
+    "get_title": "tql.tql",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        # also lets `from tql import batch` fall back to the submodule
+        raise AttributeError(f"module 'tql' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Custom lightcurves of many apertures of one target from a single read of
+its tpf.
+
+Checking a candidate for contamination means comparing e.g. square r=1,
+r=2, round, percentile 90 and threshold 5 apertures of the same star. Here
+the masks of all apertures are made from the same (memory-mapped) cube and
+summed in one pass over its cadences as a batched matrix product, giving an
+(naperture, ncadences) stack of lightcurves. The contamination ratio of
+every aperture is computed from the same Gaia source list.
+"""
+
+import numpy as np
+import lightkurve as lk
+
+from tql.config import CATALOG_CACHE_DIR
+from tql.tpf import (
+    get_tpf_cube,
+    get_aperture_mask,
+    get_background_mask,
+    sum_apertures,
+)
+
+# parameter of sap_mask set by the number in an aperture spec
+SPEC_PARAMS = {
+    "square": ("aper_radius", int),
+    "round": ("aper_radius", int),
+    "percentile": ("percentile", float),
+    "threshold": ("threshold_sigma", float),
+}
+SAP_MASKS = ["pipeline", "all"] + list(SPEC_PARAMS)
+
+
+def parse_aperture_spec(spec):
+    """
+    Parse an aperture spec, e.g. "square:2", "round:1", "percentile:90",
+    "threshold:5" or "pipeline"
+
+    Returns
+    -------
+    aperture : dict
+        sap_mask and its parameter (keyword arguments of
+        tpf.get_aperture_mask)
+    """
+    if isinstance(spec, dict):
+        return dict(spec)
+    sap_mask, _, value = spec.partition(":")
+    errmsg = f"sap_mask should be one of {SAP_MASKS}"
+    assert sap_mask in SAP_MASKS, errmsg
+    aperture = {"sap_mask": sap_mask}
+    if sap_mask in SPEC_PARAMS:
+        assert value != "", f"no value given for {sap_mask}"
+        key, kind = SPEC_PARAMS[sap_mask]
+        aperture[key] = kind(value)
+    return aperture
+
+
+def get_aperture_label(aperture):
+    """
+    e.g. square:2 for {"sap_mask": "square", "aper_radius": 2}
+    """
+    sap_mask = aperture["sap_mask"]
+    if sap_mask not in SPEC_PARAMS:
+        return sap_mask
+    key, _ = SPEC_PARAMS[sap_mask]
+    return f"{sap_mask}:{aperture[key]}"
+
+
+def get_aperture_masks(tpf, apertures, cube=None):
+    """
+    masks of several apertures of a tpf; the median image needed by
+    threshold and percentile masks is computed only once
+
+    Parameters
+    ----------
+    apertures : list
+        aperture specs (see parse_aperture_spec)
+    cube : tpf.TpfCube
+        memory-mapped cube of tpf (default=tpf.get_tpf_cube)
+
+    Returns
+    -------
+    masks : array of bool (naper, ny, nx)
+    """
+    cube = get_tpf_cube(tpf) if cube is None else cube
+    return np.array(
+        [
+            get_aperture_mask(tpf, cube=cube, **parse_aperture_spec(spec))
+            for spec in apertures
+        ],
+        dtype=bool,
+    )
+
+
+def get_contratios(tpf, masks, gaia_sources):
+    """
+    flux contamination ratio of the gaia sources within each mask, as
+    chronos' get_fluxes_within_mask: sum of the flux of the sources in the
+    mask relative to the brightest one, minus 1. Each source is assigned to
+    the pixel containing it, so that all masks are evaluated at once.
+
+    Parameters
+    ----------
+    tpf : lightkurve.TargetPixelFile or tpf.TpfCube
+        only its wcs is used
+    masks : array of bool (naper, ny, nx)
+    gaia_sources : pandas.DataFrame
+        with ra, dec and phot_g_mean_mag
+
+    Returns
+    -------
+    contratio : array (naper,)
+    """
+    masks = np.asarray(masks, dtype=bool)
+    _, ny, nx = masks.shape
+    radec = gaia_sources[["ra", "dec"]].values
+    x, y = tpf.wcs.all_world2pix(radec, 0).T
+    ix, iy = np.round(x).astype(int), np.round(y).astype(int)
+    on_tpf = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    gmag = gaia_sources["phot_g_mean_mag"].values[on_tpf]
+    # (naper, nsources) sources within each mask
+    inside = masks[:, iy[on_tpf], ix[on_tpf]] & np.isfinite(gmag)
+    min_gmag = np.where(inside, gmag, np.inf).min(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore"):
+        gamma = np.where(inside, 10 ** (0.4 * (min_gmag - gmag)), 0.0)
+    contratio = gamma.sum(axis=1) - 1
+    # no source in mask
+    contratio[~inside.any(axis=1)] = np.nan
+    return contratio
+
+
+def get_aperture_lcs(
+    tpf, apertures, gaia_sources=None, subtract_bkg=False, cube=None
+):
+    """
+    Custom lightcurves of several apertures from one read of the tpf
+
+    Parameters
+    ----------
+    tpf : lightkurve.TargetPixelFile
+        tpf or TESSCut cutout
+    apertures : list
+        aperture specs, e.g. ["square:1", "square:2", "round:1",
+        "percentile:90", "threshold:5"] (see parse_aperture_spec)
+    gaia_sources : pandas.DataFrame
+        Gaia sources around the target used for the contamination ratio
+        of every aperture (None=not computed)
+    subtract_bkg : bool
+        subtract the median of the faint pixels outside each aperture
+        (e.g. TESSCut cutouts which are not background-subtracted)
+    cube : tpf.TpfCube
+        memory-mapped cube of tpf (default=tpf.get_tpf_cube; if the tpf
+        cannot be mapped, tpf.flux is read once)
+
+    Returns
+    -------
+    aperture_lcs : dict
+        apertures (labels), masks (naper, ny, nx), time (ncadences,),
+        flux & flux_err (naper, ncadences) and contratio (naper,)
+    """
+    apertures = [parse_aperture_spec(spec) for spec in apertures]
+    cube = get_tpf_cube(tpf) if cube is None else cube
+    masks = get_aperture_masks(tpf, apertures, cube=cube)
+    if cube is None:
+        flux, flux_err = np.asarray(tpf.flux), np.asarray(tpf.flux_err)
+        median_image = np.nanmedian(flux, axis=0)
+    else:
+        median_image = cube.get_median_image() if subtract_bkg else None
+    bkg_masks = None
+    if subtract_bkg:
+        bkg_masks = [get_background_mask(median_image, m) for m in masks]
+    if cube is None:
+        time = np.asarray(tpf.time)
+        flux, flux_err = sum_apertures(flux, flux_err, masks, bkg_masks)
+    else:
+        time, flux, flux_err = cube.get_aperture_lcs(masks, bkg_masks)
+    contratio = None
+    if gaia_sources is not None:
+        contratio = get_contratios(tpf, masks, gaia_sources)
+    return dict(
+        apertures=[get_aperture_label(a) for a in apertures],
+        masks=masks,
+        time=time,
+        flux=flux,
+        flux_err=flux_err,
+        contratio=contratio,
+    )
+
+
+def to_lightcurves(aperture_lcs):
+    """
+    lightcurve of each aperture of get_aperture_lcs (without nans)
+
+    Returns
+    -------
+    lcs : list of lightkurve.LightCurve
+    """
+    time = aperture_lcs["time"]
+    lcs = []
+    for flux, flux_err in zip(aperture_lcs["flux"], aperture_lcs["flux_err"]):
+        idx = np.isfinite(time) & np.isfinite(flux) & np.isfinite(flux_err)
+        lcs.append(
+            lk.LightCurve(
+                time=time[idx], flux=flux[idx], flux_err=flux_err[idx]
+            )
+        )
+    return lcs
+
+
+def get_target_aperture_lcs(
+    l,
+    apertures,
+    cadence="short",
+    nearby_gaia_radius=120,
+    cache_dir=CATALOG_CACHE_DIR,
+    offline=False,
+):
+    """
+    get_aperture_lcs of a chronos target (see core.load_target); the
+    background of TESSCut cutouts (cadence=long) is subtracted
+
+    Returns
+    -------
+    aperture_lcs : dict
+        see get_aperture_lcs
+    """
+    from tql.core import get_tpf, get_cube, query_gaia_sources, _get_cache
+
+    tpf = get_tpf(l, cadence)
+    cache = _get_cache(cache_dir, offline)
+    gaia_sources = query_gaia_sources(
+        l, radius=nearby_gaia_radius, cache=cache
+    )
+    return get_aperture_lcs(
+        tpf,
+        apertures,
+        gaia_sources=gaia_sources,
+        subtract_bkg=cadence == "long",
+        cube=get_cube(l, cadence),
+    )
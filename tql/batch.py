@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""
+Run tql over a list of targets using a bounded pool of persistent workers.
+
+Each worker process is started once, imports the heavy dependencies once
+and then stays alive across targets. Progress is appended to a status file
+so that an interrupted run can be resumed. Optionally, figures and tls
+results are written by a separate pool of writer processes fed by a bounded
+queue (see tql.writers) so that workers go on with the next search.
+"""
+
+import os
+import csv
+import threading
+import traceback
+import multiprocessing as mp
+from functools import partial
+from time import time as timer
+
+from tql.prefetch import Prefetcher, get_mast_downloads
+from tql.writers import WriterPool
+
+ID_TYPES = ["tic", "toi", "gaia"]
+STATUS_COLUMNS = ["target", "status", "runtime", "message"]
+DONE_STATUS = ["ok", "skipped", "rejected"]
+
+
+def _parse_id(id_type, value):
+    if id_type == "toi":
+        # e.g. 125 or 125.01
+        return float(value) if "." in value else int(value)
+    return int(value)
+
+
+def read_target_list(fp, id_type="tic"):
+    """
+    Parse a target list file into keyword arguments of plot_tql.
+
+    Each non-empty line (lines starting with # are ignored) is one of:
+    * 52368076          (ID interpreted as id_type)
+    * tic 52368076
+    * toi 125.01
+    * gaia 2382520826218346240
+    * 22.5 -12.56       (ra dec in degree)
+    * 08:09:10 -05:04:23 (ra dec in hourangle & degree)
+    Commas are treated as whitespace.
+
+    Parameters
+    ----------
+    fp : str
+        path to target list
+    id_type : str
+        type of bare IDs (tic, toi, gaia)
+
+    Returns
+    -------
+    targets : list of dict
+    """
+    errmsg = f"id_type should be one of {ID_TYPES}"
+    assert id_type in ID_TYPES, errmsg
+    id_kwargs = {"tic": "ticid", "toi": "toiid", "gaia": "gaiaid"}
+
+    targets = []
+    with open(fp) as f:
+        for n, line in enumerate(f):
+            line = line.split("#")[0].replace(",", " ").strip()
+            if line == "":
+                continue
+            tokens = line.split()
+            try:
+                if len(tokens) == 1:
+                    target = {
+                        id_kwargs[id_type]: _parse_id(id_type, tokens[0])
+                    }
+                elif tokens[0].lower() in ID_TYPES:
+                    key = tokens[0].lower()
+                    target = {id_kwargs[key]: _parse_id(key, tokens[1])}
+                elif len(tokens) == 2:
+                    target = {"coords": (tokens[0], tokens[1])}
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"cannot decode line {n+1} in {fp}: {line}")
+            targets.append(target)
+    return targets
+
+
+def get_target_key(target):
+    """
+    unique string identifying a target dict, e.g. 'tic 52368076'
+    """
+    if target.get("ticid") is not None:
+        return f"tic {target['ticid']}"
+    elif target.get("toiid") is not None:
+        return f"toi {target['toiid']}"
+    elif target.get("gaiaid") is not None:
+        return f"gaia {target['gaiaid']}"
+    elif target.get("coords") is not None:
+        return "coords {} {}".format(*target["coords"])
+    elif target.get("name") is not None:
+        return f"name {target['name']}"
+    else:
+        raise ValueError("target has no identifier")
+
+
+def read_status(fp):
+    """
+    Read a batch status file
+
+    Returns
+    -------
+    status : dict
+        latest status of each target key
+    """
+    status = {}
+    if (fp is None) or (not os.path.exists(fp)):
+        return status
+    with open(fp, newline="") as f:
+        for row in csv.DictReader(f):
+            status[row["target"]] = row["status"]
+    return status
+
+
+# queue of the WriterPool of the batch (set in each compute worker)
+_write_queue = None
+
+
+def _init_worker(write_queue=None):
+    """
+    Warm up a worker: use a non-interactive backend and import the heavy
+    dependencies (astropy, lightkurve, wotan, tls, chronos) only once
+
+    Parameters
+    ----------
+    write_queue : multiprocessing.Queue
+        queue of a WriterPool on which results are put for rendering and
+        saving (default=None: done by the worker itself)
+    """
+    global _write_queue
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from tql import tql  # noqa
+
+    _write_queue = write_queue
+
+
+def _render(results, fast_render, render_kwargs):
+    import matplotlib.pyplot as pl
+    from tql import tql
+    from tql.template import render_tql_fast
+
+    if fast_render:
+        # the figure template of this worker is reused
+        _ = render_tql_fast(results, **render_kwargs)
+    else:
+        fig = tql.render_tql(results, **render_kwargs)
+        pl.close(fig)
+
+
+def _run_target(args):
+    """
+    Run tql on a single target inside a worker; the figure is rendered only
+    if SDE >= sde_min and if the target passed the BLS triage (if any).
+    If the worker has a write queue, the figure and tls results are made
+    by the writers instead (see _write_target).
+
+    Returns
+    -------
+    row : dict
+        status record with STATUS_COLUMNS; queued=True if the row is
+        completed by a writer
+    """
+    import matplotlib.pyplot as pl
+    from tql import tql
+    from tql.core import (
+        save_timings,
+        get_output_prefix,
+        get_picklable_results,
+    )
+    from tql.index import get_index_row
+    from tql.profiling import StageTimer
+    from tql.store import get_store_record
+
+    target, kwargs, sde_min, use_store = args
+    kwargs = kwargs.copy()
+    fast_render = kwargs.pop("fast_render", False)
+    render_kwargs = dict(
+        savefig=kwargs.pop("savefig", False),
+        tpf_cmap=kwargs.pop("tpf_cmap", "viridis"),
+        thumbnail=kwargs.pop("thumbnail", False),
+        outdir=kwargs["outdir"],
+        verbose=kwargs["verbose"],
+    )
+    if not fast_render:
+        render_kwargs["run_gls"] = kwargs.get("run_gls", False)
+    savetls = kwargs.get("savetls", False)
+    if _write_queue is not None:
+        kwargs["savetls"] = False
+    timings = StageTimer(profile_stage=kwargs.pop("profile_stage", None))
+    key = get_target_key(target)
+    index_row, record, queued = None, None, False
+    start = timer()
+    try:
+        results = tql.run_tql(**target, timings=timings, **kwargs)
+        status = "ok"
+        render = False
+        if results.tls_results is None:
+            status = "rejected"
+            message = "BLS SDE={bls_SDE:.2f}, SNR={bls_snr:.2f}".format(
+                **results.bls_results
+            )
+        elif (sde_min is None) or (results.SDE >= sde_min):
+            render = True
+            message = ""
+        else:
+            message = f"not rendered (SDE={results.SDE:.2f})"
+        if results.get("cached", False):
+            message = f"{message} (cached)".strip()
+        write = savetls and (results.tls_results is not None)
+        # the index points to the h5 file only if one is written
+        fp = None
+        if write:
+            fp = get_output_prefix(results, kwargs["outdir"]) + "_tls.h5"
+        index_row = get_index_row(results, fp)
+        if use_store:
+            record = get_store_record(results)
+        if (_write_queue is not None) and (render or write):
+            row = {
+                "target": key,
+                "status": status,
+                "runtime": timer() - start,
+                "message": message,
+                "index": index_row,
+                "store": record,
+            }
+            # blocks while the writers are busy
+            _write_queue.put(
+                dict(
+                    row=row,
+                    results=get_picklable_results(results),
+                    render=render,
+                    savetls=write,
+                    fast_render=fast_render,
+                    render_kwargs=render_kwargs,
+                )
+            )
+            queued = True
+        else:
+            if render:
+                _render(results, fast_render, render_kwargs)
+            _ = save_timings(results, kwargs["outdir"])
+    except Exception as e:
+        status, message = "failed", f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    pl.close("all")
+    end = timer()
+    return {
+        "target": key,
+        "status": status,
+        "runtime": f"{end-start:.2f}",
+        "message": message.replace("\n", " "),
+        "index": index_row,
+        "store": record,
+        "queued": queued,
+    }
+
+
+def _write_target(task):
+    """
+    Render the figure and save the tls results of a target inside a writer
+    process (see _run_target)
+
+    Returns
+    -------
+    row : dict
+        status record of the target completed with the writing time
+    """
+    import matplotlib.pyplot as pl
+    from tql.core import save_tls, save_timings, get_output_prefix, load_tpf
+
+    row = task["row"]
+    results = task["results"]
+    outdir = task["render_kwargs"]["outdir"]
+    start = timer()
+    try:
+        if task["savetls"]:
+            fp = get_output_prefix(results, outdir) + "_tls.h5"
+            with results.timings.stage("save_tls"):
+                save_tls(results, fp)
+        if task["render"]:
+            load_tpf(results)
+            _render(results, task["fast_render"], task["render_kwargs"])
+        _ = save_timings(results, outdir)
+    except Exception as e:
+        row.update(status="failed", index=None, store=None)
+        row["message"] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    pl.close("all")
+    row["runtime"] = f"{row['runtime'] + timer() - start:.2f}"
+    row["message"] = row["message"].replace("\n", " ")
+    return row
+
+
+def run_batch(
+    targets,
+    ncores=1,
+    outdir=".",
+    status_file=None,
+    index_file=None,
+    store_file=None,
+    float32=False,
+    redo=False,
+    sde_min=None,
+    prefetch=0,
+    prefetch_workers=2,
+    prefetch_max_bytes=2 * 2**30,
+    writers=0,
+    write_queue_size=None,
+    verbose=True,
+    **kwargs,
+):
+    """
+    Run tql on many targets in a pool of persistent worker processes
+
+    Parameters
+    ----------
+    targets : list of dict
+        e.g. from read_target_list
+    ncores : int
+        maximum number of worker processes
+    outdir : str
+        output directory of figures, tls results and status file
+    status_file : str
+        csv file where per-target status (ok/failed/skipped/rejected) is
+        appended;
+        default=outdir/tql_status.csv
+    index_file : str
+        results index (see tql.index) appended as each target finishes;
+        default=outdir/tql_index.h5
+    store_file : str
+        ResultStore where the parent process adds the results of each
+        target (default=None)
+    float32 : bool
+        downcast arrays added to store_file to float32
+    redo : bool
+        re-run targets which already succeeded in a previous run
+    sde_min : float
+        render figures only for targets with SDE >= sde_min (default=all)
+    prefetch : int
+        number of upcoming targets whose lightcurve, tpf or TESSCut files
+        are downloaded in the background (default=0: no prefetching)
+    prefetch_workers : int
+        number of concurrent prefetch downloads
+    prefetch_max_bytes : int
+        bytes of prefetched files of targets not yet analyzed above which
+        prefetching waits
+    writers : int
+        number of writer processes rendering the figures and saving the
+        tls results while the workers run the next targets (default=0:
+        done by the workers); see writers.WriterPool
+    write_queue_size : int
+        results waiting for the writers above which workers block
+        (default=2*writers)
+    kwargs : dict
+        passed to run_tql (e.g. cadence, lctype, savetls, run_gls; results
+        are cached in config.RESULTS_CACHE_DIR unless results_cache_dir is
+        given) and
+        render_tql (savefig, tpf_cmap, run_gls, thumbnail); with
+        fast_render=True, figures are rendered by updating one figure
+        template per worker (see template.render_tql_fast)
+
+    Returns
+    -------
+    rows : list of dict
+        status record of each target
+    """
+    from tql.config import RESULTS_CACHE_DIR
+    from tql.index import append_to_index
+    from tql.store import ResultStore
+
+    kwargs.setdefault("results_cache_dir", RESULTS_CACHE_DIR)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    if status_file is None:
+        status_file = os.path.join(outdir, "tql_status.csv")
+    if index_file is None:
+        index_file = os.path.join(outdir, "tql_index.h5")
+    previous = {} if redo else read_status(status_file)
+
+    # drop duplicates and targets done in previous runs
+    todo, skipped, seen = [], [], set()
+    for target in targets:
+        key = get_target_key(target)
+        if key in seen:
+            continue
+        seen.add(key)
+        if previous.get(key) in DONE_STATUS:
+            skipped.append(key)
+        else:
+            todo.append(target)
+    # per-target details from workers would interleave; keep them quiet
+    kwargs.update(outdir=outdir, verbose=False)
+    if verbose:
+        print(
+            f"Running {len(todo)} targets on {ncores} cores "
+            f"({len(skipped)} skipped)"
+        )
+
+    is_new = not os.path.exists(status_file)
+    rows = []
+    store = None
+    if (store_file is not None) and (len(todo) > 0):
+        store = ResultStore(store_file, float32=float32)
+    with open(status_file, "a", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=STATUS_COLUMNS, extrasaction="ignore"
+        )
+        if is_new:
+            writer.writeheader()
+
+        lock = threading.Lock()
+
+        def write(row):
+            with lock:
+                _write(row)
+
+        def _write(row):
+            rows.append(row)
+            writer.writerow(row)
+            # flush after every target so a crash loses nothing
+            f.flush()
+            if row.get("index") is not None:
+                append_to_index([row["index"]], index_file)
+            if row.get("store") is not None:
+                store.append(*row["store"])
+            if verbose:
+                print(
+                    "{target}: {status} ({runtime} s) {message}".format(**row)
+                )
+
+        for key in skipped:
+            write(
+                {
+                    "target": key,
+                    "status": "skipped",
+                    "runtime": "0.00",
+                    "message": "",
+                }
+            )
+        if len(todo) == 0:
+            return rows
+        use_store = store is not None
+        args = [(target, kwargs, sde_min, use_store) for target in todo]
+        prefetcher = None
+        if prefetch > 0:
+            resolver = partial(
+                get_mast_downloads,
+                cadence=kwargs.get("cadence", "short"),
+                sector=kwargs.get("sector"),
+                cutout_size=kwargs.get("cutout_size", (12, 12)),
+            )
+            prefetcher = Prefetcher(
+                resolver,
+                ahead=prefetch,
+                max_workers=prefetch_workers,
+                max_bytes=prefetch_max_bytes,
+                key=get_target_key,
+            )
+            # the first targets are downloaded by the workers themselves
+            prefetcher.start(todo[ncores:])
+        writer_pool, write_queue = None, None
+        if writers > 0:
+            # rows of queued targets are written when the writers are done
+            writer_pool = WriterPool(
+                _write_target,
+                callback=write,
+                nworkers=writers,
+                maxsize=write_queue_size,
+                initializer=_init_worker,
+            )
+            write_queue = writer_pool.queue
+
+        def done(row):
+            if prefetcher is not None:
+                prefetcher.release(row["target"])
+            if not row.pop("queued"):
+                write(row)
+
+        try:
+            if ncores == 1:
+                _init_worker(write_queue)
+                for arg in args:
+                    done(_run_target(arg))
+            else:
+                with mp.Pool(
+                    processes=min(ncores, len(todo)),
+                    initializer=_init_worker,
+                    initargs=(write_queue,),
+                ) as pool:
+                    for row in pool.imap_unordered(
+                        _run_target, args, chunksize=1
+                    ):
+                        done(row)
+                    # workers exit cleanly so that their queued results
+                    # are flushed to the writers
+                    pool.close()
+                    pool.join()
+            if writer_pool is not None:
+                writer_pool.close()
+                writer_pool = None
+        finally:
+            if writer_pool is not None:
+                writer_pool.terminate()
+            if prefetcher is not None:
+                prefetcher.close(wait=False)
+                if verbose and len(prefetcher.errors) > 0:
+                    print(f"{len(prefetcher.errors)} targets not prefetched")
+            if store is not None:
+                store.close()
+    return rows
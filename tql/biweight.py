@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+Fast sliding-window biweight detrending of long, regular-cadence
+lightcurves (e.g. stitched 2-min sectors).
+
+The trend at each cadence is the same robust location estimate as wotan's
+flatten(method="biweight"): the Tukey biweight of the flux in a time window
+of window_length centered on it, iterated from the window median with the
+window MAD as scale. Instead of copying and partially sorting each window,
+the window is kept sorted as it slides (at a regular cadence one value
+leaves and one enters per step), so the median and MAD are lookups, the
+biweight iterations only visit the values within cval*MAD of the center and
+start from the location of the previous window, which is already close.
+
+The trend of a 0.5-day window changes little from one 2-min cadence to
+the next, so the biweight is only evaluated every `stride` cadences (and at
+both ends of each segment) and linearly interpolated in between; stride=1
+evaluates every cadence.
+"""
+
+from time import perf_counter as timer
+
+import numpy as np
+from numba import njit
+
+# convergence tolerance of the biweight iterations (as wotan's FTOL)
+FTOL = 1e-6
+MAXITER = 100
+# sorted window updated by one merge pass if more values change
+MERGE_MIN = 4
+# default stride: number of evaluations per window
+EVALS_PER_WINDOW = 60
+
+
+@njit(cache=True)
+def _replace(buf, n, old, new):
+    """
+    replace one occurrence of old by new in the sorted buf[:n], shifting
+    only the values between their positions
+    """
+    k = np.searchsorted(buf[:n], old)
+    if new >= old:
+        while (k + 1 < n) and (buf[k + 1] < new):
+            buf[k] = buf[k + 1]
+            k += 1
+    else:
+        while (k > 0) and (buf[k - 1] > new):
+            buf[k] = buf[k - 1]
+            k -= 1
+    buf[k] = new
+
+
+@njit(cache=True)
+def _insert(buf, n, value):
+    k = np.searchsorted(buf[:n], value)
+    buf[k + 1 : n + 1] = buf[k:n].copy()
+    buf[k] = value
+    return n + 1
+
+
+@njit(cache=True)
+def _remove(buf, n, value):
+    k = np.searchsorted(buf[:n], value)
+    buf[k : n - 1] = buf[k + 1 : n].copy()
+    return n - 1
+
+
+@njit(cache=True)
+def _merge(buf, n, leaving, entering, out):
+    """
+    sorted buf[:n] without the (sorted) leaving values and with the
+    (sorted) entering values, in one pass into out; returns the new length
+    """
+    k = e = m = 0
+    for j in range(n):
+        value = buf[j]
+        if (k < len(leaving)) and (value == leaving[k]):
+            k += 1
+            continue
+        while (e < len(entering)) and (entering[e] < value):
+            out[m] = entering[e]
+            m += 1
+            e += 1
+        out[m] = value
+        m += 1
+    while e < len(entering):
+        out[m] = entering[e]
+        m += 1
+        e += 1
+    return m
+
+
+@njit(cache=True)
+def _median_mad(s):
+    """
+    median and median absolute deviation of the sorted array s in
+    O(log n): the MAD is the median of the union of the two sorted runs
+    med - s[:r][::-1] and s[r:] - med
+    """
+    n = len(s)
+    if n % 2 == 1:
+        med = s[n // 2]
+    else:
+        med = (s[n // 2 - 1] + s[n // 2]) / 2
+    r = np.searchsorted(s, med)
+    na, nb = r, n - r
+    # k-th (and for even n the (k+1)-th) smallest absolute deviation
+    k = (n - 1) // 2 + 1
+    lo, hi = max(0, k - nb), min(k, na)
+    v1 = v2 = 0.0
+    while lo <= hi:
+        i = (lo + hi) // 2
+        j = k - i
+        a_left = med - s[r - i] if i > 0 else -np.inf
+        a_right = med - s[r - 1 - i] if i < na else np.inf
+        b_left = s[r + j - 1] - med if j > 0 else -np.inf
+        b_right = s[r + j] - med if j < nb else np.inf
+        if a_left > b_right:
+            hi = i - 1
+        elif b_left > a_right:
+            lo = i + 1
+        else:
+            v1 = max(a_left, b_left)
+            v2 = min(a_right, b_right) if n % 2 == 0 else v1
+            break
+    return med, (v1 + v2) / 2
+
+
+@njit(cache=True, fastmath=True)
+def _biweight(s, med, mad, cval, ftol, start):
+    """
+    biweight location of the sorted array s iterated from start (e.g. the
+    location of the previous window) if it is within a MAD of the median,
+    else from the median (as wotan's location_iter)
+    """
+    if mad == 0:
+        return med
+    center = start if abs(start - med) < mad else med
+    c = cval * mad
+    inv_c = 1 / c
+    for _ in range(MAXITER):
+        # values with non-zero weight
+        i0 = np.searchsorted(s, center - c, side="right")
+        i1 = np.searchsorted(s, center + c, side="left")
+        sum_dw = 0.0
+        sum_w = 0.0
+        for j in range(i0, i1):
+            d = s[j] - center
+            u = d * inv_c
+            w = (1 - u * u) ** 2
+            sum_dw += d * w
+            sum_w += w
+        if sum_w == 0:
+            break
+        delta = sum_dw / sum_w
+        center += delta
+        if abs(delta) < ftol:
+            break
+    return center
+
+
+@njit(cache=True)
+def _sliding_biweight(flux, use, lo, hi, evaluate, cval, ftol, trend):
+    """
+    biweight of flux[lo[i]:hi[i]] (values with use) at the evaluated
+    indexes; lo and hi must be non-decreasing
+    """
+    size = 0
+    for i in range(len(flux)):
+        size = max(size, hi[i] - lo[i])
+    buf = np.empty(max(size, 1))
+    tmp = np.empty_like(buf)
+    # at most a window leaves and enters between overlapping windows
+    leaving = np.empty_like(buf)
+    entering = np.empty_like(buf)
+    n = 0
+    cur_lo = cur_hi = 0
+    center = 0.0
+    warm = False
+    for i in range(len(flux)):
+        if not evaluate[i]:
+            continue
+        if lo[i] >= cur_hi:
+            # disjoint from the previous window: sort from scratch
+            n = 0
+            for j in range(lo[i], hi[i]):
+                if use[j]:
+                    buf[n] = flux[j]
+                    n += 1
+            buf[:n].sort()
+            warm = False
+        elif (lo[i] - cur_lo) + (hi[i] - cur_hi) > MERGE_MIN:
+            # many values changed (stride > 1): one merge pass
+            nl = 0
+            for j in range(cur_lo, lo[i]):
+                if use[j]:
+                    leaving[nl] = flux[j]
+                    nl += 1
+            ne = 0
+            for j in range(cur_hi, hi[i]):
+                if use[j]:
+                    entering[ne] = flux[j]
+                    ne += 1
+            leaving[:nl].sort()
+            entering[:ne].sort()
+            n = _merge(buf, n, leaving[:nl], entering[:ne], tmp)
+            buf, tmp = tmp, buf
+        else:
+            # swap the values leaving the window for those entering it
+            j_out, j_in = cur_lo, cur_hi
+            while True:
+                while (j_out < lo[i]) and not use[j_out]:
+                    j_out += 1
+                while (j_in < hi[i]) and not use[j_in]:
+                    j_in += 1
+                if (j_out < lo[i]) and (j_in < hi[i]):
+                    _replace(buf, n, flux[j_out], flux[j_in])
+                    j_out += 1
+                    j_in += 1
+                elif j_out < lo[i]:
+                    n = _remove(buf, n, flux[j_out])
+                    j_out += 1
+                elif j_in < hi[i]:
+                    n = _insert(buf, n, flux[j_in])
+                    j_in += 1
+                else:
+                    break
+        cur_lo, cur_hi = lo[i], hi[i]
+        if n > 0:
+            med, mad = _median_mad(buf[:n])
+            start = center if warm else med
+            center = _biweight(buf[:n], med, mad, cval, ftol, start)
+            trend[i] = center
+            warm = True
+
+
+def get_segments(time, break_tolerance):
+    """
+    start and end indexes of the segments of a sorted time array split at
+    gaps longer than break_tolerance
+    """
+    breaks = np.flatnonzero(np.diff(time) > break_tolerance) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(time)]])
+    return list(zip(starts, ends))
+
+
+def get_stride(time, window_length, evals_per_window=EVALS_PER_WINDOW):
+    """
+    number of cadences between biweight evaluations: ~evals_per_window per
+    window at the median cadence
+    """
+    if len(time) < 2:
+        return 1
+    cadence = np.median(np.diff(time))
+    # rounded against the float jitter of the time stamps
+    ncadences = np.round(window_length / cadence, 6) if cadence > 0 else 1
+    return max(1, int(ncadences // evals_per_window))
+
+
+def sliding_biweight(
+    time,
+    flux,
+    window_length=0.5,
+    edge_cutoff=0,
+    break_tolerance=None,
+    cval=5,
+    mask=None,
+    stride=None,
+    ftol=FTOL,
+):
+    """
+    Biweight trend of a lightcurve (as wotan's flatten(method="biweight"))
+
+    Parameters
+    ----------
+    time, flux : array
+        lightcurve (nans are ignored)
+    window_length : float
+        length in days of the filter window
+    edge_cutoff : float
+        length in days at each edge of a segment without trend (nan)
+    break_tolerance : float
+        segments split at gaps longer than that are detrended on their own
+        (default=window_length/2; 0 to not split)
+    cval : float
+        tuning parameter of the biweight in units of the MAD
+    mask : array of bool
+        cadences excluded from the fit (e.g. transits)
+    stride : int
+        cadences between biweight evaluations, interpolated in between
+        (default=window_length/EVALS_PER_WINDOW; 1 is exact)
+
+    Returns
+    -------
+    trend : array
+    """
+    time = np.asarray(time, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    trend = np.full(len(time), np.nan)
+    good = np.isfinite(time) & np.isfinite(flux)
+    if not np.any(good):
+        return trend
+    order = np.argsort(time[good], kind="stable")
+    idx = np.flatnonzero(good)[order]
+    t, f = time[idx], flux[idx]
+    use = np.ones(len(t), dtype=bool)
+    if mask is not None:
+        use = ~np.asarray(mask, dtype=bool)[idx]
+    if break_tolerance is None:
+        break_tolerance = window_length / 2
+    if break_tolerance == 0:
+        break_tolerance = np.inf
+    if stride is None:
+        stride = get_stride(t, window_length)
+    edge_cutoff = min(edge_cutoff, window_length / 2)
+
+    half_window = window_length / 2
+    lo = np.empty(len(t), dtype=np.int64)
+    hi = np.empty(len(t), dtype=np.int64)
+    evaluate = np.zeros(len(t), dtype=bool)
+    segments = []
+    for start, end in get_segments(t, break_tolerance):
+        ts = t[start:end]
+        # window of i: time[i] - half_window <= time < time[i] + half_window
+        lo[start:end] = start + np.searchsorted(ts, ts - half_window)
+        hi[start:end] = start + np.searchsorted(ts, ts + half_window)
+        inside = np.flatnonzero(
+            (ts >= ts[0] + edge_cutoff) & (ts <= ts[-1] - edge_cutoff)
+        )
+        if len(inside) == 0:
+            continue
+        inside += start
+        evaluate[inside[::stride]] = True
+        evaluate[inside[-1]] = True
+        segments.append(inside)
+
+    trend_sorted = np.full(len(t), np.nan)
+    _sliding_biweight(
+        f, use, lo, hi, evaluate, float(cval), float(ftol), trend_sorted
+    )
+    # no unmasked values in the window
+    nused = np.concatenate([[0], np.cumsum(use)])
+    empty = (nused[hi] - nused[lo]) == 0
+    for inside in segments:
+        done = inside[evaluate[inside] & np.isfinite(trend_sorted[inside])]
+        if (stride > 1) and (len(done) > 0):
+            trend_sorted[inside] = np.interp(
+                t[inside], t[done], trend_sorted[done]
+            )
+    trend_sorted[empty] = np.nan
+    trend[idx] = trend_sorted
+    return trend
+
+
+def compare_biweight(time, flux, nrepeat=3, **kwargs):
+    """
+    run wotan's biweight and sliding_biweight (exact and strided) on the
+    same lightcurve
+
+    Parameters
+    ----------
+    nrepeat : int
+        the best of nrepeat wall times is kept
+    kwargs : dict
+        passed to both (e.g. window_length, edge_cutoff, break_tolerance)
+
+    Returns
+    -------
+    comparison : dict
+        wall times and the max and rms differences of the trends in units
+        of the standard error of the window mean (noise/sqrt(n))
+    """
+    from wotan import flatten
+
+    time = np.asarray(time, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    window_length = kwargs.pop("window_length", 0.5)
+    stride = kwargs.pop("stride", None)
+    if stride is None:
+        stride = get_stride(time, window_length)
+
+    def best_of(func):
+        times = []
+        for _ in range(nrepeat):
+            start = timer()
+            trend = func()
+            times.append(timer() - start)
+        return trend, min(times)
+
+    wotan_trend, time_wotan = best_of(
+        lambda: flatten(
+            time,
+            flux,
+            method="biweight",
+            window_length=window_length,
+            return_trend=True,
+            **kwargs,
+        )[1]
+    )
+    d = dict(ndata=len(time), stride=stride, time_wotan=time_wotan)
+    # noise of the point-to-point differences
+    noise = 1.4826 * np.nanmedian(np.abs(np.diff(flux))) / np.sqrt(2)
+    cadence = np.nanmedian(np.diff(time))
+    error = noise / np.sqrt(window_length / cadence)
+    for name, s in [("exact", 1), ("fast", stride)]:
+        trend, t = best_of(
+            lambda: sliding_biweight(
+                time, flux, window_length=window_length, stride=s, **kwargs
+            )
+        )
+        diff = trend - wotan_trend
+        d[f"time_{name}"] = t
+        d[f"speedup_{name}"] = time_wotan / t
+        d[f"max_diff_{name}"] = np.nanmax(np.abs(diff)) / error
+        d[f"rms_diff_{name}"] = np.sqrt(np.nanmean(diff**2)) / error
+        d[f"nan_mismatch_{name}"] = int(
+            np.sum(np.isnan(trend) != np.isnan(wotan_trend))
+        )
+    return d
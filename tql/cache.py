@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of catalog query results and of tql results.
+
+Each entry is a pickle file whose name is the hash of its key, e.g.
+("gaia_dr2", "tic 52368076", 120). Entries older than ttl are re-queried,
+and the least recently used entries are evicted once the cache grows beyond
+max_size. The total size is kept as a running sum, and the directory is
+only scanned when it exceeds max_size or every scan_every writes. In
+offline mode only cached entries are served.
+
+Results of run_tql are keyed by the hash of the target, all the parameters
+that change them and the versions of the code and of its dependencies
+(see get_results_key), so that re-running unchanged targets only loads
+them.
+"""
+
+import os
+import glob
+import pickle
+import hashlib
+from time import time as timer
+from importlib.metadata import version, PackageNotFoundError
+
+from tql.config import (
+    CACHE_SCAN_EVERY,
+    CATALOG_CACHE_DIR,
+    CATALOG_CACHE_TTL,
+    CATALOG_CACHE_MAX_SIZE,
+    RESULTS_CACHE_DIR,
+    RESULTS_CACHE_TTL,
+    RESULTS_CACHE_MAX_SIZE,
+)
+
+# a full cache is evicted down to this fraction of max_size, so that it is
+# not scanned again on the next write
+EVICT_FRACTION = 0.9
+# packages whose versions change the results of run_tql (e.g. downloaded
+# lightcurves, catalog values and detrending)
+RESULTS_KEY_PACKAGES = [
+    "chronos",
+    "astropy",
+    "lightkurve",
+    "wotan",
+    "transitleastsquares",
+]
+# parameters of run_tql which change its results
+RESULTS_KEY_PARAMS = [
+    "gaiaid",
+    "toiid",
+    "ticid",
+    "coords",
+    "name",
+    "sector",
+    "sectors",
+    "search_radius",
+    "cadence",
+    "lctype",
+    "sap_mask",
+    "aper_radius",
+    "threshold_sigma",
+    "percentile",
+    "cutout_size",
+    "quality_bitmask",
+    "apply_data_quality_mask",
+    "mmap_tpf",
+    "flatten_method",
+    "window_length",
+    "Porb_limits",
+    "use_star_priors",
+    "edge_cutoff",
+    "sigma",
+    "find_cluster",
+    "nearby_gaia_radius",
+    "bin_hr",
+    "run_gls",
+    "triage",
+    "bls_sde_min",
+    "bls_snr_min",
+    "fast_search",
+    "max_planets",
+    "planet_sde_min",
+]
+
+
+class CatalogCache:
+    """
+    Keyed on-disk cache with time-to-live and size-based eviction
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory of cached files
+    ttl : float
+        time-to-live of entries in days
+    max_size : float
+        maximum total size of cache in MB
+    offline : bool
+        serve only from the cache (raises KeyError on misses)
+    memory : bool
+        keep loaded entries in memory (e.g. not for large entries read
+        only once)
+    scan_every : int
+        number of writes between scans of cache_dir, which count the
+        entries written by other processes
+    """
+
+    def __init__(
+        self,
+        cache_dir=CATALOG_CACHE_DIR,
+        ttl=CATALOG_CACHE_TTL,
+        max_size=CATALOG_CACHE_MAX_SIZE,
+        offline=False,
+        memory=True,
+        scan_every=CACHE_SCAN_EVERY,
+        verbose=False,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.memory = memory
+        self.scan_every = scan_every
+        self.verbose = verbose
+        # entries already loaded in this process
+        self._memory = {}
+        # total size in bytes (None until the first scan) and number of
+        # writes since the last scan
+        self._size = None
+        self._nwrites = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        return (
+            f"CatalogCache(cache_dir={self.cache_dir}, ttl={self.ttl}, "
+            f"max_size={self.max_size}, offline={self.offline})"
+        )
+
+    def get_filepath(self, key):
+        h = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, h + ".pkl")
+
+    def get(self, key, default=None):
+        """
+        cached value of key or default if missing or expired
+        (expired entries are still served in offline mode)
+        """
+        fp = self.get_filepath(key)
+        if key in self._memory:
+            entry = self._memory[key]
+        elif os.path.exists(fp):
+            try:
+                with open(fp, "rb") as f:
+                    entry = pickle.load(f)
+            except Exception:
+                # e.g. truncated file
+                return default
+            if entry["key"] != key:
+                # hash collision
+                return default
+            if self.memory:
+                self._memory[key] = entry
+        else:
+            return default
+        age = (timer() - entry["created"]) / 86400
+        if (age > self.ttl) and not self.offline:
+            _ = self._memory.pop(key, None)
+            return default
+        if os.path.exists(fp):
+            # mark as recently used
+            os.utime(fp)
+        return entry["value"]
+
+    def set(self, key, value):
+        """
+        save value of key and evict old entries if cache is full
+        """
+        entry = {"key": key, "created": timer(), "value": value}
+        if self.memory:
+            self._memory[key] = entry
+        fp = self.get_filepath(key)
+        try:
+            old_nbytes = os.path.getsize(fp)
+        except FileNotFoundError:
+            old_nbytes = 0
+        # write then rename so parallel workers never read partial files
+        tmp = f"{fp}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            nbytes = f.tell()
+        os.replace(tmp, fp)
+        self._nwrites += 1
+        if self._size is not None:
+            self._size += nbytes - old_nbytes
+        if (
+            (self._size is None)
+            or (self._size > self.max_size * 1024**2)
+            or (self._nwrites >= self.scan_every)
+        ):
+            self.evict()
+
+    def query(self, key, func, *args, **kwargs):
+        """
+        return cached value of key, or call func(*args, **kwargs) and
+        cache its output
+        """
+        value = self.get(key)
+        if value is not None:
+            if self.verbose:
+                print(f"Loaded {key} from cache")
+            return value
+        if self.offline:
+            raise KeyError(f"{key} is not in cache (offline mode)")
+        value = func(*args, **kwargs)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def get_size(self):
+        """
+        total size of cache in MB
+        """
+        return sum(os.path.getsize(fp) for fp in self._files()) / 1024**2
+
+    def _files(self):
+        return [
+            entry.path
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".pkl")
+        ]
+
+    def evict(self):
+        """
+        delete least recently used entries until size <= EVICT_FRACTION *
+        max_size if the cache is larger than max_size
+        """
+        files = []
+        for fp in self._files():
+            try:
+                st = os.stat(fp)
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+            files.append((st.st_mtime, st.st_size, fp))
+        size = sum(f[1] for f in files)
+        self._nwrites = 0
+        self._size = size
+        if size <= self.max_size * 1024**2:
+            return
+        for _, nbytes, fp in sorted(files):
+            if size <= EVICT_FRACTION * self.max_size * 1024**2:
+                break
+            try:
+                os.remove(fp)
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+        self._size = size
+        self._memory = {
+            k: v
+            for k, v in self._memory.items()
+            if os.path.exists(self.get_filepath(k))
+        }
+
+    def clear(self):
+        for fp in self._files():
+            os.remove(fp)
+        self._memory = {}
+        self._size = 0
+
+
+def get_cache_target_key(l):
+    """
+    unique identifier of a chronos target used in cache keys
+    """
+    if l.ticid is not None:
+        return f"tic {l.ticid}"
+    elif l.gaiaid is not None:
+        return f"gaia {l.gaiaid}"
+    elif l.toiid is not None:
+        return f"toi {l.toiid}"
+    else:
+        coord = l.target_coord
+        return f"coords {coord.ra.deg:.6f} {coord.dec.deg:.6f}"
+
+
+_caches = {}
+
+
+def get_catalog_cache(cache_dir=CATALOG_CACHE_DIR, offline=False):
+    """
+    CatalogCache shared by all runs in this process so that loaded entries
+    stay in memory across targets (e.g. in batch workers)
+    """
+    key = (cache_dir, offline)
+    if key not in _caches:
+        _caches[key] = CatalogCache(cache_dir=cache_dir, offline=offline)
+    return _caches[key]
+
+
+def get_results_cache(cache_dir=RESULTS_CACHE_DIR):
+    """
+    cache of run_tql results shared by all runs in this process; results
+    are not kept in memory
+    """
+    key = (cache_dir, "results")
+    if key not in _caches:
+        _caches[key] = CatalogCache(
+            cache_dir=cache_dir,
+            ttl=RESULTS_CACHE_TTL,
+            max_size=RESULTS_CACHE_MAX_SIZE,
+            memory=False,
+        )
+    return _caches[key]
+
+
+_code_version = None
+
+
+def get_code_version():
+    """
+    hash of the tql source files and of the versions of
+    RESULTS_KEY_PACKAGES, so that results cached by other versions of the
+    code or of its dependencies are not used
+    """
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha1()
+        pkg_dir = os.path.dirname(os.path.abspath(__file__))
+        for fp in sorted(glob.glob(os.path.join(pkg_dir, "*.py"))):
+            with open(fp, "rb") as f:
+                h.update(f.read())
+        for package in RESULTS_KEY_PACKAGES:
+            try:
+                h.update(f"{package}=={version(package)}".encode())
+            except PackageNotFoundError:
+                h.update(package.encode())
+        _code_version = h.hexdigest()[:12]
+    return _code_version
+
+
+def is_resolved(params):
+    """
+    whether the sector(s) of the arguments of run_tql are known before the
+    target is loaded, i.e. not sector=None (default sector of the target)
+    or sectors="all"
+    """
+    sectors = params.get("sectors")
+    if sectors is None:
+        return params.get("sector") is not None
+    return sectors != "all"
+
+
+def get_results_key(params):
+    """
+    cache key of the results of run_tql called with params
+
+    Parameters
+    ----------
+    params : dict
+        arguments of run_tql with resolved sector(s) (see is_resolved);
+        only RESULTS_KEY_PARAMS are used
+    """
+    params = dict(params)
+    if isinstance(params.get("sectors"), (list, tuple)):
+        params["sectors"] = sorted(params["sectors"])
+    values = tuple((k, params.get(k)) for k in RESULTS_KEY_PARAMS)
+    return ("tql_results", get_code_version(), values)
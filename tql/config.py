@@ -1,3 +1,20 @@
-import pkg_resources
+import os
 
-DATA_PATH = pkg_resources.resource_filename("tql", "../data")
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data")
+
+# on-disk cache of Gaia/TIC/VizieR query results
+CATALOG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".tql", "catalogs")
+CATALOG_CACHE_TTL = 30  # days
+CATALOG_CACHE_MAX_SIZE = 500  # MB
+# writes between two scans of a cache directory (to count the entries
+# written by other processes)
+CACHE_SCAN_EVERY = 1000
+
+# on-disk cache of run_tql results
+RESULTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".tql", "results")
+RESULTS_CACHE_TTL = 30  # days
+RESULTS_CACHE_MAX_SIZE = 5000  # MB
+
+# tql server (see server.py)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
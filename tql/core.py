@@ -0,0 +1,1493 @@
+# -*- coding: utf-8 -*-
+"""
+Headless compute core of tql.
+
+run_tql downloads the data, detrends the lightcurve, computes the rotation
+and transit periodograms, the contamination ratio and the stellar parameters
+and returns them as a TqlResults object. Nothing here imports matplotlib;
+rendering is done by tql.plot_tql/render_tql over the returned results.
+Dependencies of optional stages (chronos.gls, deepdish, the ResultStore)
+are imported only when the stage runs.
+"""
+
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import lightkurve as lk
+import astropy.units as u
+from astropy.stats import sigma_clip
+from astropy.coordinates import SkyCoord
+from wotan import flatten
+from wotan import t14 as estimate_transit_duration
+from transitleastsquares import transitleastsquares as tls
+from transitleastsquares import duration_grid
+
+from chronos.lightcurve import ShortCadence, LongCadence
+from chronos.constants import TESS_TIME_OFFSET
+from chronos.utils import (
+    get_fluxes_within_mask,
+    get_transit_mask,
+    is_gaiaid_in_cluster,
+    get_err_quadrature,
+)
+
+from tql.config import CATALOG_CACHE_DIR
+from tql.cache import (
+    get_catalog_cache,
+    get_cache_target_key,
+    get_results_cache,
+    get_results_key,
+    is_resolved,
+    RESULTS_KEY_PARAMS,
+)
+from tql.profiling import StageTimer
+from tql.detrend import Detrender
+from tql.rotation import get_rotation_periodogram
+from tql.search import (
+    get_tls_results_fast,
+    get_bls_results,
+    passes_triage,
+)
+from tql.tpf import get_tpf_cube, get_aperture_mask, get_background_mask
+from tql.aperture import get_contratios
+
+# scalars of each candidate of the iterative transit search
+CANDIDATE_COLUMNS = [
+    "SDE",
+    "period",
+    "period_uncertainty",
+    "T0",
+    "duration",
+    "depth",
+    "rp_rs",
+    "snr",
+    "transit_count",
+    "odd_even_mismatch",
+]
+
+
+class TqlResults(dict):
+    """
+    dict of tql results with attribute access (like tls_results), e.g.
+    results.SDE, results.period, results.Rp
+    """
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __dir__(self):
+        return list(self.keys())
+
+
+def parse_coords(coords):
+    """
+    coords : tuple
+        (ra, dec) in '08:09:10 -05:04:23' or '22.5 -12.56' format
+    """
+    if coords is None:
+        return None
+    errmsg = "coords should be a tuple (ra dec)"
+    assert len(coords) == 2, errmsg
+    if len(coords[0].split(":")) == 3:
+        target_coord = SkyCoord(
+            ra=coords[0], dec=coords[1], unit=("hourangle", "degree")
+        )
+    elif len(coords[0].split(".")) == 2:
+        target_coord = SkyCoord(ra=coords[0], dec=coords[1], unit="degree")
+    else:
+        raise ValueError("cannot decode coord input")
+    return target_coord
+
+
+def get_target(
+    gaiaid=None,
+    toiid=None,
+    ticid=None,
+    coords=None,
+    name=None,
+    sector=None,
+    search_radius=3,
+    cadence="short",
+    lctype=None,
+    sap_mask=None,
+    aper_radius=1,
+    threshold_sigma=5,
+    percentile=90,
+    cutout_size=(12, 12),
+    quality_bitmask="default",
+    apply_data_quality_mask=False,
+    verbose=True,
+    clobber=False,
+):
+    """
+    Instantiate chronos ShortCadence or LongCadence with default lctype
+    and sap_mask of each cadence
+
+    Returns
+    -------
+    lightcurve, lctype
+    """
+    target_coord = parse_coords(coords)
+    if cadence == "long":
+        sap_mask = "square" if sap_mask is None else sap_mask
+        lctype = "custom" if lctype is None else lctype
+        lctypes = ["custom", "cdips", "pathos"]
+        errmsg = f"{lctype} is not available in cadence=long"
+        assert lctype in lctypes, errmsg
+        lightcurve = LongCadence(
+            gaiaDR2id=gaiaid,
+            toiid=toiid,
+            ticid=ticid,
+            name=name,
+            ra_deg=target_coord.ra.deg if target_coord else None,
+            dec_deg=target_coord.dec.deg if target_coord else None,
+            sector=sector,
+            search_radius=search_radius,
+            sap_mask=sap_mask,
+            aper_radius=aper_radius,
+            threshold_sigma=threshold_sigma,
+            percentile=percentile,
+            cutout_size=cutout_size,
+            quality_bitmask=quality_bitmask,
+            apply_data_quality_mask=apply_data_quality_mask,
+            verbose=verbose,
+            clobber=clobber,
+        )
+    elif cadence == "short":
+        sap_mask = "pipeline" if sap_mask is None else sap_mask
+        lctype = "pdcsap" if lctype is None else lctype
+        lctypes = ["pdcsap", "sap", "custom"]
+        errmsg = f"{lctype} is not available in cadence=short"
+        assert lctype in lctypes, errmsg
+        lightcurve = ShortCadence(
+            gaiaDR2id=gaiaid,
+            toiid=toiid,
+            ticid=ticid,
+            ra_deg=target_coord.ra.deg if target_coord else None,
+            dec_deg=target_coord.dec.deg if target_coord else None,
+            name=name,
+            sector=sector,
+            search_radius=search_radius,
+            sap_mask=sap_mask,
+            aper_radius=aper_radius,
+            threshold_sigma=threshold_sigma,
+            percentile=percentile,
+            quality_bitmask=quality_bitmask,
+            apply_data_quality_mask=apply_data_quality_mask,
+            verbose=verbose,
+            clobber=clobber,
+        )
+    else:
+        raise ValueError("Use cadence=(long, short).")
+    if verbose:
+        print(f"Analyzing {cadence} cadence data with {sap_mask} mask")
+    return lightcurve, lctype
+
+
+def query_xmatch(l, search_radius=3, cache=None):
+    """
+    nearest Gaia DR2 and TIC cross-match of the target;
+    sets l.gaia_params and l.tic_params
+    """
+    if l.gaia_params is None:
+
+        def _query_gaia():
+            _ = l.query_gaia_dr2_catalog(return_nearest_xmatch=True)
+            return l.gaia_params, l.gaiaid
+
+        if cache is None:
+            _ = _query_gaia()
+        else:
+            key = ("gaia_dr2_xmatch", get_cache_target_key(l), search_radius)
+            l.gaia_params, gaiaid = cache.query(key, _query_gaia)
+            l.gaiaid = gaiaid if l.gaiaid is None else l.gaiaid
+    if l.tic_params is None:
+
+        def _query_tic():
+            _ = l.query_tic_catalog(return_nearest_xmatch=True)
+            return l.tic_params, l.ticid
+
+        if cache is None:
+            _ = _query_tic()
+        else:
+            key = ("tic_xmatch", get_cache_target_key(l), search_radius)
+            l.tic_params, ticid = cache.query(key, _query_tic)
+            l.ticid = ticid if l.ticid is None else l.ticid
+
+
+def query_gaia_sources(l, radius=120, cache=None):
+    """
+    Gaia DR2 sources within radius (arcsec) of the target;
+    sets l.gaia_sources
+    """
+    if (l.gaia_sources is not None) and (radius == 120):
+        return l.gaia_sources
+
+    def _query():
+        _ = l.query_gaia_dr2_catalog(radius=radius)
+        return l.gaia_sources
+
+    if cache is None:
+        return _query()
+    key = ("gaia_dr2", get_cache_target_key(l), radius)
+    l.gaia_sources = cache.query(key, _query)
+    return l.gaia_sources
+
+
+def query_vizier(l, cache=None):
+    """
+    VizieR tables around the target (used for StarHorse parameters)
+    """
+    if cache is None:
+        return l.query_vizier(verbose=False)
+    key = ("vizier", get_cache_target_key(l), None)
+    return cache.query(key, l.query_vizier, verbose=False)
+
+
+def _get_cache(cache_dir, offline=False):
+    if offline:
+        assert cache_dir is not None, "offline mode needs cache_dir"
+    if cache_dir is None:
+        return None
+    return get_catalog_cache(cache_dir=cache_dir, offline=offline)
+
+
+def load_target(
+    gaiaid=None,
+    toiid=None,
+    ticid=None,
+    coords=None,
+    name=None,
+    sector=None,
+    search_radius=3,
+    cadence="short",
+    lctype=None,
+    sap_mask=None,
+    aper_radius=1,
+    threshold_sigma=5,
+    percentile=90,
+    cutout_size=(12, 12),
+    quality_bitmask="default",
+    apply_data_quality_mask=False,
+    cache_dir=CATALOG_CACHE_DIR,
+    offline=False,
+    timings=None,
+    verbose=True,
+    clobber=False,
+):
+    """
+    Instantiate the target (see get_target) and cross-match it with
+    Gaia DR2 and TIC
+
+    Returns
+    -------
+    lightcurve, lctype
+    """
+    timings = StageTimer() if timings is None else timings
+    cache = _get_cache(cache_dir, offline)
+    with timings.stage("target"):
+        l, lctype = get_target(
+            gaiaid=gaiaid,
+            toiid=toiid,
+            ticid=ticid,
+            coords=coords,
+            name=name,
+            sector=sector,
+            search_radius=search_radius,
+            cadence=cadence,
+            lctype=lctype,
+            sap_mask=sap_mask,
+            aper_radius=aper_radius,
+            threshold_sigma=threshold_sigma,
+            percentile=percentile,
+            cutout_size=cutout_size,
+            quality_bitmask=quality_bitmask,
+            apply_data_quality_mask=apply_data_quality_mask,
+            verbose=verbose,
+            clobber=clobber,
+        )
+    with timings.stage("catalog_xmatch"):
+        query_xmatch(l, search_radius=search_radius, cache=cache)
+    if not l.validate_gaia_tic_xmatch():
+        raise ValueError("Gaia TIC cross-match failed")
+    return l, lctype
+
+
+def get_raw_lc(l, lctype, mmap_tpf=False):
+    """
+    download (or make) the raw lightcurve of type lctype
+
+    Parameters
+    ----------
+    mmap_tpf : bool
+        make custom lightcurves from the memory-mapped tpf (see
+        get_custom_lc) instead of chronos' make_custom_lc
+    """
+    if (lctype == "custom") and mmap_tpf:
+        lc = get_custom_lc(l, l.cadence)
+    elif lctype == "custom":
+        # tpf is also called to make custom lc
+        lc = l.make_custom_lc()
+    elif lctype == "pdcsap":
+        # just downloads lightcurvefile
+        lc = l.get_lc(lctype)
+    elif lctype == "sap":
+        # just downloads lightcurvefile;
+        lc = l.get_lc(lctype)
+    elif lctype == "cdips":
+        errmsg = "cdips is only available for cadence=long"
+        assert l.cadence == "long", errmsg
+        #  just downloads fits file
+        lc = l.get_cdips_lc()
+        l.aper_mask = l.cdips.get_aper_mask_cdips()
+    elif lctype == "pathos":
+        errmsg = "pathos is only available for cadence=long"
+        assert l.cadence == "long", errmsg
+        #  just downloads fits file
+        lc = l.get_pathos_lc()
+        l.aper_mask = l.pathos.get_aper_mask_pathos()
+    else:
+        errmsg = "use lctype=[custom,sap,pdcsap,cdips,pathos]"
+        raise ValueError(errmsg)
+    return lc
+
+
+def get_sector_lcs(
+    l, lctype, sectors=None, nthreads=4, mmap_tpf=False, **target_kwargs
+):
+    """
+    download (or make) the raw lightcurves of several sectors concurrently
+
+    Parameters
+    ----------
+    l : ShortCadence or LongCadence
+        target (its own sector is reused)
+    sectors : list
+        sectors to fetch (default=l.all_sectors)
+    nthreads : int
+        number of concurrent downloads
+    mmap_tpf : bool
+        see get_raw_lc
+    target_kwargs : dict
+        passed to get_target for the other sectors (e.g. cadence, sap_mask)
+
+    Returns
+    -------
+    lcs : dict
+        raw lightcurve of each sector
+    """
+    sectors = l.all_sectors if sectors is None else sectors
+    target_kwargs.update(
+        gaiaid=None, toiid=None, coords=None, name=None, ticid=l.ticid
+    )
+
+    def _get_lc(sector):
+        if sector == l.sector:
+            return get_raw_lc(l, lctype, mmap_tpf=mmap_tpf)
+        target, _ = get_target(sector=sector, lctype=lctype, **target_kwargs)
+        return get_raw_lc(target, lctype, mmap_tpf=mmap_tpf)
+
+    # downloads are I/O bound
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        lcs = list(executor.map(_get_lc, sectors))
+    return dict(zip(sectors, lcs))
+
+
+def stitch_lcs(lcs):
+    """
+    normalize each lightcurve, remove nans and outliers and concatenate them
+
+    Parameters
+    ----------
+    lcs : dict
+        lightcurve of each sector
+
+    Returns
+    -------
+    lc : lightkurve.LightCurve
+        stitched lightcurve sorted in time
+    segments : array
+        sector of each cadence
+    """
+    lcs = {
+        sector: lc.normalize().remove_nans().remove_outliers(sigma=7)
+        for sector, lc in lcs.items()
+    }
+    sectors = sorted(lcs.keys(), key=lambda sector: lcs[sector].time[0])
+    lc = lcs[sectors[0]].append([lcs[sector] for sector in sectors[1:]])
+    segments = np.concatenate(
+        [np.full(len(lcs[sector].time), sector) for sector in sectors]
+    )
+    idx = np.argsort(lc.time, kind="stable")
+    return lc[idx], segments[idx]
+
+
+def flatten_lc(
+    lc,
+    flatten_method="biweight",
+    window_length=0.5,
+    edge_cutoff=0.1,
+    sigma=(10, 3),
+    detrender=None,
+):
+    """
+    Flatten lightcurve with wotan and remove outliers
+
+    Parameters
+    ----------
+    lc : lightkurve.LightCurve
+        normalized lightcurve
+    flatten_method : str
+        wotan flatten method or fast_biweight (tql.biweight)
+    window_length : float
+        length in days of the filter window
+    edge_cutoff : float
+        length in days to be cut off each edge of lightcurve
+    sigma : tuple
+        sigma_lower & sigma_upper for outlier rejection after flattening
+    detrender : Detrender
+        memoized trends of lc (created if None)
+
+    Returns
+    -------
+    flat, trend : lightkurve.LightCurve
+    """
+    if detrender is None:
+        detrender = Detrender(lc)
+    flat, trend = detrender.flatten(
+        flatten_method,
+        window_length,  # The length of the filter window in units of ``time``
+        edge_cutoff=edge_cutoff,
+        break_tolerance=0.1,  # Split into segments at breaks longer than that
+        cval=5.0,  # Tuning parameter for the robust estimators
+    )
+    # f > np.median(f) + 5 * np.std(f)
+    idx = sigma_clip(
+        flat.flux, sigma_lower=sigma[0], sigma_upper=sigma[1]
+    ).mask
+    return flat[~idx], trend[~idx]
+
+
+def detrend_rotation_lc(lc, mask=None, detrender=None):
+    """
+    Detrend lightcurve for the rotation periodogram with a 2nd order
+    Savitzky-Golay filter with a window of 1/10 of the data (of the longest
+    segment if detrender has segments)
+
+    Parameters
+    ----------
+    mask : array of bool
+        cadences excluded from the fit (e.g. transits)
+    detrender : Detrender
+        memoized trends of lc (created if None)
+    """
+    if detrender is None:
+        detrender = Detrender(lc)
+    ncadences = lc.time.shape[0]
+    if detrender.segments is not None:
+        # window of 1/10 of the longest segment
+        _, counts = np.unique(detrender.segments, return_counts=True)
+        ncadences = counts.max()
+    fraction = ncadences // 10
+    if fraction % 2 == 0:
+        fraction += 1  # add 1 if even
+    dlc, _ = detrender.flatten(
+        "lk_savgol", fraction, mask=mask, polyorder=2, break_tolerance=10
+    )
+    return dlc
+
+
+def get_ls_periodogram(dlc, mask=None, Prot_max=None):
+    """
+    Lomb-scargle periodogram of the detrended lightcurve with the fast
+    method; see rotation.get_rotation_periodogram
+
+    Parameters
+    ----------
+    mask : array of bool
+        cadences to exclude (e.g. transits)
+    Prot_max : float
+        longest period in days (default=baseline/2)
+
+    Returns
+    -------
+    ls_results : dict
+        ls_periods, ls_powers, Prot_ls, Prot_ls_err, amp_ls, amp_ls_err
+        and ls_model (phase-folded sine model at Prot_ls)
+    """
+    mask = np.zeros(len(dlc.time), dtype=bool) if mask is None else mask
+    time, flux = dlc.time[~mask], dlc.flux[~mask]
+    return get_rotation_periodogram(time, flux, Prot_max=Prot_max)
+
+
+def get_gls(dlc, mask=None, use_err=True, verbose=True):
+    """
+    Generalized Lomb-Scargle periodogram of the detrended lightcurve
+    """
+    from chronos.gls import Gls
+
+    mask = np.zeros(len(dlc.time), dtype=bool) if mask is None else mask
+    if use_err:
+        data = (dlc.time[~mask], dlc.flux[~mask], dlc.flux_err[~mask])
+    else:
+        data = (dlc.time[~mask], dlc.flux[~mask])
+    return Gls(data, Pbeg=0.1, verbose=verbose)
+
+
+def get_results_gls(results, verbose=True):
+    """
+    Generalized Lomb-Scargle of the output of run_tql, computed only when
+    first requested (e.g. render_tql with run_gls=True)
+    """
+    if results.get("gls") is None:
+        results["gls"] = get_gls(
+            results.dlc,
+            mask=results.rot_mask,
+            use_err=results.lctype != "pathos",
+            verbose=verbose,
+        )
+    return results.gls
+
+
+# tls computes its grids in the (private) _grids method overridden by
+# _GridTLS; without it grid_cache would silently do nothing
+HAS_TLS_GRIDS = callable(getattr(tls, "_grids", None))
+if not HAS_TLS_GRIDS:
+    warnings.warn(
+        "transitleastsquares has no _grids method: the period grid is not "
+        "shared between searches"
+    )
+
+
+class _GridTLS(tls):
+    """
+    tls which memoizes its period grid in grid_cache so that searches of
+    the same lightcurve (e.g. with transits masked) share it; the duration
+    grid depends on the number of data points and is computed by each
+    search as in tls
+    """
+
+    def __init__(self, *args, grid_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.grid_cache = {} if grid_cache is None else grid_cache
+
+    def _grids(self):
+        if "periods" not in self.grid_cache:
+            periods, durations = super()._grids()
+            self.grid_cache["periods"] = periods
+            return periods, durations
+        periods = self.grid_cache["periods"]
+        durations = duration_grid(
+            periods,
+            shortest=1 / len(self.t),
+            log_step=self.duration_grid_step,
+            R_star_min=self.R_star_min,
+            R_star_max=self.R_star_max,
+            M_star_min=self.M_star_min,
+            M_star_max=self.M_star_max,
+        )
+        return periods, durations
+
+
+def get_tls_results(
+    flat,
+    Rstar=1.0,
+    Mstar=1.0,
+    period_min=0.1,
+    period_max=None,
+    use_err=True,
+    oversampling_factor=3,
+    grid_cache=None,
+):
+    """
+    Transit Least Squares search on the flattened lightcurve
+
+    Parameters
+    ----------
+    Rstar, Mstar : float
+        stellar radius and mass in solar units (priors of tls)
+    period_min, period_max : float
+        period search limits in days (default=0.1, baseline/2)
+    use_err : bool
+        use flux_err (somewhat improves SDE)
+    oversampling_factor : int
+        oversampling of the period grid (default of tls=3)
+    grid_cache : dict
+        period grid shared between searches of the same lightcurve (filled
+        by the first search; ignored if not HAS_TLS_GRIDS)
+
+    Returns
+    -------
+    tls_results : transitleastsquares.results
+    """
+    if period_max is None:
+        period_max = int(flat.time[-1] - flat.time[0]) / 2
+    if use_err:
+        data = flat.time, flat.flux, flat.flux_err
+    else:
+        data = flat.time, flat.flux
+    model = (
+        _GridTLS(*data, grid_cache=grid_cache) if HAS_TLS_GRIDS else tls(*data)
+    )
+    tls_results = model.power(
+        R_star=Rstar,  # 0.13-3.5 default
+        R_star_max=Rstar + 0.1 if Rstar > 3.5 else 3.5,
+        M_star=Mstar,  # 0.1-1
+        M_star_max=Mstar + 0.1 if Mstar > 1.0 else 1.0,
+        period_min=period_min,  # Roche limit default
+        period_max=period_max,
+        n_transits_min=2,  # default
+        oversampling_factor=oversampling_factor,
+    )
+    return tls_results
+
+
+def get_candidate_row(tls_results):
+    """
+    scalars of a transit candidate, see CANDIDATE_COLUMNS
+    """
+    return {key: tls_results[key] for key in CANDIDATE_COLUMNS}
+
+
+def search_planets(
+    flat,
+    tls_results=None,
+    sde_min=7.0,
+    max_planets=5,
+    mask_factor=2.0,
+    fast_search=False,
+    grid_cache=None,
+    verbose=True,
+    **kwargs,
+):
+    """
+    Iterative transit search: the transits of each candidate are masked
+    and tls is run again on the remaining data until SDE < sde_min.
+    The flattened lightcurve and the period grid are reused in every
+    iteration.
+
+    Parameters
+    ----------
+    flat : lightkurve.LightCurve
+        flattened lightcurve
+    tls_results : transitleastsquares.results
+        result of a previous search of flat (e.g. run_tql) used as the
+        first candidate instead of running tls again
+    sde_min : float
+        stop when the SDE of the search is below this
+    max_planets : int
+        maximum number of candidates
+    mask_factor : float
+        width of the masked window in units of the transit duration
+    fast_search : bool
+        use the coarse-to-fine search (see search.get_tls_results_fast)
+    grid_cache : dict
+        see get_tls_results
+    kwargs : dict
+        passed to get_tls_results (e.g. Rstar, Mstar, period_min,
+        period_max, use_err)
+
+    Returns
+    -------
+    candidates : list of transitleastsquares.results
+        with SDE >= sde_min, in order of detection
+    """
+    grid_cache = {} if grid_cache is None else grid_cache
+    if kwargs.get("period_max") is None:
+        # keep the period range of the unmasked lightcurve
+        kwargs["period_max"] = int(flat.time[-1] - flat.time[0]) / 2
+    search = get_tls_results_fast if fast_search else get_tls_results
+    mask = np.zeros(len(flat.time), dtype=bool)
+    candidates = []
+    while len(candidates) < max_planets:
+        if tls_results is None:
+            tls_results = search(flat[~mask], grid_cache=grid_cache, **kwargs)
+        if not np.isfinite(tls_results.SDE) or tls_results.SDE < sde_min:
+            break
+        candidates.append(tls_results)
+        if verbose:
+            print(
+                f"Candidate {len(candidates)}: "
+                f"P={tls_results.period:.4f} d (SDE={tls_results.SDE:.2f})"
+            )
+        mask |= get_transit_mask(
+            flat,
+            tls_results.period,
+            tls_results.T0,
+            tls_results.duration * 24 * mask_factor,
+        )
+        tls_results = None
+    return candidates
+
+
+def get_tpf(l, cadence):
+    """
+    reuse the tpf if it was already downloaded (e.g. custom lc)
+    """
+    if cadence == "short":
+        if l.tpf is None:
+            # e.g. pdcsap, sap
+            tpf = l.get_tpf()
+        else:
+            # e.g. custom
+            tpf = l.tpf
+    else:
+        if l.tpf_tesscut is None:
+            # e.g. cdips
+            tpf = l.get_tpf_tesscut()
+        else:
+            # e.g. custom
+            tpf = l.tpf_tesscut
+    return tpf
+
+
+def get_cube(l, cadence):
+    """
+    memory-mapped cube of the tpf (see tpf.TpfCube), kept on the target so
+    that its median image is computed once; None if the tpf cannot be
+    mapped (e.g. compressed file)
+    """
+    if getattr(l, "tpf_cube", None) is None:
+        l.tpf_cube = get_tpf_cube(get_tpf(l, cadence))
+    return l.tpf_cube
+
+
+def get_custom_lc(l, cadence):
+    """
+    aperture photometry of the tpf (short cadence) or TESSCut cutout (long
+    cadence) read in chunks of cadences through a memory map (see
+    tpf.TpfCube); the background of TESSCut cutouts (median of the faint
+    pixels outside the aperture) is subtracted. Unlike chronos'
+    make_custom_lc, no pixel level decorrelation is done since it needs
+    the whole cube.
+
+    Returns
+    -------
+    lc : lightkurve.LightCurve
+    """
+    tpf = get_tpf(l, cadence)
+    cube = get_cube(l, cadence)
+    if cube is None:
+        # e.g. compressed file
+        return l.make_custom_lc()
+    l.aper_mask = get_aperture_mask(
+        tpf,
+        sap_mask=l.sap_mask,
+        aper_radius=l.aper_radius,
+        percentile=l.percentile,
+        threshold_sigma=l.threshold_sigma,
+        cube=cube,
+    )
+    bkg_mask = None
+    if cadence == "long":
+        bkg_mask = get_background_mask(cube.get_median_image(), l.aper_mask)
+    time, flux, flux_err = cube.get_aperture_lc(l.aper_mask, bkg_mask)
+    idx = np.isfinite(time) & np.isfinite(flux) & np.isfinite(flux_err)
+    return lk.LightCurve(
+        time=time[idx], flux=flux[idx], flux_err=flux_err[idx]
+    )
+
+
+def get_contratio(l, tpf, cube=None):
+    """
+    flux contamination ratio of gaia sources within the aperture mask;
+    the mask and the positions of the sources are taken from the
+    memory-mapped cube of the tpf (see get_cube) if given, so that
+    tpf.flux is never read
+    """
+    if l.contratio is None:
+        # also computed in make_custom_lc()
+        l.aper_mask = get_aperture_mask(
+            tpf,
+            sap_mask=l.sap_mask,
+            aper_radius=l.aper_radius,
+            percentile=l.percentile,
+            threshold_sigma=l.threshold_sigma,
+            cube=cube,
+        )
+        if (cube is None) or (cube.wcs is None):
+            fluxes = get_fluxes_within_mask(tpf, l.aper_mask, l.gaia_sources)
+            l.contratio = sum(fluxes) - 1  # c.f. l.tic_params.contratio
+        else:
+            l.contratio = get_contratios(cube, [l.aper_mask], l.gaia_sources)[
+                0
+            ]
+    return l.contratio
+
+
+def get_star_params(l, vizier=None):
+    """
+    stellar parameters from StarHorse, TIC and Gaia DR2 (in that order)
+
+    Parameters
+    ----------
+    vizier : astroquery.utils.TableList
+        output of l.query_vizier (queried if None)
+
+    Returns
+    -------
+    star_params : dict
+    """
+    tp, gp = l.tic_params, l.gaia_params
+    # query starhorse star params
+    if vizier is None:
+        vizier = l.query_vizier(verbose=False)
+    starhorse = (
+        vizier["I/349/starhorse"]
+        if "I/349/starhorse" in vizier.keys()
+        else None
+    )
+    Mstar = (
+        np.nan if starhorse is None else starhorse["mass50"].quantity[0].value
+    )
+    Teff = (
+        np.nan if starhorse is None else starhorse["teff50"].quantity[0].value
+    )
+    logg = (
+        np.nan if starhorse is None else starhorse["logg50"].quantity[0].value
+    )
+    met = np.nan if starhorse is None else starhorse["met50"].quantity[0].value
+    if (tp["rad"] is None) or (str(tp["rad"]) == "nan"):
+        # use gaia Rstar if TIC Rstar is nan
+        Rstar = gp.radius_val
+        siglo = gp.radius_percentile_lower
+        sighi = gp.radius_percentile_upper
+        Rstar_err = get_err_quadrature(Rstar - siglo, sighi - Rstar)
+    else:
+        Rstar, Rstar_err = tp["rad"], tp["e_rad"]
+    eteff = "nan" if str(tp["e_Teff"]).lower() == "nan" else int(tp["e_Teff"])
+    logg = tp["logg"] if str(logg) == "nan" else logg
+    met = tp["MH"] if str(met) == "nan" else met
+    return dict(
+        Rstar=Rstar,
+        Rstar_err=Rstar_err,
+        Mstar=Mstar,
+        Teff=Teff,
+        eteff=eteff,
+        logg=logg,
+        met=met,
+    )
+
+
+def get_target_info(l, lctype, cadence, sectors=None):
+    """
+    target fields of the results of run_tql; sector is the first of the
+    sectors of a stitched lightcurve
+    """
+    return dict(
+        ticid=l.ticid,
+        gaiaid=l.gaiaid,
+        toiid=l.toiid,
+        sector=l.sector if sectors is None else min(sectors),
+        sectors=sectors,
+        mission=l.mission,
+        all_sectors=(
+            l.all_sectors if l.mission == "tess" else l.all_campaigns
+        ),
+        cadence=cadence,
+        lctype=lctype,
+        sap_mask=l.sap_mask,
+        aper_radius=l.aper_radius,
+        threshold_sigma=l.threshold_sigma,
+        percentile=l.percentile,
+    )
+
+
+def get_sector_label(results):
+    """
+    e.g. 1, or 1-3,5 for a lightcurve stitched from sectors 1, 2, 3 and 5
+    (runs of consecutive sectors are joined by a dash)
+    """
+    sectors = results.get("sectors")
+    if (sectors is None) or (len(sectors) == 1):
+        return results["sector"]
+    runs = []
+    for sector in sorted(sectors):
+        if (len(runs) > 0) and (sector == runs[-1][1] + 1):
+            runs[-1][1] = sector
+        else:
+            runs.append([sector, sector])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}"
+        for first, last in runs
+    )
+
+
+def get_output_prefix(results, outdir="."):
+    """
+    path prefix of the figure and tls output files of a target
+    """
+    return os.path.join(
+        outdir,
+        f"tic{results.ticid}_s{get_sector_label(results)}_{results.lctype}_{results.cadence[0]}c",
+    )
+
+
+def save_timings(results, outdir="."):
+    """
+    save the stage timings of a run as json alongside its outputs
+    """
+    fp = get_output_prefix(results, outdir) + "_timings.json"
+    extra = dict(
+        ticid=results.ticid,
+        sector=results.sector,
+        sectors=results.get("sectors"),
+        lctype=results.lctype,
+        cadence=results.cadence,
+        ndata=len(results.lc.time),
+    )
+    results.timings.save(fp, extra=extra)
+    return fp
+
+
+def save_tls(results, fp):
+    """
+    save tls_results together with the raw and flattened lightcurves
+    """
+    import deepdish as dd
+
+    tls_results = results.tls_results
+    tls_results["gaiaid"] = results.gaiaid
+    tls_results["ticid"] = results.ticid
+    dd.io.save(fp, tls_results)
+
+
+def get_picklable_results(results):
+    """
+    copy of the output of run_tql that can be pickled (e.g. sent to a writer
+    process or cached): the memoized trends and the GLS (recomputed by
+    get_results_gls if needed) are dropped and the tpf is replaced by its
+    path (re-read by load_tpf)
+    """
+    results = results.__class__(results)
+    _ = results.pop("detrender", None)
+    results["gls"] = None
+    tpf = results.get("tpf")
+    fp = getattr(tpf, "path", None)
+    results["tpf"] = None
+    if isinstance(fp, str) and os.path.isfile(fp):
+        results["tpf_path"] = fp
+        results["tpf_quality_bitmask"] = tpf.quality_bitmask
+    return results
+
+
+def load_tpf(results):
+    """
+    re-read the tpf of results made by get_picklable_results (if any)
+    """
+    fp = results.get("tpf_path")
+    if (results.get("tpf") is None) and (fp is not None):
+        results["tpf"] = lk.read(
+            fp, quality_bitmask=results["tpf_quality_bitmask"]
+        )
+    return results
+
+
+def load_cached_results(results_cache, results_key, timings=None):
+    """
+    results of a previous run from the results cache (see
+    cache.get_results_key), with cached=True and their tpf re-read;
+    None if not cached
+    """
+    results = results_cache.get(results_key)
+    if results is None:
+        return None
+    timings = StageTimer() if timings is None else timings
+    results.update(cached=True, timings=timings)
+    return load_tpf(results)
+
+
+def save_outputs(
+    results, savetls=False, outdir=".", store=None, float32=False, verbose=True
+):
+    """
+    save the tls results of run_tql in outdir (if savetls) and add them to
+    a ResultStore (if store)
+    """
+    timings = results.timings
+    if savetls and (results.tls_results is not None):
+        if (outdir is not None) & (not os.path.exists(outdir)):
+            os.makedirs(outdir)
+        fp = get_output_prefix(results, outdir) + "_tls.h5"
+        with timings.stage("save_tls"):
+            save_tls(results, fp)
+        if verbose:
+            print(f"Saved: {fp}")
+    if store is not None:
+        from tql.store import ResultStore
+
+        with timings.stage("save_tls"):
+            with ResultStore(store, float32=float32) as s:
+                s.add(results)
+        if verbose:
+            print(f"Saved: {store}")
+    return results
+
+
+def run_tql(
+    gaiaid=None,
+    toiid=None,
+    ticid=None,
+    coords=None,
+    name=None,
+    sector=None,
+    search_radius=3,
+    cadence="short",
+    lctype=None,  # custom, pdcsap, sap, custom
+    sap_mask=None,
+    aper_radius=1,
+    threshold_sigma=5,
+    percentile=90,
+    cutout_size=(12, 12),
+    quality_bitmask="default",
+    apply_data_quality_mask=False,
+    flatten_method="biweight",
+    window_length=0.5,  # deprecated for lk's flatten in ncadences
+    Porb_limits=None,
+    use_star_priors=False,
+    edge_cutoff=0.1,
+    sigma=(10, 3),
+    find_cluster=False,
+    savetls=False,
+    outdir=".",
+    nearby_gaia_radius=120,  # arcsec
+    bin_hr=None,
+    run_gls=False,
+    triage=False,
+    bls_sde_min=7.0,
+    bls_snr_min=7.0,
+    fast_search=False,
+    max_planets=1,
+    planet_sde_min=7.0,
+    sectors=None,
+    nthreads=4,
+    mmap_tpf=False,
+    store=None,
+    float32=False,
+    cache_dir=CATALOG_CACHE_DIR,
+    offline=False,
+    results_cache_dir=None,
+    target=None,
+    raw_lc=None,
+    timings=None,
+    verbose=True,
+    clobber=False,
+):
+    """
+    Run the tql analysis without making any figure.
+    See plot_tql for the description of parameters.
+
+    Parameters
+    ----------
+    run_gls : bool
+        also run the Generalized Lomb Scargle (slow); Prot_ls, amp_ls and
+        their uncertainties are always derived from the Lomb-Scargle
+        periodogram
+    triage : bool
+        run a box least squares search first and stop before tls (and the
+        tpf, catalog queries etc.) unless its SDE >= bls_sde_min and SNR
+        >= bls_snr_min; the results of rejected targets have
+        tls_results=None and the BLS summary in bls_results
+    bls_sde_min, bls_snr_min : float
+        thresholds of the triage
+    fast_search : bool
+        coarse-to-fine transit search: tls on the binned lightcurve and a
+        coarse period grid, refined around the top peaks at full resolution
+        (see search.get_tls_results_fast)
+    max_planets : int
+        maximum number of candidates of the iterative transit search;
+        transits of each candidate are masked and tls is run again
+        (default=1: single search)
+    planet_sde_min : float
+        the iterative search stops when SDE < planet_sde_min; only
+        candidates (including the first) with SDE >= planet_sde_min are
+        kept in candidates
+    sectors : list or str
+        analyze the stitched lightcurve of these sectors ("all"=all
+        available sectors) instead of a single sector; the tpf, its image
+        and the contamination ratio are those of the sector of the target
+        (tpf_sector in the results)
+    nthreads : int
+        number of concurrent sector downloads
+    mmap_tpf : bool
+        make custom lightcurves by aperture photometry of the
+        memory-mapped tpf in chunks of cadences (see get_custom_lc)
+    target : tuple or callable
+        (lightcurve, lctype) from load_target to reuse instead of
+        instantiating the target again (e.g. in a parameter sweep), or a
+        function returning it, called only if the results are not cached
+    raw_lc : lightkurve.LightCurve or callable
+        raw lightcurve of target to reuse instead of downloading it, or a
+        function returning it (None=download)
+    store : str
+        path of a ResultStore (e.g. outdir/tql_results.h5) where the
+        results are added
+    float32 : bool
+        downcast arrays added to store to float32
+    results_cache_dir : str
+        cache of results keyed by the hash of the target, parameters and
+        code version (see cache.get_results_key); results of a previous run
+        with the same key are returned without recomputing them unless
+        clobber=True (None=no cache; the tql script and run_batch use
+        config.RESULTS_CACHE_DIR). Results are stored under the sector(s)
+        they were computed on, so that runs with sector=None or
+        sectors="all" are not served from the cache (which would not know
+        of newer sectors). target and raw_lc should match
+        the other arguments since they are not part of the key.
+    timings : StageTimer
+        records the wall/cpu time of each stage (created if None)
+
+    Returns
+    -------
+    results : TqlResults
+        orbital & rotation periods, SDE, depth, Rp, odd-even mismatch,
+        stellar parameters together with the lightcurves, periodograms,
+        tls_results and tpf needed to render the figure, and timings
+    """
+    params = {k: v for k, v in locals().items() if k in RESULTS_KEY_PARAMS}
+    timings = StageTimer() if timings is None else timings
+    output_kwargs = dict(
+        savetls=savetls,
+        outdir=outdir,
+        store=store,
+        float32=float32,
+        verbose=verbose,
+    )
+    results_cache, results_key = None, None
+    if results_cache_dir is not None:
+        results_cache = get_results_cache(results_cache_dir)
+        results = None
+        # otherwise the sector(s) are known only once the target is loaded
+        if is_resolved(params) and (not clobber):
+            results_key = get_results_key(params)
+            results = load_cached_results(results_cache, results_key, timings)
+        if results is not None:
+            if verbose:
+                print("Loaded results from cache (use clobber to re-run)")
+            return save_outputs(results, **output_kwargs)
+    if Porb_limits is not None:
+        # assert isinstance(Porb_limits, list)
+        assert len(Porb_limits) == 2, "period_min, period_max"
+        Porb_min = Porb_limits[0] if Porb_limits[0] > 0.1 else None
+        Porb_max = Porb_limits[1] if Porb_limits[1] > 1 else None
+    else:
+        Porb_min, Porb_max = None, None
+    cache = _get_cache(cache_dir, offline)
+    if target is None:
+        l, lctype = load_target(
+            gaiaid=gaiaid,
+            toiid=toiid,
+            ticid=ticid,
+            coords=coords,
+            name=name,
+            sector=sector,
+            search_radius=search_radius,
+            cadence=cadence,
+            lctype=lctype,
+            sap_mask=sap_mask,
+            aper_radius=aper_radius,
+            threshold_sigma=threshold_sigma,
+            percentile=percentile,
+            cutout_size=cutout_size,
+            quality_bitmask=quality_bitmask,
+            apply_data_quality_mask=apply_data_quality_mask,
+            cache_dir=cache_dir,
+            offline=offline,
+            timings=timings,
+            verbose=verbose,
+            clobber=clobber,
+        )
+    else:
+        l, lctype = target() if callable(target) else target
+    if callable(raw_lc):
+        raw_lc = raw_lc()
+    if cadence == "long":
+        bin_hr = 4 if bin_hr is None else bin_hr
+        # cad = np.median(np.diff(time))
+        cad = 30 / 60 / 24
+    else:
+        bin_hr = 0.5 if bin_hr is None else bin_hr
+        cad = 2 / 60 / 24
+
+    # +++++++++++++++++++++ raw lc
+    segments = None
+    if (raw_lc is not None) and (sectors is not None):
+        raise ValueError("raw_lc is a single sector: do not give sectors")
+    elif raw_lc is not None:
+        lc = raw_lc
+    elif sectors is not None:
+        sectors = l.all_sectors if sectors == "all" else sectors
+        with timings.stage("lc_download"):
+            lcs = get_sector_lcs(
+                l,
+                lctype,
+                sectors=sectors,
+                nthreads=nthreads,
+                mmap_tpf=mmap_tpf,
+                search_radius=search_radius,
+                cadence=cadence,
+                sap_mask=sap_mask,
+                aper_radius=aper_radius,
+                threshold_sigma=threshold_sigma,
+                percentile=percentile,
+                cutout_size=cutout_size,
+                quality_bitmask=quality_bitmask,
+                apply_data_quality_mask=apply_data_quality_mask,
+                verbose=False,
+                clobber=clobber,
+            )
+        with timings.stage("stitch"):
+            lc, segments = stitch_lcs(lcs)
+        sectors = sorted(lcs.keys())
+    else:
+        with timings.stage("lc_download"):
+            lc = get_raw_lc(l, lctype, mmap_tpf=mmap_tpf)
+    if results_cache is not None:
+        # stored under the resolved sector(s)
+        if sectors is None:
+            params["sector"] = l.sector
+        else:
+            params["sectors"] = sectors
+        results_key = get_results_key(params)
+
+    # +++++++++++++++++++++ flatten
+    if segments is None:
+        lc = lc.normalize().remove_nans().remove_outliers(sigma=7)
+    time = lc.time
+    if use_star_priors:
+        # for wotan and tls.power
+        Rstar = l.tic_params["rad"] if l.tic_params["rad"] is not None else 1.0
+        Mstar = (
+            l.tic_params["mass"] if l.tic_params["mass"] is not None else 1.0
+        )
+        Porb = 10  # TODO: arbitrary default!
+        tdur = estimate_transit_duration(
+            R_s=Rstar, M_s=Mstar, P=Porb, small_planet=True
+        )
+        window_length = tdur * 3  # overrides default
+
+    else:
+        Rstar, Mstar = 1.0, 1.0
+
+    baseline = int(time[-1] - time[0])
+    Prot_max = baseline / 2
+
+    if l.toi_params is not None:
+        rot_mask = get_transit_mask(
+            lc,
+            period=l.toi_period,
+            epoch=l.toi_epoch - TESS_TIME_OFFSET,
+            duration_hours=l.toi_duration,
+        )
+    else:
+        rot_mask = np.zeros_like(time, dtype=bool)
+
+    # trends for the transit search and the rotation periodogram
+    detrender = Detrender(lc, segments=segments)
+    with timings.stage("detrend"):
+        flat, trend = flatten_lc(
+            lc,
+            flatten_method=flatten_method,
+            window_length=window_length,
+            edge_cutoff=edge_cutoff,
+            sigma=sigma,
+            detrender=detrender,
+        )
+        dlc = detrend_rotation_lc(lc, mask=rot_mask, detrender=detrender)
+
+    # +++++++++++++++++++++ Lomb-scargle periodogram
+    with timings.stage("lomb_scargle"):
+        ls_results = get_ls_periodogram(dlc, mask=rot_mask, Prot_max=Prot_max)
+
+    # +++++++++++++++++++++ BLS triage
+    period_min = 0.1 if Porb_min is None else Porb_min
+    period_max = baseline / 2 if Porb_max is None else Porb_max
+    bls_results = None
+    if triage:
+        with timings.stage("bls"):
+            bls_results = get_bls_results(
+                flat,
+                Rstar=Rstar,
+                Mstar=Mstar,
+                period_min=period_min,
+                period_max=period_max,
+                use_err=lctype != "pathos",
+            )
+        if not passes_triage(bls_results, bls_sde_min, bls_snr_min):
+            if verbose:
+                print(
+                    "Rejected by BLS triage: SDE={bls_SDE:.2f}, "
+                    "SNR={bls_snr:.2f}".format(**bls_results)
+                )
+            results = TqlResults(
+                **get_target_info(l, lctype, cadence, sectors),
+                SDE=np.nan,
+                lc=lc,
+                flat=flat,
+                trend=trend,
+                dlc=dlc,
+                detrender=detrender,
+                Prot_ls=ls_results["Prot_ls"],
+                Prot_ls_err=ls_results["Prot_ls_err"],
+                amp_ls=ls_results["amp_ls"],
+                amp_ls_err=ls_results["amp_ls_err"],
+                bls_results=bls_results,
+                tls_results=None,
+                timings=timings,
+            )
+            if results_cache is not None:
+                results_cache.set(results_key, get_picklable_results(results))
+            return save_outputs(results, **output_kwargs)
+    gls = None
+    if run_gls:
+        with timings.stage("gls"):
+            gls = get_gls(
+                dlc,
+                mask=rot_mask,
+                use_err=lctype != "pathos",
+                verbose=verbose,
+            )
+
+    # +++++++++++++++++++++ TLS periodogram
+    tls_kwargs = dict(
+        Rstar=Rstar,
+        Mstar=Mstar,
+        period_min=period_min,
+        period_max=period_max,
+        # pathos do not have flux_err
+        use_err=lctype != "pathos",
+    )
+    grid_cache = {}
+    search = get_tls_results_fast if fast_search else get_tls_results
+    with timings.stage("tls_power"):
+        tls_results = search(flat, grid_cache=grid_cache, **tls_kwargs)
+    # only the first search if max_planets=1
+    with timings.stage("tls_multi"):
+        candidates = search_planets(
+            flat,
+            tls_results=tls_results,
+            sde_min=planet_sde_min,
+            max_planets=max_planets,
+            fast_search=fast_search,
+            grid_cache=grid_cache,
+            verbose=verbose and (max_planets > 1),
+            **tls_kwargs,
+        )
+    # transit mask
+    transit_mask = get_transit_mask(
+        flat, tls_results.period, tls_results.T0, tls_results.duration * 24
+    )
+
+    # +++++++++++++++++++++ tpf & contamination
+    with timings.stage("tpf_download"):
+        tpf = get_tpf(l, cadence)
+        cube = get_cube(l, cadence)
+    with timings.stage("gaia_sources_query"):
+        _ = query_gaia_sources(l, radius=nearby_gaia_radius, cache=cache)
+    with timings.stage("contratio"):
+        contratio = get_contratio(l, tpf, cube)
+
+    # +++++++++++++++++++++ stellar & planet parameters
+    with timings.stage("starhorse_query"):
+        vizier = query_vizier(l, cache=cache)
+    star_params = get_star_params(l, vizier=vizier)
+    Rp = tls_results["rp_rs"] * star_params["Rstar"] * u.Rsun.to(u.Rearth)
+    # np.sqrt(tls_results["depth"]*(1+l.contratio))
+    Rp_true = Rp * np.sqrt(1 + contratio)
+
+    cluster = None
+    if find_cluster:
+        with timings.stage("find_cluster"):
+            if is_gaiaid_in_cluster(
+                l.gaiaid, catalog_name="CantatGaudin2020", verbose=True
+            ):
+                # function prints output
+                cluster_params = l.get_cluster_membership()
+                cluster = cluster_params.Cluster
+
+    # add details to tls_results
+    tls_results["time_raw"] = lc.time
+    tls_results["flux_raw"] = lc.flux
+    tls_results["time_flat"] = flat.time
+    tls_results["flux_flat"] = flat.flux
+    target_info = get_target_info(l, lctype, cadence, sectors)
+    tls_results["ticid"] = l.ticid
+    tls_results["sector"] = target_info["sector"]
+    tls_results["sectors"] = sectors
+    tls_results["nsectors"] = 1 if sectors is None else len(sectors)
+    tls_results["cont_ratio"] = contratio
+    tls_results["tpf_sector"] = l.sector
+    tls_results["Rp"] = Rp
+    # add rotation results
+    tls_results["Prot_ls"] = (ls_results["Prot_ls"], ls_results["Prot_ls_err"])
+    tls_results["amp_ls"] = (ls_results["amp_ls"], ls_results["amp_ls_err"])
+    tls_results["candidates"] = [get_candidate_row(c) for c in candidates]
+    if bls_results is not None:
+        tls_results.update(bls_results)
+    if gls is not None:
+        tls_results["Prot_gls"] = (gls.hpstat["P"], gls.hpstat["e_P"])
+        tls_results["amp_gls"] = (gls.hpstat["amp"], gls.hpstat["e_amp"])
+
+    results = TqlResults(
+        # target
+        **target_info,
+        cluster=cluster,
+        # candidate
+        SDE=tls_results.SDE,
+        period=tls_results.period,
+        period_uncertainty=tls_results.period_uncertainty,
+        T0=tls_results.T0,
+        duration=tls_results.duration,
+        depth=tls_results.depth,
+        odd_even_mismatch=tls_results.odd_even_mismatch,
+        Rp=Rp,
+        Rp_true=Rp_true,
+        contratio=contratio,
+        candidates=tls_results["candidates"],
+        # rotation
+        Prot_ls=ls_results["Prot_ls"],
+        Prot_ls_err=ls_results["Prot_ls_err"],
+        amp_ls=ls_results["amp_ls"],
+        amp_ls_err=ls_results["amp_ls_err"],
+        Prot_gls=tls_results.get("Prot_gls"),
+        amp_gls=tls_results.get("amp_gls"),
+        # stars
+        tic_params=l.tic_params,
+        gaia_params=l.gaia_params,
+        **star_params,
+        # data products
+        lc=lc,
+        flat=flat,
+        trend=trend,
+        detrender=detrender,
+        rot_mask=rot_mask,
+        rot_masked=l.toi_params is not None,
+        transit_mask=transit_mask,
+        ls_periods=ls_results["ls_periods"],
+        ls_powers=ls_results["ls_powers"],
+        ls_model=ls_results["ls_model"],
+        dlc=dlc,
+        gls=gls,
+        bls_results=bls_results,
+        tls_results=tls_results,
+        period_min=period_min,
+        period_max=period_max,
+        bin_hr=bin_hr,
+        cadence_days=cad,
+        tpf=tpf,
+        tpf_sector=l.sector,
+        aper_mask=getattr(l, "aper_mask", None),
+        gaia_sources=l.gaia_sources,
+        timings=timings,
+    )
+    if results_cache is not None:
+        results_cache.set(results_key, get_picklable_results(results))
+    return save_outputs(results, **output_kwargs)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Detrending engine shared by the stages and panels of a tql run.
+
+Trends of a lightcurve are computed once and memoized on
+(method, window_length, mask, options), so that e.g. the transit search,
+the rotation periodogram and the raw lightcurve panel reuse them.
+"""
+
+import hashlib
+
+import numpy as np
+from wotan import flatten
+
+from tql.biweight import sliding_biweight
+
+# lightkurve's Savitzky-Golay filter; window_length in cadences
+LK_METHODS = ["lk_savgol"]
+# tql's sliding-window biweight (see tql.biweight)
+FAST_METHODS = ["fast_biweight"]
+
+
+def get_mask_key(mask):
+    """
+    hashable key of a boolean mask (None if nothing is masked)
+    """
+    if (mask is None) or (not np.any(mask)):
+        return None
+    return hashlib.sha1(np.packbits(mask)).hexdigest()
+
+
+def _get_trend(lc, method, window_length, mask, **kwargs):
+    if get_mask_key(mask) is None:
+        mask = None
+    if method in LK_METHODS:
+        _, trend = lc.flatten(
+            window_length=window_length,
+            mask=mask,
+            return_trend=True,
+            **kwargs,
+        )
+        return np.asarray(trend.flux)
+    if method in FAST_METHODS:
+        return sliding_biweight(
+            getattr(lc.time, "value", lc.time),
+            getattr(lc.flux, "value", lc.flux),
+            window_length=window_length,
+            mask=mask,
+            **kwargs,
+        )
+    if mask is not None:
+        kwargs["mask"] = mask
+    return flatten(
+        lc.time,
+        lc.flux,
+        method=method,
+        window_length=window_length,
+        return_trend=True,
+        **kwargs,
+    )[1]
+
+
+class Detrender:
+    """
+    Compute and memoize the trends of a lightcurve, e.g.
+
+    >>> detrender = Detrender(lc)
+    >>> flat, trend = detrender.flatten("biweight", 0.5, edge_cutoff=0.1)
+    >>> dlc, _ = detrender.flatten("lk_savgol", 1001, mask=rot_mask)
+
+    Parameters
+    ----------
+    lc : lightkurve.LightCurve
+        normalized lightcurve
+    segments : array
+        label (e.g. sector) of each cadence; each segment of a stitched
+        lightcurve is detrended on its own
+    """
+
+    def __init__(self, lc, segments=None):
+        self.lc = lc
+        self.segments = segments
+        self._trends = {}
+        self.ncomputed = 0
+
+    def __repr__(self):
+        return f"Detrender({len(self._trends)} trends)"
+
+    def get_trend(
+        self, method="biweight", window_length=0.5, mask=None, **kwargs
+    ):
+        """
+        trend of the lightcurve
+
+        Parameters
+        ----------
+        method : str
+            wotan flatten method, fast_biweight (tql.biweight) or lk_savgol
+            (lightkurve)
+        window_length : float
+            filter window in days, or cadences for lk_savgol
+        mask : array of bool
+            cadences excluded from the fit (e.g. transits)
+        kwargs : dict
+            passed to wotan.flatten, sliding_biweight or
+            lightkurve.LightCurve.flatten
+
+        Returns
+        -------
+        trend : array
+        """
+        key = (
+            method,
+            window_length,
+            get_mask_key(mask),
+            tuple(sorted(kwargs.items())),
+        )
+        if key not in self._trends:
+            self._trends[key] = self._compute_trend(
+                method, window_length, mask, **kwargs
+            )
+            self.ncomputed += 1
+        return self._trends[key]
+
+    def _compute_trend(self, method, window_length, mask, **kwargs):
+        if self.segments is None:
+            return _get_trend(self.lc, method, window_length, mask, **kwargs)
+        trend = np.empty(len(self.lc.time))
+        for segment in np.unique(self.segments):
+            idx = self.segments == segment
+            trend[idx] = _get_trend(
+                self.lc[idx],
+                method,
+                window_length,
+                None if mask is None else mask[idx],
+                **kwargs,
+            )
+        return trend
+
+    def flatten(
+        self, method="biweight", window_length=0.5, mask=None, **kwargs
+    ):
+        """
+        lightcurve divided by its (memoized) trend
+
+        Returns
+        -------
+        flat, trend : lightkurve.LightCurve
+        """
+        trend_flux = self.get_trend(method, window_length, mask, **kwargs)
+        flat = self.lc.copy()
+        flat.flux = self.lc.flux / trend_flux
+        flat.flux_err = self.lc.flux_err / trend_flux
+        trend = self.lc.copy()
+        trend.flux = trend_flux
+        return flat, trend
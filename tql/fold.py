@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Phase-folding and binning kernel of transit candidates.
+
+fold_and_bin folds a lightcurve at one or many (period, t0) at once and
+bins all, even and odd transits and the secondary eclipse window (phase
+0.5) in a single pass: the bin of every point in each group is turned into
+one flat index and the counts, sums and sums of squares of all bins of all
+periods are accumulated by np.bincount, without sorting nor creating
+LightCurve objects. Medians need one lexsort of the points within the
+windows.
+"""
+
+import numpy as np
+
+# binned groups of fold_and_bin
+GROUPS = ["all", "even", "odd", "secondary"]
+
+
+def fold_phase(time, period, t0):
+    """
+    phase in [-0.5, 0.5) and transit cycle of each time (as lightkurve's
+    fold: even transits have even cycle); arrays of shape (nperiods, ntimes)
+    if period and t0 are arrays
+    """
+    period, t0 = np.asarray(period, dtype=float), np.asarray(t0, dtype=float)
+    x = (np.asarray(time) - t0[..., None]) / period[..., None]
+    phase = (x + 0.5) % 1 - 0.5
+    cycle = np.floor(x + 0.5).astype(int)
+    return phase, cycle
+
+
+def fold_and_bin(
+    time, flux, period, t0, width, xlim=0.5, flux_err=None, median=False
+):
+    """
+    Binned phase-folded lightcurve of all, even and odd transits and of the
+    secondary eclipse window at each (period, t0)
+
+    Parameters
+    ----------
+    time, flux : array
+        lightcurve
+    period, t0 : float or array
+        orbital periods and mid-transit times in days
+    width : float or array
+        bin width in days (or one per period)
+    xlim : float or array
+        half width of the binned windows around phase 0 (transit) and
+        phase 0.5 (secondary) in phase units, e.g.
+        1.5*duration/period (default=0.5: whole orbit)
+    flux_err : array
+        if given, the error of a bin is propagated from flux_err instead of
+        its standard deviation / sqrt(n)
+    median : bool
+        also compute the median of each bin
+
+    Returns
+    -------
+    bins : dict
+        phase : (nperiods, nbins) bin centers (nan beyond xlim)
+        count, mean, error (and median) : (4, nperiods, nbins) in the order
+        of GROUPS (nan for empty bins); see get_binned
+    """
+    time = np.asarray(time, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    good = np.isfinite(time) & np.isfinite(flux)
+    if flux_err is not None:
+        flux_err = np.asarray(flux_err, dtype=float)
+        good &= np.isfinite(flux_err)
+        flux_err = flux_err[good]
+    time, flux = time[good], flux[good]
+    period = np.atleast_1d(np.asarray(period, dtype=float))
+    nperiods = len(period)
+    t0 = np.broadcast_to(np.asarray(t0, dtype=float), (nperiods,))
+    xlim = np.broadcast_to(np.asarray(xlim, dtype=float), (nperiods,))
+    step = width / period
+    # rounded so that e.g. xlim=2*step gives 4 bins despite float errors
+    nbins_p = np.maximum(1, np.ceil(np.round(2 * xlim / step, 6)).astype(int))
+    nbins = int(nbins_p.max())
+
+    x = (time - t0[:, None]) / period[:, None]
+    cycle = np.floor(x + 0.5)
+    phase = x - cycle
+    # centered on the secondary eclipse
+    phase2 = x - np.floor(x) - 0.5
+    b1 = np.floor((phase + xlim[:, None]) / step[:, None]).astype(int)
+    b2 = np.floor((phase2 + xlim[:, None]) / step[:, None]).astype(int)
+    in1 = (b1 >= 0) & (b1 < nbins_p[:, None])
+    in2 = (b2 >= 0) & (b2 < nbins_p[:, None])
+
+    # flat index of bin b of period p in group g: (g * nperiods + p) * nbins + b
+    p = np.arange(nperiods)[:, None]
+    odd = (cycle % 2).astype(int)
+    idx = np.concatenate(
+        [
+            ((0 * nperiods + p) * nbins + b1)[in1],
+            (((1 + odd) * nperiods + p) * nbins + b1)[in1],
+            ((3 * nperiods + p) * nbins + b2)[in2],
+        ]
+    )
+    points = np.concatenate(
+        [np.nonzero(in1)[1], np.nonzero(in1)[1], np.nonzero(in2)[1]]
+    )
+    # offset for precise variances of fluxes close to 1
+    offset = np.median(flux) if len(flux) > 0 else 0.0
+    y = flux[points] - offset
+    size = len(GROUPS) * nperiods * nbins
+    count = np.bincount(idx, minlength=size)
+    sums = np.bincount(idx, weights=y, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / count
+        if flux_err is None:
+            sq = np.bincount(idx, weights=y * y, minlength=size)
+            var = np.maximum(sq / count - mean**2, 0)
+            # standard error of the mean (nan for single points)
+            error = np.sqrt(var / (count - 1))
+        else:
+            sq = np.bincount(
+                idx, weights=flux_err[points] ** 2, minlength=size
+            )
+            error = np.sqrt(sq) / count
+    shape = (len(GROUPS), nperiods, nbins)
+    bins = dict(
+        phase=np.where(
+            np.arange(nbins) < nbins_p[:, None],
+            -xlim[:, None] + (np.arange(nbins) + 0.5) * step[:, None],
+            np.nan,
+        ),
+        count=count.reshape(shape),
+        mean=(mean + offset).reshape(shape),
+        error=error.reshape(shape),
+    )
+    if median:
+        order = np.lexsort((y, idx))
+        ys = y[order]
+        start = np.cumsum(count) - count
+        nonzero = count > 0
+        lo = start[nonzero] + (count[nonzero] - 1) // 2
+        hi = start[nonzero] + count[nonzero] // 2
+        med = np.full(size, np.nan)
+        med[nonzero] = (ys[lo] + ys[hi]) / 2 + offset
+        bins["median"] = med.reshape(shape)
+    return bins
+
+
+def get_binned(bins, group="all", i=0, statistic="mean"):
+    """
+    non-empty bins of one group and period of the output of fold_and_bin
+
+    Parameters
+    ----------
+    group : str
+        one of GROUPS
+    i : int
+        index of the period
+    statistic : str
+        mean or median
+
+    Returns
+    -------
+    x, y, yerr : array
+    """
+    g = GROUPS.index(group)
+    nonzero = bins["count"][g, i] > 0
+    return (
+        bins["phase"][i][nonzero],
+        bins[statistic][g, i][nonzero],
+        bins["error"][g, i][nonzero],
+    )
+
+
+def get_transit_bins(results, xlim=None, median=False):
+    """
+    fold_and_bin of the flattened lightcurve of the output of run_tql at the
+    TLS period in bins of results.bin_hr
+
+    Parameters
+    ----------
+    xlim : float
+        half width of the window in phase (default=1.5*duration/period as
+        in the folded panels)
+    """
+    tls_results = results.tls_results
+    flat = results.flat
+    if xlim is None:
+        xlim = 1.5 * tls_results.duration / tls_results.period
+    return fold_and_bin(
+        np.asarray(getattr(flat.time, "value", flat.time), dtype=float),
+        np.asarray(getattr(flat.flux, "value", flat.flux), dtype=float),
+        tls_results.period,
+        tls_results.T0,
+        width=results.bin_hr / 24,
+        xlim=xlim,
+        median=median,
+    )
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Index of tql results: one HDF5 table row of scalars per saved target.
+
+The index is appended to as each target of a batch finishes, and can be
+(re)built from existing *_tls.h5 files by reading only their scalar fields,
+so that thousands of results can be ranked or filtered instantly.
+"""
+
+import os
+import re
+from glob import glob
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+import tables
+
+INDEX_KEY = "tls"
+# summary of the BLS triage (see search.get_bls_results)
+BLS_COLUMNS = [
+    "bls_SDE",
+    "bls_snr",
+    "bls_period",
+    "bls_T0",
+    "bls_duration",
+    "bls_depth",
+]
+INDEX_COLUMNS = [
+    "filename",
+    "ticid",
+    "gaiaid",
+    "sector",
+    "sectors",
+    "nsectors",
+    "lctype",
+    "cadence",
+    "SDE",
+    "period",
+    "period_uncertainty",
+    "T0",
+    "duration",
+    "depth",
+    "snr",
+    "odd_even_mismatch",
+    "transit_count",
+    "rp_rs",
+    "Rp",
+    "cont_ratio",
+] + BLS_COLUMNS
+# sector is the first of nsectors of a stitched lightcurve and sectors is
+# their label (see core.get_sector_label)
+INT_COLUMNS = ["ticid", "gaiaid", "sector", "nsectors", "transit_count"]
+# fixed width of string columns in the HDF5 table
+STRING_SIZE = {"filename": 256, "sectors": 64, "lctype": 16, "cadence": 8}
+STRING_COLUMNS = list(STRING_SIZE)
+# a target has one row in the index (the latest); rows of targets without
+# a saved h5 file have no filename
+TARGET_COLUMNS = ["ticid", "sectors", "lctype", "cadence"]
+# e.g. tic52368076_s1-3,5_pdcsap_sc_tls.h5 (see core.get_output_prefix)
+FILE_PATTERN = re.compile(r"tic(\d+)_s([\d,-]+)_([a-z]+)_([sl])c_tls\.h5$")
+CADENCES = {"s": "short", "l": "long"}
+
+
+def get_index_row(results, fp=None):
+    """
+    index row from the output of run_tql; targets rejected by the BLS
+    triage have only the BLS columns
+
+    Parameters
+    ----------
+    results : TqlResults
+    fp : str
+        path of the saved *_tls.h5 file
+    """
+    from tql.core import get_sector_label
+
+    tls_results = results.tls_results
+    if tls_results is None:
+        tls_results = results.bls_results
+    row = {k: tls_results.get(k, np.nan) for k in INDEX_COLUMNS}
+    row.update(
+        filename=fp if fp is not None else "",
+        ticid=results.ticid,
+        gaiaid=results.gaiaid,
+        sector=results.sector,
+        sectors=str(get_sector_label(results)),
+        nsectors=len(results.get("sectors") or [results.sector]),
+        lctype=results.get("lctype", ""),
+        cadence=results.get("cadence", ""),
+        Rp=results.get("Rp", np.nan),
+        cont_ratio=results.get("contratio", np.nan),
+    )
+    return row
+
+
+def read_tls_scalars(fp):
+    """
+    Read only the scalar fields of a deepdish *_tls.h5 file; the sectors,
+    lctype and cadence are parsed from the file name
+
+    Returns
+    -------
+    row : dict
+        INDEX_COLUMNS (nan if missing)
+    """
+    row = {k: np.nan for k in INDEX_COLUMNS}
+    with tables.open_file(fp, mode="r") as h5:
+        # deepdish saves dict subclasses (e.g. tls_results) in /data
+        group = h5.root.data if "data" in h5.root else h5.root
+        attrs = group._v_attrs
+        for key in attrs._v_attrnamesuser:
+            if (key in row) and (key not in STRING_COLUMNS):
+                row[key] = attrs[key]
+    row["filename"] = fp
+    match = FILE_PATTERN.search(os.path.basename(fp))
+    if match is not None:
+        ticid, sectors, lctype, cadence = match.groups()
+        if not np.isfinite(row["ticid"]):
+            row["ticid"] = int(ticid)
+        row.update(sectors=sectors, lctype=lctype, cadence=CADENCES[cadence])
+    return row
+
+
+def _read_tls_scalars(fp):
+    try:
+        return read_tls_scalars(fp)
+    except Exception as e:
+        print(f"Error reading {fp}: {e}")
+        return None
+
+
+def _to_frame(rows):
+    df = pd.DataFrame(rows, columns=INDEX_COLUMNS)
+    for col in INDEX_COLUMNS:
+        if col in STRING_COLUMNS:
+            df[col] = df[col].fillna("").astype(str)
+            continue
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+        if col in INT_COLUMNS:
+            # gaia DR2 ids do not fit in float64; -1 if missing
+            df[col] = df[col].fillna(-1).astype(np.int64)
+        else:
+            df[col] = df[col].astype(float)
+    return df
+
+
+def append_to_index(rows, index_fp):
+    """
+    Append rows (list of dict) to the index table
+    """
+    if len(rows) == 0:
+        return
+    df = _to_frame(rows)
+    with pd.HDFStore(index_fp, mode="a") as store:
+        store.append(
+            INDEX_KEY,
+            df,
+            format="table",
+            data_columns=True,
+            index=False,
+            min_itemsize=STRING_SIZE,
+        )
+
+
+def load_index(index_fp, where=None, columns=None):
+    """
+    Load the index table
+
+    Parameters
+    ----------
+    where : str
+        query evaluated on disk, e.g. "SDE > 10 & period < 5"
+    columns : list
+        subset of INDEX_COLUMNS
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        latest entry per target (TARGET_COLUMNS)
+    """
+    read_columns = columns
+    if columns is not None:
+        read_columns = list(columns) + [
+            col for col in TARGET_COLUMNS if col not in columns
+        ]
+    df = pd.read_hdf(index_fp, INDEX_KEY, where=where, columns=read_columns)
+    df = df.drop_duplicates(TARGET_COLUMNS, keep="last")
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def build_index(indir, index_fp=None, ncores=1, rebuild=False, verbose=True):
+    """
+    Add *_tls.h5 files in indir that are not yet in the index
+
+    Parameters
+    ----------
+    indir : str
+        directory of *_tls.h5 files
+    index_fp : str
+        index file (default=indir/tql_index.h5)
+    ncores : int
+        number of processes reading the files
+    rebuild : bool
+        re-read all files
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        index table
+    """
+    if index_fp is None:
+        index_fp = os.path.join(indir, "tql_index.h5")
+    if rebuild and os.path.exists(index_fp):
+        os.remove(index_fp)
+    files = sorted(glob(os.path.join(indir, "*_tls.h5")))
+    if os.path.exists(index_fp):
+        done = set(load_index(index_fp, columns=["filename"])["filename"])
+        files = [fp for fp in files if fp not in done]
+    if verbose:
+        print(f"Reading {len(files)} new files in {indir}")
+    if ncores > 1 and len(files) > 1:
+        with mp.Pool(processes=ncores) as pool:
+            rows = pool.map(_read_tls_scalars, files, chunksize=64)
+    else:
+        rows = [_read_tls_scalars(fp) for fp in files]
+    append_to_index([row for row in rows if row is not None], index_fp)
+    if not os.path.exists(index_fp):
+        return _to_frame([])
+    return load_index(index_fp)
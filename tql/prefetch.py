@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous prefetching of the data of upcoming targets of a batch.
+
+While a target is being analyzed, the lightcurve, tpf or TESSCut cutout
+files of the next targets are downloaded by a bounded pool of threads into
+the download cache read by lightkurve (see get_download_dir), so that the
+analysis of those targets finds them locally. The number of targets
+fetched ahead and the bytes of prefetched files not yet used are bounded.
+"""
+
+import os
+import shutil
+import zipfile
+import threading
+import traceback
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# download cache of lightkurve 1.x
+DOWNLOAD_DIR = os.path.join(os.path.expanduser("~"), ".lightkurve-cache")
+MAST_DOWNLOAD_URL = "https://mast.stsci.edu/api/v0.1/Download/file?uri={}"
+TESSCUT_URL = (
+    "https://mast.stsci.edu/tesscut/api/v0.1/astrocut"
+    "?ra={ra}&dec={dec}&y={y}&x={x}&sector={sector}"
+)
+CHUNK_SIZE = 2**20
+
+# a file to download into download_dir/path; zip archives are extracted
+# into the directory download_dir/path
+Download = namedtuple("Download", ["url", "path", "unzip"], defaults=[False])
+
+
+def fetch(url, fp, unzip=False, timeout=60):
+    """
+    download url into fp unless it exists; the file is written under a
+    temporary name and renamed when complete so that readers never see a
+    partial file
+
+    Returns
+    -------
+    paths : list
+        files written (none if fp exists)
+    """
+    if (not unzip) and os.path.exists(fp):
+        return []
+    dirname = fp if unzip else os.path.dirname(fp)
+    os.makedirs(dirname, exist_ok=True)
+    tmp = os.path.join(dirname, f".{os.path.basename(fp)}.{os.getpid()}.part")
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+        if not unzip:
+            os.replace(tmp, fp)
+            return [fp]
+        paths = []
+        with zipfile.ZipFile(tmp) as archive:
+            for member in archive.infolist():
+                out = os.path.join(fp, os.path.basename(member.filename))
+                if member.is_dir() or os.path.exists(out):
+                    continue
+                with archive.open(member) as src:
+                    with open(out + ".part", "wb") as f:
+                        shutil.copyfileobj(src, f, CHUNK_SIZE)
+                os.replace(out + ".part", out)
+                paths.append(out)
+        return paths
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def get_download_dir():
+    """
+    download cache of the installed lightkurve (~/.lightkurve-cache before
+    lightkurve 2); files are laid out as by astroquery's
+    Observations.download_products (mastDownload/...) and TESSCut cutouts
+    are in tesscut/
+    """
+    try:
+        from lightkurve.config import get_cache_dir
+    except ImportError:
+        return DOWNLOAD_DIR
+    return get_cache_dir()
+
+
+def resolve_object(name):
+    """
+    coordinates of a target name resolved by MAST, as lightkurve does
+    """
+    try:
+        from lightkurve.search import _resolve_object
+    except ImportError:
+        # private in lightkurve: use the resolver of astroquery
+        from astroquery.mast import Observations
+
+        return Observations.resolve_object(name)
+    return _resolve_object(name)
+
+
+def _get_search_name(target):
+    if target.get("ticid") is not None:
+        return f"TIC {target['ticid']}"
+    elif target.get("coords") is not None:
+        return "{} {}".format(*target["coords"])
+    elif target.get("name") is not None:
+        return target["name"]
+    # toi and gaia ids need catalog queries: not prefetched
+    return None
+
+
+def get_mast_downloads(
+    target, cadence="short", sector=None, cutout_size=(12, 12)
+):
+    """
+    files of a target at MAST read by run_tql: the lightcurve and tpf
+    (short cadence) or the TESSCut cutout (long cadence) of a sector
+    (default=first available, as lightkurve)
+
+    Parameters
+    ----------
+    target : dict
+        e.g. from batch.read_target_list; toi and gaia ids are not resolved
+
+    Returns
+    -------
+    downloads : list of Download
+    """
+    import lightkurve as lk
+
+    name = _get_search_name(target)
+    if name is None:
+        return []
+    if cadence == "short":
+        downloads = []
+        for search in [lk.search_lightcurvefile, lk.search_targetpixelfile]:
+            res = search(name, mission="TESS", sector=sector)
+            if len(res) == 0:
+                continue
+            row = res.table[0]
+            # same layout as astroquery's Observations.download_products
+            path = os.path.join(
+                "mastDownload",
+                row["obs_collection"],
+                row["obs_id"],
+                row["productFilename"],
+            )
+            downloads.append(
+                Download(MAST_DOWNLOAD_URL.format(row["dataURI"]), path)
+            )
+        return downloads
+    res = lk.search_tesscut(name, sector=sector)
+    if len(res) == 0:
+        return []
+    coord = resolve_object(name)
+    y, x = cutout_size
+    url = TESSCUT_URL.format(
+        ra=coord.ra.deg,
+        dec=coord.dec.deg,
+        y=y,
+        x=x,
+        sector=res.table[0]["sequence_number"],
+    )
+    return [Download(url, "tesscut", unzip=True)]
+
+
+class Prefetcher:
+    """
+    Download the files of upcoming targets in a bounded pool of threads,
+    e.g.
+
+    >>> prefetcher = Prefetcher(get_mast_downloads, ahead=4)
+    >>> prefetcher.start(targets[ncores:])
+    >>> for row in pool.imap_unordered(run, targets):
+    ...     prefetcher.release(row["target"])
+    >>> prefetcher.close()
+
+    Parameters
+    ----------
+    resolver : callable
+        target -> list of Download (e.g. get_mast_downloads)
+    download_dir : str
+        cache directory (default=get_download_dir())
+    ahead : int
+        number of targets prefetched and not yet released
+    max_workers : int
+        number of concurrent downloads
+    max_bytes : int
+        downloads wait while the prefetched files of unreleased targets
+        exceed this size (it is exceeded by at most one file per worker)
+    delete_released : bool
+        delete the files downloaded by the prefetcher once their target is
+        released (i.e. analyzed)
+    key : callable
+        target -> hashable key used in release (default=repr)
+    timeout : float
+        timeout of each request in seconds
+    verbose : bool
+        print prefetched files and errors
+    """
+
+    def __init__(
+        self,
+        resolver,
+        download_dir=None,
+        ahead=4,
+        max_workers=2,
+        max_bytes=2 * 2**30,
+        delete_released=False,
+        key=repr,
+        timeout=60,
+        verbose=False,
+    ):
+        self.resolver = resolver
+        self.download_dir = (
+            get_download_dir() if download_dir is None else download_dir
+        )
+        self.ahead = ahead
+        self.max_bytes = max_bytes
+        self.delete_released = delete_released
+        self.key = key
+        self.timeout = timeout
+        self.verbose = verbose
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Condition()
+        self.queue = []
+        self.nscheduled = 0
+        self.nactive = 0
+        # workers not waiting on the byte budget
+        self.nrunning = 0
+        self.released = set()
+        self.files = {}
+        self.nbytes = {}
+        self.pending_bytes = 0
+        self.ndownloaded = 0
+        self.errors = []
+        self.closed = False
+
+    def __repr__(self):
+        return (
+            f"Prefetcher({self.nscheduled}/{len(self.queue)} targets, "
+            f"{self.ndownloaded} files)"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self, targets):
+        """
+        queue targets in the order they will be analyzed
+        """
+        with self.lock:
+            self.queue.extend(targets)
+            self._schedule()
+
+    def _schedule(self):
+        # called with the lock held
+        while (self.nactive < self.ahead) and (
+            self.nscheduled < len(self.queue)
+        ):
+            target = self.queue[self.nscheduled]
+            self.nscheduled += 1
+            key = self.key(target)
+            if key in self.released:
+                # analyzed before its turn
+                continue
+            self.nactive += 1
+            self.files[key], self.nbytes[key] = [], 0
+            self.nrunning += 1
+            self.executor.submit(self._prefetch, target, key)
+
+    def _prefetch(self, target, key):
+        try:
+            downloads = self.resolver(target)
+            for download in downloads:
+                with self.lock:
+                    # bounded disk usage
+                    self.nrunning -= 1
+                    self.lock.notify_all()
+                    while (self.pending_bytes >= self.max_bytes) and not (
+                        self.closed or key in self.released
+                    ):
+                        self.lock.wait()
+                    self.nrunning += 1
+                    if self.closed or (key in self.released):
+                        return
+                paths = fetch(
+                    download.url,
+                    os.path.join(self.download_dir, download.path),
+                    unzip=download.unzip,
+                    timeout=self.timeout,
+                )
+                nbytes = sum(os.path.getsize(fp) for fp in paths)
+                with self.lock:
+                    self.ndownloaded += len(paths)
+                    self.files[key].extend(paths)
+                    if key in self.released:
+                        self._delete(key)
+                        continue
+                    self.nbytes[key] += nbytes
+                    self.pending_bytes += nbytes
+                if self.verbose:
+                    for fp in paths:
+                        print(f"Prefetched {fp}")
+        except Exception as e:
+            with self.lock:
+                self.errors.append((key, f"{type(e).__name__}: {e}"))
+            if self.verbose:
+                traceback.print_exc()
+        finally:
+            with self.lock:
+                self.nrunning -= 1
+                self.lock.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        wait until every scheduled target is downloaded or waits on max_bytes;
+        returns False on timeout
+        """
+        with self.lock:
+            return self.lock.wait_for(
+                lambda: self.nrunning == 0, timeout=timeout
+            )
+
+    def _delete(self, key):
+        # called with the lock held
+        if self.delete_released:
+            for fp in self.files.get(key, []):
+                if os.path.exists(fp):
+                    os.remove(fp)
+        self.files[key] = []
+
+    def release(self, key):
+        """
+        mark the target with key as analyzed: its prefetched files no longer
+        count towards max_bytes and the next target is scheduled
+        """
+        with self.lock:
+            if key in self.released:
+                return
+            self.released.add(key)
+            if key in self.nbytes:
+                self.nactive -= 1
+                self.pending_bytes -= self.nbytes.pop(key)
+                self._delete(key)
+            self._schedule()
+            self.lock.notify_all()
+
+    def close(self, wait=True):
+        """
+        stop scheduling; downloads in progress are completed
+        """
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.executor.shutdown(wait=wait)
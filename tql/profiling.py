@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage wall/CPU timings and memory of a tql run with an optional
+cProfile hook.
+"""
+
+import io
+import os
+import sys
+import json
+import pstats
+import cProfile
+from contextlib import contextmanager
+from time import perf_counter, process_time
+
+try:
+    import resource
+except ImportError:
+    # e.g. windows
+    resource = None
+
+STAGES = [
+    "target",
+    "catalog_xmatch",
+    "lc_download",
+    "stitch",
+    "detrend",
+    "lomb_scargle",
+    "bls",
+    "gls",
+    "tls_power",
+    "tls_multi",
+    "tpf_download",
+    "gaia_sources_query",
+    "contratio",
+    "starhorse_query",
+    "find_cluster",
+    "save_tls",
+    "plotting",
+    "savefig",
+]
+
+
+def get_memory():
+    """
+    current and peak resident memory of the process in MB
+    (current=peak if it cannot be read from /proc)
+    """
+    peak = 0.0
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes in macos, kilobytes in linux
+        peak /= 1024**2 if sys.platform == "darwin" else 1024
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        rss /= 1024**2
+    except (OSError, ValueError, AttributeError):
+        rss = peak
+    return rss, peak
+
+
+class StageTimer:
+    """
+    Record wall and CPU time and memory of named stages, e.g.
+
+    >>> timings = StageTimer(profile_stage="tls_power")
+    >>> with timings.stage("tls_power"):
+    ...     results = model.power()
+    >>> timings.save("tic123_s1_pdcsap_sc_timings.json")
+
+    Parameters
+    ----------
+    profile_stage : str
+        name of a stage to run under cProfile (default=None)
+    nstats : int
+        number of functions listed in the profile summary
+    """
+
+    def __init__(self, profile_stage=None, nstats=20):
+        self.profile_stage = profile_stage
+        self.nstats = nstats
+        self.stages = {}
+        self._profiles = []
+        self._stats = None
+        self._start = perf_counter()
+        self._start_cpu = process_time()
+
+    def __repr__(self):
+        return f"StageTimer({list(self.stages.keys())})"
+
+    def __getstate__(self):
+        # e.g. sent to a writer process with the results: profiles are
+        # kept as their stats and the elapsed times are carried over
+        state = self.__dict__.copy()
+        stats = self.get_stats()
+        if stats is not None:
+            stats.stream = None
+        state.update(
+            _profiles=[],
+            _stats=stats,
+            _start=perf_counter() - self._start,
+            _start_cpu=process_time() - self._start_cpu,
+        )
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._start = perf_counter() - state["_start"]
+        self._start_cpu = process_time() - state["_start_cpu"]
+
+    @contextmanager
+    def stage(self, name):
+        """
+        time the enclosed block; repeated stages are accumulated.
+        rss is the resident memory at the end of the stage, mem the change
+        in resident memory during the stage and peak the peak resident
+        memory of the process so far (all in MB)
+        """
+        profile = None
+        if name == self.profile_stage:
+            profile = cProfile.Profile()
+            profile.enable()
+        rss, _ = get_memory()
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            wall = perf_counter() - wall
+            cpu = process_time() - cpu
+            rss_end, peak = get_memory()
+            if profile is not None:
+                profile.disable()
+                self._profiles.append(profile)
+                self._stats = None
+            d = self.stages.setdefault(
+                name, {"wall": 0.0, "cpu": 0.0, "mem": 0.0}
+            )
+            d["wall"] += wall
+            d["cpu"] += cpu
+            d["mem"] += rss_end - rss
+            d["rss"], d["peak"] = rss_end, peak
+
+    def get_stats(self):
+        """
+        pstats.Stats of the profiled stage (None if not profiled)
+        """
+        if (self._stats is None) and (len(self._profiles) > 0):
+            self._stats = pstats.Stats(*self._profiles)
+        return self._stats
+
+    def get_profile_stats(self):
+        """
+        top functions of the profiled stage sorted by cumulative time
+        """
+        stats = self.get_stats()
+        if stats is None:
+            return None
+        stats.stream = io.StringIO()
+        stats.sort_stats("cumulative").print_stats(self.nstats)
+        return stats.stream.getvalue()
+
+    def to_dict(self):
+        return {
+            "stages": self.stages,
+            "total_wall": perf_counter() - self._start,
+            "total_cpu": process_time() - self._start_cpu,
+            "peak_memory": get_memory()[1],
+            "profile_stage": self.profile_stage,
+            "profile": self.get_profile_stats(),
+        }
+
+    def summary(self):
+        """
+        table of stage timings and memory
+        """
+        msg = f"{'stage':<20}{'wall [s]':>10}{'cpu [s]':>10}"
+        msg += f"{'mem [MB]':>10}{'rss [MB]':>10}\n"
+        for name, d in self.stages.items():
+            msg += f"{name:<20}{d['wall']:>10.2f}{d['cpu']:>10.2f}"
+            msg += f"{d.get('mem', 0):>10.1f}{d.get('rss', 0):>10.1f}\n"
+        return msg
+
+    def save(self, fp, extra=None):
+        """
+        save timings as json; the raw profile is dumped in fp.prof
+
+        Parameters
+        ----------
+        fp : str
+            json file path
+        extra : dict
+            other fields to save, e.g. target id
+        """
+        d = self.to_dict()
+        if extra is not None:
+            d.update(extra)
+        stats = self.get_stats()
+        if stats is not None:
+            prof_fp = fp.replace(".json", "") + ".prof"
+            stats.dump_stats(prof_fp)
+            d["profile_file"] = prof_fp
+        with open(fp, "w") as f:
+            json.dump(d, f, indent=2, default=_to_json)
+
+
+def _to_json(obj):
+    # e.g. numpy integers of ticid and sector
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+def load_timings(files):
+    """
+    Aggregate timing json files of a batch
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        wall time of each stage (columns) per file (rows)
+    """
+    import pandas as pd
+
+    rows = {}
+    for fp in files:
+        with open(fp) as f:
+            d = json.load(f)
+        row = {k: v["wall"] for k, v in d["stages"].items()}
+        row["total"] = d["total_wall"]
+        rows[fp] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Rotation period engine: Lomb-Scargle periodograms on a regular frequency
+grid from which the peak period, amplitude and their uncertainties are
+derived, without running a full Generalized Lomb-Scargle (GLS).
+
+Single lightcurves use the O(N log N) method of Press & Rybicki (1989).
+Many lightcurves sharing the same timestamps (e.g. stars observed in the
+same sector) are computed in one vectorized call in which the
+extirpolation and the time-only sums are done once for all stars.
+"""
+
+from math import factorial
+
+import numpy as np
+from scipy import sparse
+from astropy.timeseries import LombScargle
+
+# shortest rotation period searched in days
+PROT_MIN = 0.5
+
+
+def get_frequency_grid(
+    baseline, Prot_min=PROT_MIN, Prot_max=None, samples_per_peak=5
+):
+    """
+    regular frequency grid shared by the rotation periodograms
+
+    Parameters
+    ----------
+    baseline : float
+        time baseline in days
+    Prot_min, Prot_max : float
+        shortest and longest period in days (default Prot_max=baseline/2)
+    samples_per_peak : int
+        oversampling of the peak width 1/baseline
+
+    Returns
+    -------
+    frequency : array
+        in 1/day
+    """
+    Prot_max = baseline / 2 if Prot_max is None else Prot_max
+    df = 1.0 / (samples_per_peak * baseline)
+    return np.arange(1.0 / Prot_max, 1.0 / Prot_min + df, df)
+
+
+def get_peak_stats(ls, frequency, power, refine=10):
+    """
+    period, amplitude and uncertainties of the highest peak
+    (c.f. Zechmeister & Kuerster 2009 and chronos.gls.Gls.hpstat)
+
+    Parameters
+    ----------
+    ls : astropy.timeseries.LombScargle
+    frequency, power : array
+        periodogram
+    refine : int
+        number of steps of a finer grid within one grid step of the peak
+
+    Returns
+    -------
+    stats : dict
+        Prot, Prot_err, amp, amp_err, best_freq, power
+    """
+    idx = np.argmax(power)
+    best_freq = frequency[idx]
+    if refine > 1:
+        # the grid step is wider than the peak uncertainty
+        df = frequency[1] - frequency[0]
+        fine = best_freq + np.linspace(-df, df, 2 * refine + 1)
+        fine = fine[fine > 0]
+        best_freq = fine[np.argmax(ls.power(fine, method="cython"))]
+    time, flux = np.asarray(ls.t), np.asarray(ls.y)
+    _, a, b = ls.model_parameters(best_freq)
+    amp = np.hypot(a, b)
+    rms = np.std(flux - ls.model(time, best_freq))
+    N, T = len(time), time.max() - time.min()
+    freq_err = np.sqrt(6.0 / N) / (np.pi * T * amp / rms)
+    return dict(
+        Prot=1.0 / best_freq,
+        Prot_err=freq_err / best_freq**2,
+        amp=amp,
+        amp_err=np.sqrt(2.0 / N) * rms,
+        best_freq=best_freq,
+        power=power[idx],
+    )
+
+
+def get_rotation_periodogram(
+    time, flux, flux_err=None, frequency=None, Prot_max=None
+):
+    """
+    Lomb-Scargle periodogram of one lightcurve with the fast method
+
+    Parameters
+    ----------
+    time, flux, flux_err : array
+        detrended lightcurve (excluding e.g. transits)
+    frequency : array
+        regular frequency grid (default=get_frequency_grid)
+    Prot_max : float
+        longest period in days if frequency is None (default=baseline/2)
+
+    Returns
+    -------
+    ls_results : dict
+        ls_periods, ls_powers, Prot_ls, Prot_ls_err, amp_ls, amp_ls_err
+        and ls_model (phase-folded sine model at Prot_ls)
+    """
+    time, flux = np.asarray(time), np.asarray(flux)
+    if frequency is None:
+        baseline = int(time[-1] - time[0])
+        frequency = get_frequency_grid(baseline, Prot_max=Prot_max)
+    ls = LombScargle(time, flux, flux_err)
+    power = ls.power(frequency, method="fast", assume_regular_frequency=True)
+    return _get_ls_results(ls, frequency, power)
+
+
+def _get_ls_results(ls, frequency, power):
+    stats = get_peak_stats(ls, frequency, power)
+    best_freq, best_period = stats["best_freq"], stats["Prot"]
+    # sinusoidal model phase-folded at rotation period
+    offset = 0.5
+    t_fit = np.linspace(0, 1, 100) - offset
+    y_fit = ls.model(t_fit * best_period - best_period / 2, best_freq)
+    return dict(
+        ls_periods=1.0 / frequency,
+        ls_powers=power,
+        Prot_ls=best_period,
+        Prot_ls_err=stats["Prot_err"],
+        amp_ls=stats["amp"],
+        amp_ls_err=stats["amp_err"],
+        ls_model=(t_fit, y_fit),
+    )
+
+
+def _get_extirpolation_matrix(x, N, M=4):
+    """
+    sparse (N, len(x)) matrix of the Press & Rybicki extirpolation of values
+    at positions x onto a regular grid of N points; c.f.
+    astropy.timeseries.periodograms.lombscargle.implementations.utils
+    """
+    nx = len(x)
+    cols = np.arange(nx)
+    integers = x % 1 == 0
+    rows = [x[integers].astype(int)]
+    vals = [np.ones(integers.sum())]
+    col_list = [cols[integers]]
+    x, cols = x[~integers], cols[~integers]
+    ilo = np.clip((x - M // 2).astype(int), 0, N - M)
+    numerator = np.prod(x - ilo - np.arange(M)[:, np.newaxis], 0)
+    denominator = factorial(M - 1)
+    for j in range(M):
+        if j > 0:
+            denominator *= j / (j - M)
+        ind = ilo + (M - 1 - j)
+        rows.append(ind)
+        col_list.append(cols)
+        vals.append(numerator / (denominator * (x - ind)))
+    return sparse.csr_matrix(
+        (
+            np.concatenate(vals),
+            (np.concatenate(rows), np.concatenate(col_list)),
+        ),
+        shape=(N, nx),
+    )
+
+
+def _trig_sums(t, h, f0, df, Nf, freq_factor=1, oversampling=5, Mfft=4):
+    """
+    sum(h * sin(2 pi f t)) and sum(h * cos(2 pi f t)) of each row of h at
+    f = f0 + df * arange(Nf) using FFTs of the extirpolated rows
+    """
+    df, f0 = df * freq_factor, f0 * freq_factor
+    Nfft = 1 << int(np.ceil(np.log2(Nf * oversampling)))
+    t0 = t.min()
+    tnorm = ((t - t0) * Nfft * df) % Nfft
+    # the extirpolation only depends on time: shared by all rows
+    E = _get_extirpolation_matrix(tnorm, Nfft, Mfft)
+    phase = np.exp(2j * np.pi * f0 * (t - t0))
+    grid = (E @ (h * phase).T).T
+    fftgrid = np.fft.ifft(grid, axis=-1)[:, :Nf]
+    fftgrid *= np.exp(2j * np.pi * t0 * (f0 + df * np.arange(Nf)))
+    return Nfft * fftgrid.imag, Nfft * fftgrid.real
+
+
+def get_shared_time_powers(time, fluxes, frequency):
+    """
+    Lomb-Scargle power (floating mean, standard normalization) of many
+    lightcurves sampled at the same times with the fast method vectorized
+    over lightcurves; c.f. astropy's lombscargle_fast
+
+    Parameters
+    ----------
+    time : array (N,)
+    fluxes : array (nstars, N)
+    frequency : array (F,)
+        regular frequency grid
+
+    Returns
+    -------
+    powers : array (nstars, F)
+    """
+    t = np.asarray(time, dtype=float)
+    y = np.atleast_2d(np.asarray(fluxes, dtype=float))
+    y = y - y.mean(axis=1, keepdims=True)
+    w = np.full((1, len(t)), 1.0 / len(t))
+    f0, df, Nf = frequency[0], frequency[1] - frequency[0], len(frequency)
+
+    # the last row gives the time-only sums shared by all lightcurves
+    Sh, Ch = _trig_sums(t, np.vstack([w * y, w]), f0, df, Nf)
+    Sh, Ch, S, C = Sh[:-1], Ch[:-1], Sh[-1], Ch[-1]
+    S2, C2 = _trig_sums(t, w, f0, df, Nf, freq_factor=2)
+    tan_2omega_tau = (S2 - 2 * S * C) / (C2 - (C * C - S * S))
+    S2w = tan_2omega_tau / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+    C2w = 1 / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+    Cw = np.sqrt(0.5) * np.sqrt(1 + C2w)
+    Sw = np.sqrt(0.5) * np.sign(S2w) * np.sqrt(1 - C2w)
+
+    YY = (w * y**2).sum(axis=1, keepdims=True)
+    YC = Ch * Cw + Sh * Sw
+    YS = Sh * Cw - Ch * Sw
+    CC = 0.5 * (1 + C2 * C2w + S2 * S2w) - (C * Cw + S * Sw) ** 2
+    SS = 0.5 * (1 - C2 * C2w - S2 * S2w) - (S * Cw - C * Sw) ** 2
+    return (YC * YC / CC + YS * YS / SS) / YY
+
+
+def get_rotation_periodograms(lcs, masks=None, Prot_max=None):
+    """
+    Rotation periodograms of many lightcurves on one shared frequency grid.
+    Lightcurves with identical timestamps (after masking) are computed
+    together in a single vectorized call.
+
+    Parameters
+    ----------
+    lcs : list of lightkurve.LightCurve
+        detrended lightcurves
+    masks : list of array of bool
+        cadences to exclude from each lightcurve (e.g. transits)
+    Prot_max : float
+        longest period in days (default=longest baseline/2)
+
+    Returns
+    -------
+    ls_results : list of dict
+        see get_rotation_periodogram
+    """
+    masks = [None] * len(lcs) if masks is None else masks
+    data = []
+    for lc, mask in zip(lcs, masks):
+        mask = np.zeros(len(lc.time), dtype=bool) if mask is None else mask
+        data.append((np.asarray(lc.time)[~mask], np.asarray(lc.flux)[~mask]))
+    baseline = max(int(time[-1] - time[0]) for time, _ in data)
+    frequency = get_frequency_grid(baseline, Prot_max=Prot_max)
+
+    # group lightcurves by their timestamps
+    groups = {}
+    for n, (time, _) in enumerate(data):
+        key = (len(time), time[0], time[-1], hash(time.tobytes()))
+        groups.setdefault(key, []).append(n)
+
+    results = [None] * len(lcs)
+    for idx in groups.values():
+        time = data[idx[0]][0]
+        if len(idx) == 1:
+            ls = LombScargle(*data[idx[0]])
+            powers = [
+                ls.power(
+                    frequency, method="fast", assume_regular_frequency=True
+                )
+            ]
+        else:
+            fluxes = np.array([data[n][1] for n in idx])
+            powers = get_shared_time_powers(time, fluxes, frequency)
+        for n, power in zip(idx, powers):
+            ls = LombScargle(*data[n])
+            results[n] = _get_ls_results(ls, frequency, power)
+    return results
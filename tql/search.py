@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Coarse-to-fine transit search and box least squares (BLS) triage.
+
+TLS is first run on the flattened lightcurve binned to a longer cadence
+over a coarser period grid. The top peaks of this periodogram are then
+searched again on the full-resolution lightcurve with the native grid
+density, but only within a few coarse grid steps of each peak. The SDE and
+periodogram reported are those of the coarse search; the ephemeris, depth,
+folded lightcurve etc. are those of the best refined peak.
+
+The BLS triage is a cheaper search on the binned lightcurve over the
+period grid of tls; TLS is run only if its SDE and SNR pass a threshold.
+"""
+
+from time import time as timer
+
+import numpy as np
+import lightkurve as lk
+from astropy.timeseries import BoxLeastSquares
+from transitleastsquares import period_grid
+
+# bin size of the coarse search in minutes
+COARSE_BIN_MINUTES = 10
+# oversampling of the period grid of the coarse search (tls default=3)
+COARSE_OVERSAMPLING = 1
+# periodogram of the full period range taken from the coarse search
+PERIODOGRAM_KEYS = [
+    "periods",
+    "power",
+    "power_raw",
+    "SR",
+    "SDE",
+    "SDE_raw",
+    "FAP",
+]
+# transit durations in days searched by BLS
+BLS_DURATIONS = [0.02, 0.04, 0.06, 0.08, 0.12, 0.16, 0.24]
+
+
+def bin_lc(lc, bin_minutes=COARSE_BIN_MINUTES):
+    """
+    bin a lightcurve in time (gaps are not filled); lightcurves with a
+    cadence of bin_minutes or longer are returned as is
+
+    Returns
+    -------
+    binned : lightkurve.LightCurve
+    """
+    time = np.asarray(lc.time)
+    dt = bin_minutes / 60 / 24
+    if np.median(np.diff(time)) >= dt:
+        return lc
+    _, idx, counts = np.unique(
+        np.floor((time - time[0]) / dt),
+        return_inverse=True,
+        return_counts=True,
+    )
+    return lk.LightCurve(
+        time=np.bincount(idx, time) / counts,
+        flux=np.bincount(idx, np.asarray(lc.flux)) / counts,
+        flux_err=np.sqrt(np.bincount(idx, np.asarray(lc.flux_err) ** 2))
+        / counts,
+    )
+
+
+def get_peak_indices(power, npeaks=3, width=3):
+    """
+    indices of the highest local maxima of a periodogram which are more
+    than width grid steps apart
+    """
+    power = np.asarray(power)
+    padded = np.r_[-np.inf, power, -np.inf]
+    is_peak = (power >= padded[:-2]) & (power >= padded[2:])
+    peaks = []
+    for idx in np.flatnonzero(is_peak)[np.argsort(-power[is_peak])]:
+        if all(abs(idx - n) > width for n in peaks):
+            peaks.append(idx)
+        if len(peaks) == npeaks:
+            break
+    return peaks
+
+
+def get_tls_results_fast(
+    flat,
+    period_min=0.1,
+    period_max=None,
+    npeaks=3,
+    width=3,
+    bin_minutes=COARSE_BIN_MINUTES,
+    oversampling_factor=COARSE_OVERSAMPLING,
+    grid_cache=None,
+    **kwargs,
+):
+    """
+    Coarse-to-fine Transit Least Squares search
+
+    Parameters
+    ----------
+    flat : lightkurve.LightCurve
+        flattened lightcurve
+    period_min, period_max : float
+        period search limits in days (default=0.1, baseline/2)
+    npeaks : int
+        number of peaks of the coarse periodogram to refine
+    width : int
+        half width of the refined period range in coarse grid steps
+    bin_minutes : float
+        bin size of the coarse search
+    oversampling_factor : int
+        oversampling of the period grid of the coarse search
+    grid_cache : dict
+        see core.get_tls_results; only the coarse grid is cached
+    kwargs : dict
+        passed to core.get_tls_results (e.g. Rstar, Mstar, use_err)
+
+    Returns
+    -------
+    tls_results : transitleastsquares.results
+        of the best refined peak (lowest chi2) with the periodogram and SDE
+        of the coarse search
+    """
+    from tql.core import get_tls_results
+
+    if period_max is None:
+        period_max = int(flat.time[-1] - flat.time[0]) / 2
+    coarse_cache = None
+    if grid_cache is not None:
+        coarse_cache = grid_cache.setdefault("coarse", {})
+    binned = bin_lc(flat, bin_minutes)
+    coarse = get_tls_results(
+        binned,
+        period_min=period_min,
+        period_max=period_max,
+        oversampling_factor=oversampling_factor,
+        grid_cache=coarse_cache,
+        **kwargs,
+    )
+    periods = np.asarray(coarse.periods)
+    best = None
+    for idx in get_peak_indices(coarse.power, npeaks=npeaks, width=width):
+        window = periods[max(idx - width, 0) : idx + width + 1]
+        refined = get_tls_results(
+            flat,
+            period_min=max(window.min(), period_min),
+            period_max=min(window.max(), period_max),
+            **kwargs,
+        )
+        if (best is None) or (refined.chi2_min < best.chi2_min):
+            best = refined
+    for key in PERIODOGRAM_KEYS:
+        best[key] = coarse[key]
+    best["coarse_period"] = coarse.period
+    return best
+
+
+def compare_search(flat, **kwargs):
+    """
+    run the coarse-to-fine and the full search on the same lightcurve
+
+    Parameters
+    ----------
+    kwargs : dict
+        passed to both searches (e.g. Rstar, Mstar, period_min, period_max)
+
+    Returns
+    -------
+    comparison : dict
+        SDE, period, duration and wall time of both searches
+    """
+    from tql.core import get_tls_results
+
+    fast_kwargs = {
+        key: kwargs.pop(key)
+        for key in ["npeaks", "width", "bin_minutes"]
+        if key in kwargs
+    }
+    start = timer()
+    full = get_tls_results(flat, **kwargs)
+    time_full = timer() - start
+    start = timer()
+    fast = get_tls_results_fast(flat, **kwargs, **fast_kwargs)
+    time_fast = timer() - start
+    return dict(
+        ndata=len(flat.time),
+        SDE_full=full.SDE,
+        SDE_fast=fast.SDE,
+        period_full=full.period,
+        period_fast=fast.period,
+        period_err=abs(fast.period - full.period),
+        duration_full=full.duration,
+        duration_fast=fast.duration,
+        time_full=time_full,
+        time_fast=time_fast,
+        speedup=time_full / time_fast,
+    )
+
+
+def get_bls_results(
+    flat,
+    Rstar=1.0,
+    Mstar=1.0,
+    period_min=0.1,
+    period_max=None,
+    durations=BLS_DURATIONS,
+    bin_minutes=COARSE_BIN_MINUTES,
+    oversampling_factor=3,
+    use_err=True,
+):
+    """
+    Box least squares search of the binned lightcurve over the period grid
+    of tls, used to triage targets before running tls
+
+    Parameters
+    ----------
+    flat : lightkurve.LightCurve
+        flattened lightcurve
+    Rstar, Mstar : float
+        stellar radius and mass in solar units (for the period grid)
+    period_min, period_max : float
+        period search limits in days (default=0.1, baseline/2)
+    durations : list
+        transit durations in days; only those shorter than a period are
+        searched at that period
+    bin_minutes : float
+        bin size of the lightcurve
+    oversampling_factor : int
+        oversampling of the period grid
+    use_err : bool
+        use flux_err
+
+    Returns
+    -------
+    bls_results : dict
+        index.BLS_COLUMNS: SDE of the power of transit-like (dimming)
+        boxes, SNR of the depth and ephemeris of the highest peak
+    """
+    binned = bin_lc(flat, bin_minutes)
+    time, flux = np.asarray(binned.time), np.asarray(binned.flux)
+    flux_err = np.asarray(binned.flux_err) if use_err else None
+    idx = np.isfinite(flux)
+    if flux_err is not None:
+        idx &= np.isfinite(flux_err)
+        flux_err = flux_err[idx]
+    time, flux = time[idx], flux[idx]
+    time_span = time[-1] - time[0]
+    if period_max is None:
+        period_max = int(time_span) / 2
+    periods = np.sort(
+        period_grid(
+            R_star=Rstar,
+            M_star=Mstar,
+            time_span=time_span,
+            period_min=period_min,
+            period_max=period_max,
+            oversampling_factor=oversampling_factor,
+        )
+    )
+    durations = np.sort(durations)
+    model = BoxLeastSquares(time, flux, flux_err)
+    power = np.zeros(len(periods))
+    keys = ["depth", "depth_snr", "transit_time", "duration"]
+    stats = {key: np.full(len(periods), np.nan) for key in keys}
+    # durations must be shorter than the shortest period of each block
+    edges = np.r_[durations[1:], np.inf]
+    for duration, edge in zip(durations, edges):
+        block = (periods > duration) & (periods <= edge)
+        if not np.any(block):
+            continue
+        bls = model.power(
+            periods[block],
+            durations[durations <= duration],
+            objective="likelihood",
+        )
+        # only dimming boxes are transit-like
+        power[block] = np.where(bls.depth > 0, bls.power, 0)
+        for key in keys:
+            stats[key][block] = np.asarray(bls[key])
+    n = np.argmax(power)
+    std = np.std(power)
+    return dict(
+        # nan if no dimming box at all
+        bls_SDE=(power[n] - np.mean(power)) / std if std > 0 else np.nan,
+        bls_snr=stats["depth_snr"][n],
+        bls_period=periods[n],
+        bls_T0=stats["transit_time"][n],
+        bls_duration=stats["duration"][n],
+        bls_depth=stats["depth"][n],
+    )
+
+
+def passes_triage(bls_results, bls_sde_min=7.0, bls_snr_min=7.0):
+    """
+    whether a target passes the BLS triage; nan SDE or SNR (e.g. a
+    degenerate periodogram) fail
+    """
+    sde, snr = bls_results["bls_SDE"], bls_results["bls_snr"]
+    return bool((sde >= bls_sde_min) and (snr >= bls_snr_min))
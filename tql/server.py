@@ -0,0 +1,536 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived tql server keeping one warm worker process per core.
+
+Each worker imports astropy, lightkurve, chronos, wotan and tls once and
+compiles their numba kernels on a small synthetic lightcurve at startup.
+Requests are JSON objects with a target (ticid, toiid, gaiaid, coords or
+name) and keyword arguments of run_tql, sent over HTTP on localhost or a
+Unix socket:
+
+$ tql --serve -j 4
+$ curl -d '{"ticid": 52368076, "sector": 1, "savefig": true}' localhost:8765/run
+
+or from python with submit(ticid=52368076, sector=1). The reply has the
+status, the summary of the results (as in the index) and the paths of the
+outputs. Workers keep their catalog cache in memory and the last loaded
+targets and raw lightcurves, so that re-running a target with other
+detrending or search settings starts from its lightcurve; results of
+identical requests are served from the results cache.
+"""
+
+import os
+import json
+import math
+import socket
+import inspect
+import threading
+import http.client
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from time import time as timer
+
+from tql.config import (
+    CATALOG_CACHE_DIR,
+    RESULTS_CACHE_DIR,
+    SERVER_HOST,
+    SERVER_PORT,
+)
+
+TARGET_KEYS = ["gaiaid", "toiid", "ticid", "coords", "name"]
+# options of the figure
+RENDER_KEYS = ["savefig", "fast_render", "thumbnail", "tpf_cmap"]
+# arguments of run_tql set by the server
+SERVER_KEYS = [
+    "target",
+    "raw_lc",
+    "timings",
+    "store",
+    "float32",
+    "cache_dir",
+    "offline",
+    "results_cache_dir",
+    "verbose",
+]
+# targets and raw lightcurves kept by each worker
+MAX_LOADED = 8
+
+# loaded targets of this worker, most recently used last
+_loaded = OrderedDict()
+
+
+# +++++++++++++++++++++ worker
+def warmup():
+    """
+    compile the numba kernels of wotan, tql.biweight and tls on a synthetic
+    lightcurve
+    """
+    import numpy as np
+    import lightkurve as lk
+    from tql.core import flatten_lc, get_tls_results
+
+    rng = np.random.default_rng(0)
+    time = np.arange(0, 10, 30 / 60 / 24)
+    flux = rng.normal(1, 1e-3, len(time))
+    flux[(time % 1.5) < 0.1] -= 5e-3
+    lc = lk.LightCurve(time=time, flux=flux, flux_err=np.full_like(time, 1e-3))
+    flat, _ = flatten_lc(lc)
+    _ = flatten_lc(lc, flatten_method="fast_biweight")
+    _ = get_tls_results(flat, period_min=1, period_max=2)
+
+
+def _init_server_worker(do_warmup=True):
+    from tql.batch import _init_worker
+
+    _init_worker()
+    if do_warmup:
+        warmup()
+
+
+def get_loaded_target(kwargs, timings, clobber=False):
+    """
+    target and raw lightcurve of a request, loaded once by this worker for
+    the same target and lightcurve settings (the raw lightcurve of
+    stitched sectors is not kept)
+
+    Returns
+    -------
+    l, lctype, raw_lc
+    """
+    from tql.core import load_target, get_raw_lc
+
+    load_keys = inspect.signature(load_target).parameters
+    load_kwargs = {
+        k: v
+        for k, v in kwargs.items()
+        if (k in load_keys) and (k not in SERVER_KEYS + ["clobber"])
+    }
+    key = repr(
+        sorted(load_kwargs.items())
+        + [(k, kwargs.get(k)) for k in ["sectors", "mmap_tpf"]]
+    )
+    if clobber:
+        _ = _loaded.pop(key, None)
+    if key not in _loaded:
+        l, lctype = load_target(
+            cache_dir=kwargs.get("cache_dir", CATALOG_CACHE_DIR),
+            offline=kwargs.get("offline", False),
+            timings=timings,
+            verbose=False,
+            clobber=clobber,
+            **load_kwargs,
+        )
+        raw_lc = None
+        if kwargs.get("sectors") is None:
+            with timings.stage("lc_download"):
+                raw_lc = get_raw_lc(
+                    l, lctype, mmap_tpf=kwargs.get("mmap_tpf", False)
+                )
+        _loaded[key] = (l, lctype, raw_lc)
+        while len(_loaded) > MAX_LOADED:
+            _ = _loaded.popitem(last=False)
+    _loaded.move_to_end(key)
+    return _loaded[key]
+
+
+def _to_builtin(value):
+    if hasattr(value, "item"):
+        # numpy scalars
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _serve_target(request):
+    """
+    Run tql on the target of a request inside a worker
+
+    Returns
+    -------
+    response : dict
+        target, status (ok/rejected/failed), cached, runtime, message,
+        results (summary as in the index) and outputs (paths)
+    """
+    import matplotlib.pyplot as pl
+    from tql.batch import get_target_key, _render
+    from tql.core import run_tql, get_output_prefix, save_timings
+    from tql.index import get_index_row
+    from tql.profiling import StageTimer
+
+    kwargs = dict(request)
+    render_kwargs = {k: kwargs.pop(k) for k in RENDER_KEYS if k in kwargs}
+    fast_render = render_kwargs.pop("fast_render", False)
+    savefig = render_kwargs.get("savefig", False)
+    outdir = kwargs["outdir"]
+    clobber = kwargs.get("clobber", False)
+    timings = StageTimer()
+    response = {
+        "target": get_target_key(kwargs),
+        "cached": False,
+        "results": None,
+        "outputs": {},
+    }
+    start = timer()
+    try:
+        # loaded only if the results are not cached
+        results = run_tql(
+            **kwargs,
+            target=lambda: get_loaded_target(kwargs, timings, clobber)[:2],
+            raw_lc=lambda: get_loaded_target(kwargs, timings)[2],
+            timings=timings,
+            verbose=False,
+        )
+        prefix = get_output_prefix(results, outdir)
+        outputs = {}
+        if results.tls_results is None:
+            status = "rejected"
+            message = "BLS SDE={bls_SDE:.2f}, SNR={bls_snr:.2f}".format(
+                **results.bls_results
+            )
+        else:
+            status, message = "ok", ""
+            if kwargs.get("savetls", False):
+                outputs["tls"] = prefix + "_tls.h5"
+            if savefig:
+                _render(
+                    results,
+                    fast_render,
+                    dict(render_kwargs, outdir=outdir, verbose=False),
+                )
+                outputs["figure"] = prefix + ".png"
+                if render_kwargs.get("thumbnail", False):
+                    outputs["thumbnail"] = prefix + "_thumb.png"
+        outputs["timings"] = save_timings(results, outdir)
+        row = get_index_row(results, outputs.get("tls"))
+        row.update(
+            toiid=results.get("toiid"),
+            lctype=results.lctype,
+            cadence=results.cadence,
+            Prot_ls=results.get("Prot_ls"),
+        )
+        response.update(
+            status=status,
+            message=message,
+            cached=results.get("cached", False),
+            results={k: _to_builtin(v) for k, v in row.items()},
+            outputs=outputs,
+        )
+    except Exception as e:
+        response.update(status="failed", message=f"{type(e).__name__}: {e}")
+    pl.close("all")
+    response["runtime"] = round(timer() - start, 2)
+    return response
+
+
+# +++++++++++++++++++++ server
+class TqlServer:
+    """
+    Pool of warm tql workers serving requests of many clients, e.g.
+
+    >>> server = TqlServer(ncores=4, outdir="quicklooks")
+    >>> server.serve(port=8765)  # blocks until /shutdown
+
+    Parameters
+    ----------
+    ncores : int
+        number of worker processes (requests are run in parallel)
+    outdir : str
+        default output directory of requests
+    cache_dir : str
+        catalog cache of the workers (None=no cache)
+    results_cache_dir : str
+        results cache (None=no cache)
+    offline : bool
+        use only cached catalog query results
+    warmup : bool
+        compile the numba kernels of each worker at startup
+    verbose : bool
+        log requests
+    """
+
+    def __init__(
+        self,
+        ncores=1,
+        outdir=".",
+        cache_dir=CATALOG_CACHE_DIR,
+        results_cache_dir=RESULTS_CACHE_DIR,
+        offline=False,
+        warmup=True,
+        verbose=True,
+    ):
+        from tql.core import run_tql
+
+        self.ncores = ncores
+        self.outdir = outdir
+        self.defaults = dict(
+            outdir=outdir,
+            cache_dir=cache_dir,
+            results_cache_dir=results_cache_dir,
+            offline=offline,
+        )
+        self.verbose = verbose
+        self.keys = [
+            k
+            for k in inspect.signature(run_tql).parameters
+            if k not in SERVER_KEYS
+        ] + RENDER_KEYS
+        self.nserved, self.nrunning = 0, 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._warmup = warmup
+        self.pool = self._start_pool()
+
+    def _start_pool(self):
+        pool = ProcessPoolExecutor(
+            max_workers=self.ncores,
+            initializer=_init_server_worker,
+            initargs=(self._warmup,),
+        )
+        # start (and warm up) the workers before the first request
+        _ = pool.submit(int)
+        return pool
+
+    def __repr__(self):
+        return f"TqlServer(ncores={self.ncores}, served={self.nserved})"
+
+    def parse_request(self, request):
+        """
+        keyword arguments of the worker from a request; raises ValueError
+        if it has no target or unknown keys
+        """
+        if not isinstance(request, dict):
+            raise ValueError("request should be a JSON object")
+        unknown = sorted(set(request) - set(self.keys))
+        if len(unknown) > 0:
+            raise ValueError(f"unknown keys: {unknown}")
+        if all(request.get(k) is None for k in TARGET_KEYS):
+            raise ValueError(f"request should have one of {TARGET_KEYS}")
+        return dict(self.defaults, **request)
+
+    def run(self, request):
+        """
+        run a parsed request in a worker (blocks until done); if a worker
+        dies (e.g. killed out of memory) the pool is restarted and the
+        request fails
+        """
+        from tql.batch import get_target_key
+
+        with self._lock:
+            self.nrunning += 1
+            pool = self.pool
+        start = timer()
+        try:
+            return pool.submit(_serve_target, request).result()
+        except BrokenProcessPool as e:
+            with self._lock:
+                # other requests of the broken pool may have restarted it
+                if self.pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._start_pool()
+            return {
+                "target": get_target_key(request),
+                "status": "failed",
+                "message": f"worker died: {e}",
+                "cached": False,
+                "results": None,
+                "outputs": {},
+                "runtime": round(timer() - start, 2),
+            }
+        finally:
+            with self._lock:
+                self.nrunning -= 1
+                self.nserved += 1
+
+    def get_status(self):
+        return {
+            "status": "ok",
+            "ncores": self.ncores,
+            "running": self.nrunning,
+            "served": self.nserved,
+            "outdir": os.path.abspath(self.outdir),
+        }
+
+    def serve(self, host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+        """
+        serve requests on host:port (or on the Unix socket socket_path)
+        until a POST /shutdown or KeyboardInterrupt
+        """
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._server = _UnixHTTPServer(socket_path, _Handler)
+            address = socket_path
+        else:
+            self._server = ThreadingHTTPServer((host, port), _Handler)
+            address = f"http://{host}:{port}"
+        self._server.tql = self
+        if self.verbose:
+            print(f"tql server on {address} with {self.ncores} workers")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+            if socket_path is not None and os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.close()
+
+    def shutdown(self):
+        """
+        stop serve() (from another thread)
+        """
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown).start()
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def address_string(self):
+        # client_address is empty for Unix sockets
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.tql.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.server.tql.get_status())
+        else:
+            self._reply(404, {"status": "failed", "message": "not found"})
+
+    def do_POST(self):
+        server = self.server.tql
+        if self.path == "/shutdown":
+            self._reply(200, {"status": "ok"})
+            server.shutdown()
+            return
+        if self.path != "/run":
+            self._reply(404, {"status": "failed", "message": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = server.parse_request(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            # also invalid JSON
+            self._reply(400, {"status": "failed", "message": str(e)})
+            return
+        response = server.run(request)
+        self._reply(500 if response["status"] == "failed" else 200, response)
+
+
+def serve(
+    ncores=1,
+    host=SERVER_HOST,
+    port=SERVER_PORT,
+    socket_path=None,
+    outdir=".",
+    **kwargs,
+):
+    """
+    start a TqlServer and serve requests until shutdown (see TqlServer)
+    """
+    server = TqlServer(ncores=ncores, outdir=outdir, **kwargs)
+    server.serve(host=host, port=port, socket_path=socket_path)
+
+
+# +++++++++++++++++++++ client
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _request(
+    method,
+    path,
+    body=None,
+    host=SERVER_HOST,
+    port=SERVER_PORT,
+    socket_path=None,
+    timeout=None,
+):
+    if socket_path is not None:
+        conn = _UnixHTTPConnection(socket_path, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        data = None if body is None else json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"}
+        conn.request(method, path, body=data, headers=headers)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def submit(
+    host=SERVER_HOST, port=SERVER_PORT, socket_path=None, timeout=None, **kw
+):
+    """
+    run a target on a tql server, e.g. submit(ticid=52368076, sector=1,
+    savefig=True)
+
+    Parameters
+    ----------
+    kw : dict
+        target (ticid, toiid, gaiaid, coords or name) and keyword arguments
+        of run_tql and of the figure (savefig, fast_render, thumbnail,
+        tpf_cmap)
+
+    Returns
+    -------
+    response : dict
+        see _serve_target
+    """
+    return _request(
+        "POST",
+        "/run",
+        kw,
+        host=host,
+        port=port,
+        socket_path=socket_path,
+        timeout=timeout,
+    )
+
+
+def get_status(host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+    """
+    number of workers, running and served requests of a tql server
+    """
+    return _request(
+        "GET", "/status", host=host, port=port, socket_path=socket_path
+    )
+
+
+def shutdown(host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+    """
+    stop a tql server
+    """
+    return _request(
+        "POST", "/shutdown", host=host, port=port, socket_path=socket_path
+    )
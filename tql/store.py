@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed container of the tls results of a whole run.
+
+Layout of the HDF5 file:
+* /targets : table of scalars, one row per target (see tql.index)
+* /arrays/<node>/<key> : chunked, compressed array datasets of a target,
+  e.g. /arrays/tic52368076_s1_pdcsap_sc/power; the sector ranges of
+  stitched targets are spelled out in the node name, e.g.
+  tic52368076_s1-3,5_pdcsap_sc -> /arrays/tic52368076_s1to3_5_pdcsap_sc
+
+Arrays of a single target can be read lazily (and sliced) without loading
+the rest of the run.
+"""
+
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import tables
+
+from tql.index import (
+    INDEX_COLUMNS,
+    INT_COLUMNS,
+    STRING_COLUMNS,
+    get_index_row,
+)
+
+STORE_ARRAYS = [
+    "periods",
+    "power",
+    "power_raw",
+    "SR",
+    "model_folded_phase",
+    "model_folded_model",
+    "folded_phase",
+    "folded_y",
+    "folded_dy",
+    "model_lightcurve_time",
+    "model_lightcurve_model",
+    "transit_times",
+    "per_transit_count",
+    "snr_per_transit",
+    "time_raw",
+    "flux_raw",
+    "time_flat",
+    "flux_flat",
+]
+# kept in float64 even if downcasting: BTJD times lose ~10 s in float32
+FLOAT64_ARRAYS = [
+    "model_lightcurve_time",
+    "transit_times",
+    "time_raw",
+    "time_flat",
+]
+# as the file names of the index
+NAME_SIZE = 256
+
+
+def _get_description():
+    description = {"name": tables.StringCol(NAME_SIZE, pos=0)}
+    # the name identifies the target
+    columns = [col for col in INDEX_COLUMNS if col not in STRING_COLUMNS]
+    for n, col in enumerate(columns):
+        if col in INT_COLUMNS:
+            description[col] = tables.Int64Col(pos=n + 1, dflt=-1)
+        else:
+            description[col] = tables.Float64Col(pos=n + 1, dflt=np.nan)
+    return description
+
+
+def _to_condition(where):
+    """
+    pytables condition from a pandas-like query, e.g.
+    "SDE > 10 & period < 5" -> "(SDE > 10) & (period < 5)"
+    """
+    tokens = re.split(r"\s*([&|])\s*", where.strip())
+    return " ".join(t if t in "&|" else f"({t})" for t in tokens if t != "")
+
+
+def _get_node_name(name):
+    """
+    valid pytables name of the group of a target, e.g.
+    tic52368076_s1-3,5_pdcsap_sc -> tic52368076_s1to3_5_pdcsap_sc
+    """
+    return name.replace("-", "to").replace(",", "_")
+
+
+def get_store_name(results):
+    """
+    name of a target in the store, e.g. tic52368076_s1_pdcsap_sc
+    """
+    from tql.core import get_output_prefix
+
+    return os.path.basename(get_output_prefix(results, outdir=""))
+
+
+def get_store_record(results):
+    """
+    scalars and arrays of the output of run_tql to be added to a store;
+    small enough to be returned by worker processes
+
+    Returns
+    -------
+    name, row, arrays : str, dict, dict
+    """
+    name = get_store_name(results)
+    row = get_index_row(results)
+    row.pop("filename")
+    # targets rejected by the BLS triage have no arrays
+    tls_results = results.tls_results or {}
+    arrays = {
+        key: np.asarray(tls_results[key])
+        for key in STORE_ARRAYS
+        if tls_results.get(key) is not None
+    }
+    return name, row, arrays
+
+
+class ResultStore:
+    """
+    Chunked, compressed HDF5 container of the tls results of a run, e.g.
+
+    >>> with ResultStore("tql_results.h5", float32=True) as store:
+    ...     store.add(results)
+    >>> with ResultStore("tql_results.h5", mode="r") as store:
+    ...     df = store.get_scalars("SDE > 10")
+    ...     power = store.get_array(df.name[0], "power")
+
+    Parameters
+    ----------
+    fp : str
+        file path
+    mode : str
+        "a" (append) or "r" (read only)
+    float32 : bool
+        downcast float arrays (except times) to float32
+    complevel : int
+        compression level (0-9)
+    complib : str
+        compression library (zlib, blosc, lzo, bzip2)
+    """
+
+    def __init__(
+        self, fp, mode="a", float32=False, complevel=5, complib="zlib"
+    ):
+        self.fp = fp
+        self.mode = mode
+        self.float32 = float32
+        self.filters = tables.Filters(
+            complevel=complevel, complib=complib, shuffle=True
+        )
+        if (mode != "r") and os.path.dirname(fp) != "":
+            os.makedirs(os.path.dirname(fp), exist_ok=True)
+        self.h5 = tables.open_file(fp, mode=mode)
+        if mode != "r" and "targets" not in self.h5.root:
+            self.h5.create_table(
+                "/", "targets", _get_description(), filters=self.filters
+            )
+            self.h5.create_group("/", "arrays")
+
+    def __repr__(self):
+        return f"ResultStore({self.fp}, {len(self)} targets)"
+
+    def __len__(self):
+        return self.h5.root.targets.nrows
+
+    def __contains__(self, name):
+        return _get_node_name(name) in self.h5.root.arrays
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.h5.close()
+
+    def names(self):
+        return [
+            g._v_attrs["name"] if "name" in g._v_attrs else g._v_name
+            for g in self.h5.iter_nodes("/arrays")
+        ]
+
+    def add(self, results, overwrite=True):
+        """
+        add the output of run_tql
+        """
+        self.append(*get_store_record(results), overwrite=overwrite)
+
+    def append(self, name, row, arrays, overwrite=True):
+        """
+        add the scalars (dict) and arrays (dict) of a target
+        """
+        if len(name.encode()) > NAME_SIZE:
+            raise ValueError(f"{name} is longer than {NAME_SIZE} characters")
+        if name in self:
+            if not overwrite:
+                raise ValueError(f"{name} exists in {self.fp}")
+            self.remove(name)
+        table = self.h5.root.targets
+        record = table.row
+        record["name"] = name
+        # stores made before a column was added to the index lack it
+        for col in table.colnames[1:]:
+            value = row.get(col)
+            if (value is not None) and np.isfinite(value):
+                record[col] = value
+            else:
+                record[col] = table.coldflts[col]
+        record.append()
+        table.flush()
+
+        group = self.h5.create_group("/arrays", _get_node_name(name))
+        group._v_attrs["name"] = name
+        for key, arr in arrays.items():
+            arr = np.asarray(arr)
+            if (
+                self.float32
+                and (arr.dtype == np.float64)
+                and (key not in FLOAT64_ARRAYS)
+            ):
+                arr = arr.astype(np.float32)
+            if arr.size == 0:
+                self.h5.create_array(group, key, obj=arr)
+            else:
+                self.h5.create_carray(
+                    group, key, obj=arr, filters=self.filters
+                )
+        self.h5.flush()
+
+    def remove(self, name):
+        """
+        remove the scalars and arrays of a target
+        """
+        table = self.h5.root.targets
+        rows = table.get_where_list(f"name == {name.encode()!r}")
+        for n in rows[::-1]:
+            table.remove_rows(n, n + 1)
+        if name in self:
+            self.h5.remove_node(
+                "/arrays", _get_node_name(name), recursive=True
+            )
+
+    def get_scalars(self, where=None):
+        """
+        table of scalars
+
+        Parameters
+        ----------
+        where : str
+            query evaluated on disk, e.g. "SDE > 10 & period < 5"
+
+        Returns
+        -------
+        df : pandas.DataFrame
+        """
+        table = self.h5.root.targets
+        if where is None:
+            data = table.read()
+        else:
+            data = table.read_where(_to_condition(where))
+        df = pd.DataFrame(data)
+        df["name"] = df["name"].str.decode("utf-8")
+        return df
+
+    def get_array(self, name, key, start=None, stop=None):
+        """
+        read (a slice of) one array of a target
+        """
+        node = self.h5.get_node(f"/arrays/{_get_node_name(name)}", key)
+        return node.read(start, stop)
+
+    def get(self, name, keys=None):
+        """
+        read arrays of a target
+
+        Returns
+        -------
+        arrays : dict
+        """
+        group = self.h5.get_node("/arrays", _get_node_name(name))
+        if keys is None:
+            keys = [node._v_name for node in group]
+        return {key: group._f_get_child(key).read() for key in keys}
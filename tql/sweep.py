@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Re-run one target over a grid of detrending and aperture settings.
+
+The target is instantiated, cross-matched and its raw lightcurve of each
+aperture downloaded once in the parent process; the grid is then fanned out
+over forked worker processes which inherit them. The SDE, period and depth
+of each setting are written to a comparison table.
+"""
+
+import os
+import inspect
+import itertools
+import traceback
+import multiprocessing as mp
+from time import time as timer
+
+import pandas as pd
+
+from tql.core import (
+    TqlResults,
+    load_target,
+    get_raw_lc,
+    get_tpf,
+    get_cube,
+    get_output_prefix,
+    run_tql,
+)
+from tql.aperture import get_aperture_lcs, to_lightcurves
+
+# run_tql parameters which can be swept and their types
+SWEEP_PARAMS = {
+    "flatten_method": str,
+    "window_length": float,
+    "edge_cutoff": float,
+    "sigma": tuple,
+    "sap_mask": str,
+    "aper_radius": int,
+    "threshold_sigma": float,
+    "percentile": float,
+}
+APERTURE_PARAMS = ["sap_mask", "aper_radius", "threshold_sigma", "percentile"]
+SWEEP_COLUMNS = [
+    "SDE",
+    "period",
+    "T0",
+    "duration",
+    "depth",
+    "Rp",
+    "odd_even_mismatch",
+    "contratio",
+]
+# shared with forked workers
+_shared = {}
+
+
+def parse_sweep_args(items):
+    """
+    Parse command line grid specifications, e.g.
+    ["flatten_method=biweight,median", "window_length=0.3,0.5", "sigma=10:3"]
+
+    Returns
+    -------
+    grid : dict
+        list of values of each parameter
+    """
+    grid = {}
+    for item in items:
+        key, _, values = item.partition("=")
+        errmsg = f"sweep parameter should be one of {list(SWEEP_PARAMS)}"
+        assert key in SWEEP_PARAMS, errmsg
+        assert values != "", f"no values given for {key}"
+        kind = SWEEP_PARAMS[key]
+        if kind is tuple:
+            # e.g. sigma=10:3,5:3
+            grid[key] = [
+                tuple(float(v) for v in value.split(":"))
+                for value in values.split(",")
+            ]
+        else:
+            grid[key] = [kind(value) for value in values.split(",")]
+    return grid
+
+
+def get_param_grid(grid):
+    """
+    all combinations of the parameter grid
+
+    Parameters
+    ----------
+    grid : dict
+        e.g. {"flatten_method": ["biweight", "median"],
+              "window_length": [0.3, 0.5, 1.0]}
+
+    Returns
+    -------
+    settings : list of dict
+    """
+    keys = list(grid.keys())
+    return [
+        dict(zip(keys, values))
+        for values in itertools.product(*[grid[k] for k in keys])
+    ]
+
+
+def get_aperture(kwargs):
+    return tuple(kwargs.get(k) for k in APERTURE_PARAMS)
+
+
+def set_aperture(l, aperture):
+    """
+    set the aperture of the target; contratio is recomputed for it
+    """
+    for key, value in zip(APERTURE_PARAMS, aperture):
+        if value is not None:
+            setattr(l, key, value)
+    l.contratio = None
+
+
+def get_custom_lcs(l, settings, kwargs):
+    """
+    custom lightcurves of all apertures of the grid from one read of the
+    memory-mapped tpf (see aperture.get_aperture_lcs)
+
+    Returns
+    -------
+    raw_lcs : dict
+        lightcurve of each aperture (see get_aperture)
+    """
+    keys, specs = [], []
+    for params in settings:
+        aperture = get_aperture(dict(kwargs, **params))
+        if aperture not in keys:
+            set_aperture(l, aperture)
+            keys.append(aperture)
+            specs.append({k: getattr(l, k) for k in APERTURE_PARAMS})
+    cadence = kwargs.get("cadence", "short")
+    aperture_lcs = get_aperture_lcs(
+        get_tpf(l, cadence),
+        specs,
+        subtract_bkg=cadence == "long",
+        cube=get_cube(l, cadence),
+    )
+    return dict(zip(keys, to_lightcurves(aperture_lcs)))
+
+
+def _run_setting(params):
+    """
+    run tql with one setting of the grid on the shared target
+    """
+    l, lctype = _shared["target"]
+    kwargs = dict(_shared["kwargs"], **params)
+    aperture = get_aperture(kwargs)
+    set_aperture(l, aperture)
+    key = aperture if lctype == "custom" else None
+    row = dict(params)
+    start = timer()
+    try:
+        results = run_tql(
+            target=(l, lctype),
+            raw_lc=_shared["raw_lcs"][key],
+            **kwargs,
+        )
+        row.update({k: results.get(k) for k in SWEEP_COLUMNS})
+        row["status"], row["message"] = "ok", ""
+    except Exception as e:
+        row["status"], row["message"] = "failed", f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    row["runtime"] = timer() - start
+    return row
+
+
+def run_sweep(grid, ncores=1, outdir=".", verbose=True, **kwargs):
+    """
+    Run tql on one target over a parameter grid
+
+    Parameters
+    ----------
+    grid : dict
+        list of values of each of SWEEP_PARAMS (see get_param_grid)
+    ncores : int
+        number of worker processes
+    outdir : str
+        directory of the comparison table (*_sweep.csv)
+    kwargs : dict
+        target and other parameters of run_tql shared by all settings
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        SDE, period, depth etc. of each setting
+    """
+    if kwargs.get("sectors") is not None:
+        # the raw lightcurves of the grid are single sectors
+        raise ValueError("sweeps of stitched sectors are not supported")
+    settings = get_param_grid(grid)
+    parameters = inspect.signature(load_target).parameters
+    target_kwargs = {k: v for k, v in kwargs.items() if k in parameters}
+    l, lctype = load_target(verbose=verbose, **target_kwargs)
+
+    # download (or make) the raw lightcurve once per aperture; only custom
+    # lightcurves depend on the aperture
+    raw_lcs = {}
+    if (lctype == "custom") and kwargs.get("mmap_tpf", False):
+        raw_lcs = get_custom_lcs(l, settings, kwargs)
+    for params in settings:
+        aperture = get_aperture(dict(kwargs, **params))
+        key = aperture if lctype == "custom" else None
+        if key not in raw_lcs:
+            set_aperture(l, aperture)
+            raw_lcs[key] = get_raw_lc(l, lctype)
+
+    kwargs.update(outdir=outdir, savetls=False, verbose=False)
+    _shared.update(target=(l, lctype), raw_lcs=raw_lcs, kwargs=kwargs)
+    if verbose:
+        print(f"Running {len(settings)} settings on {ncores} cores")
+    if ncores == 1:
+        rows = [_run_setting(params) for params in settings]
+    else:
+        # workers inherit the target and lightcurves
+        ctx = mp.get_context("fork")
+        with ctx.Pool(processes=min(ncores, len(settings))) as pool:
+            rows = pool.map(_run_setting, settings, chunksize=1)
+    _shared.clear()
+
+    df = pd.DataFrame(rows)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    target = TqlResults(
+        ticid=l.ticid,
+        sector=l.sector,
+        lctype=lctype,
+        cadence=kwargs.get("cadence", "short"),
+    )
+    fp = get_output_prefix(target, outdir) + "_sweep.csv"
+    df.to_csv(fp, index=False)
+    if verbose:
+        print(df.to_string(index=False))
+        print(f"Saved: {fp}")
+    return df
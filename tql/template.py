@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+Fast rendering of the quick look figure for batch runs.
+
+FigureTemplate lays out the 3x3 figure and creates its artists once; each
+target only updates their data in place and the figure is saved without
+re-running the layout (no constrained_layout nor bbox_inches="tight").
+Dense panels are drawn as markers of Line2D artists (cheaper than scatter),
+decimated to at most max_points and rasterized in vector outputs; the
+phase-folded panels only draw the points within the plotted window. The
+figure is not managed by pyplot, so pl.close("all") in batch workers does
+not close it.
+"""
+
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from tql.core import get_output_prefix
+from tql.fold import fold_phase, fold_and_bin, get_binned
+from tql.profiling import StageTimer
+from tql.tpf import get_tpf_cube
+
+# points drawn per panel
+MAX_POINTS = 20000
+DPI = 100
+THUMBNAIL_DPI = 30
+# lower and higher harmonics of the TLS period shown in the periodogram
+HARMONICS = list(range(2, 10))
+
+
+def decimate(*arrays, max_points=MAX_POINTS):
+    """
+    every n-th element of arrays so that at most max_points are left
+    """
+    n = len(arrays[0])
+    step = max(1, int(np.ceil(n / max_points)))
+    return [np.asarray(arr)[::step] for arr in arrays]
+
+
+def _values(arr):
+    """
+    float array of time or flux (also of astropy Time & Quantity)
+    """
+    return np.asarray(getattr(arr, "value", arr), dtype=float)
+
+
+def _get_limits(y, pad=0.05):
+    y = np.asarray(y)
+    y = y[np.isfinite(y)]
+    if len(y) == 0:
+        return 0, 1
+    lo, hi = y.min(), y.max()
+    dy = (hi - lo) * pad if hi > lo else 1e-3
+    return lo - dy, hi + dy
+
+
+def get_median_image(tpf):
+    """
+    median image of the tpf (from the memory-mapped cube if possible)
+    """
+    cube = get_tpf_cube(tpf)
+    if cube is not None:
+        return cube.get_median_image()
+    return np.nanmedian(_values(tpf.flux), axis=0)
+
+
+class FigureTemplate:
+    """
+    Quick look figure laid out once and updated in place for each target,
+    e.g.
+
+    >>> template = FigureTemplate()
+    >>> for results in many_results:
+    ...     template.update(results)
+    ...     template.savefig(get_output_prefix(results) + ".png")
+
+    Parameters
+    ----------
+    tpf_cmap : str
+        colormap of tpf
+    max_points : int
+        points drawn per panel
+    dpi : int
+        resolution of saved figures
+    """
+
+    def __init__(self, tpf_cmap="viridis", max_points=MAX_POINTS, dpi=DPI):
+        self.max_points = max_points
+        self.dpi = dpi
+        self.fig = Figure(figsize=(15, 12))
+        FigureCanvasAgg(self.fig)
+        axs = self.fig.subplots(3, 3).flatten()
+        self.fig.subplots_adjust(
+            left=0.05,
+            right=0.97,
+            bottom=0.05,
+            top=0.93,
+            wspace=0.3,
+            hspace=0.3,
+        )
+        self.axs = axs
+        self.title = self.fig.suptitle("")
+        self._init_raw(axs[0])
+        self._init_ls(axs[1])
+        self._init_rotation_fold(axs[2])
+        self._init_flat(axs[3])
+        self._init_tls(axs[4])
+        self._init_fold(axs[5])
+        self._init_odd_even(axs[6])
+        self._init_tpf(axs[7], tpf_cmap)
+        self.summary = axs[8].text(0, 0, "", fontsize=10)
+        axs[8].axis("off")
+        self.nrendered = 0
+
+    def __repr__(self):
+        return f"FigureTemplate({self.nrendered} targets rendered)"
+
+    def _points(self, ax, fmt="k.", ms=2, **kwargs):
+        (line,) = ax.plot([], [], fmt, ms=ms, **kwargs)
+        line.set_rasterized(True)
+        return line
+
+    # +++++++++++++++++++++ artists
+    def _init_raw(self, ax):
+        self.raw = self._points(ax, label="raw")
+        (self.trend,) = ax.plot([], [], "r-", lw=1, label="trend")
+        ax.legend(loc="upper right")
+        ax.set_xlabel("Time [BTJD]")
+        ax.set_ylabel("Normalized Flux")
+
+    def _init_ls(self, ax):
+        (self.ls,) = ax.plot([], [], "k-")
+        self.ls_peak = ax.axvline(1, 0, 1, ls="--", c="r", label="peak")
+        self.ls_legend = ax.legend(title="Rotation period [d]")
+        ax.set_xscale("log")
+        ax.set_xlabel("Period [days]")
+        ax.set_ylabel("Lomb-Scargle Power")
+
+    def _init_rotation_fold(self, ax):
+        self.rot = ax.scatter(
+            [], [], c=[], s=4, cmap="Blues", label="folded at Prot"
+        )
+        self.rot.set_rasterized(True)
+        (self.rot_model,) = ax.plot(
+            [], [], "r-", lw=3, label="sine model", zorder=3
+        )
+        self.fig.colorbar(self.rot, ax=ax, label="Time [BTJD]")
+        self.rot_legend = ax.legend()
+        ax.set_ylabel("Normalized Flux")
+        ax.set_xlabel("Phase [days]")
+
+    def _init_flat(self, ax):
+        self.flat = self._points(ax, label="flat")
+        self.flat_transit = self._points(ax, "r.", alpha=0.5, label="transit")
+        ax.legend(loc="upper right")
+        ax.set_xlabel("Time [BTJD]")
+        ax.set_ylabel("Normalized Flux")
+
+    def _init_tls(self, ax):
+        (self.tls,) = ax.plot([], [], color="black", lw=0.5)
+        self.tls_peak = ax.axvline(1, alpha=0.4, lw=3, label="peak")
+        self.harmonics = [
+            ax.axvline(1, alpha=0.4, lw=1, linestyle="dashed")
+            for _ in range(2 * len(HARMONICS))
+        ]
+        self.tls_legend = ax.legend(title="Orbital period [d]")
+        ax.set_ylabel(r"Transit Least Squares SDE")
+        ax.set_xlabel("Period (days)")
+
+    def _init_fold(self, ax):
+        self.fold = self._points(ax, label="folded at Porb")
+        self.fold_binned = self._points(ax, "o", ms=5, label="bin")
+        (self.fold_model,) = ax.plot(
+            [], [], color="red", zorder=3, label="TLS model"
+        )
+        self.fold_legend = ax.legend()
+        ax.set_xlabel("Phase")
+        ax.set_ylabel("Relative flux")
+
+    def _init_odd_even(self, ax):
+        self.odd_even = self._points(ax, label="_nolegend_")
+        self.even = self._points(ax, "o", ms=5, label="even")
+        self.odd = self._points(ax, "o", ms=5, label="odd")
+        (self.odd_even_model,) = ax.plot(
+            [], [], color="red", zorder=3, label="TLS model"
+        )
+        self.depth = ax.axhline(1, 0, 1, lw=2, ls="--", c="k")
+        ax.legend()
+        ax.set_xlabel("Phase")
+        ax.set_ylabel("Relative flux")
+
+    def _init_tpf(self, ax, cmap):
+        self.tpf_image = ax.imshow(
+            np.zeros((2, 2)), origin="lower", cmap=cmap, aspect="equal"
+        )
+        self.aperture = ax.imshow(
+            np.zeros((2, 2, 4)), origin="lower", aspect="equal"
+        )
+        self.gaia = ax.scatter(
+            [], [], s=30, facecolors="none", edgecolors="w", label="Gaia DR2"
+        )
+        (self.target,) = ax.plot([], [], "rx", ms=10, label="target")
+        ax.set_xlabel("Pixel column")
+        ax.set_ylabel("Pixel row")
+
+    # +++++++++++++++++++++ updates
+    def update(self, results, summary=None, title=None):
+        """
+        set the data of all panels to the output of run_tql
+
+        Parameters
+        ----------
+        summary, title : str
+            text of the summary panel and title
+            (default=tql.get_summary_text and tql.get_title)
+        """
+        from tql.tql import get_summary_text, get_title
+
+        self._update_raw(results)
+        self._update_ls(results)
+        self._update_rotation_fold(results)
+        self._update_flat(results)
+        self._update_tls(results)
+        self._update_folds(results)
+        self._update_tpf(results)
+        self.summary.set_text(
+            get_summary_text(results) if summary is None else summary
+        )
+        self.title.set_text(get_title(results) if title is None else title)
+        self.nrendered += 1
+
+    def _update_raw(self, results):
+        lc, trend = results.lc, results.trend
+        time = _values(lc.time)
+        x, y = decimate(time, _values(lc.flux), max_points=self.max_points)
+        self.raw.set_data(x, y)
+        self.trend.set_data(_values(trend.time), _values(trend.flux))
+        ax = self.axs[0]
+        ax.set_xlim(*_get_limits(time, pad=0.01))
+        ax.set_ylim(*_get_limits(y))
+
+    def _update_ls(self, results):
+        best_period = results.Prot_ls
+        self.ls.set_data(results.ls_periods, results.ls_powers)
+        self.ls_peak.set_xdata([best_period, best_period])
+        self.ls_legend.get_texts()[0].set_text(f"peak={best_period:.2f}")
+        ax = self.axs[1]
+        ax.set_xlim(np.min(results.ls_periods), np.max(results.ls_periods))
+        ax.set_ylim(0, 1.05 * np.nanmax(results.ls_powers))
+
+    def _update_rotation_fold(self, results):
+        best_period = results.Prot_ls
+        time, flux = _values(results.lc.time), _values(results.lc.flux)
+        tmask = results.rot_mask
+        phase = ((time / best_period) % 1) - 0.5
+        x, y, c = decimate(
+            (phase * best_period)[~tmask],
+            flux[~tmask],
+            time[~tmask],
+            max_points=self.max_points,
+        )
+        self.rot.set_offsets(np.c_[x, y])
+        self.rot.set_array(c)
+        self.rot.set_clim(*_get_limits(c, pad=0))
+        t_fit, y_fit = results.ls_model
+        self.rot_model.set_data(t_fit * best_period, y_fit)
+        label = "masked & " if results.rot_masked else ""
+        self.rot_legend.get_texts()[0].set_text(label + "folded at Prot")
+        ax = self.axs[2]
+        ax.set_xlim(-best_period / 2, best_period / 2)
+        ax.set_ylim(*_get_limits(y))
+
+    def _update_flat(self, results):
+        flat = results.flat
+        time, flux = _values(flat.time), _values(flat.flux)
+        x, y = decimate(time, flux, max_points=self.max_points)
+        self.flat.set_data(x, y)
+        tmask = results.transit_mask
+        self.flat_transit.set_data(time[tmask], flux[tmask])
+        ax = self.axs[3]
+        ax.set_xlim(*_get_limits(time, pad=0.01))
+        ax.set_ylim(*_get_limits(y))
+
+    def _update_tls(self, results):
+        tls_results = results.tls_results
+        period = tls_results.period
+        period_min, period_max = results.period_min, results.period_max
+        self.tls.set_data(tls_results.periods, tls_results.power)
+        self.tls_peak.set_xdata([period, period])
+        self.tls_legend.get_texts()[0].set_text(f"peak={period:.3}")
+        harmonics = [i * period for i in HARMONICS]
+        harmonics += [period / i for i in HARMONICS]
+        for line, x in zip(self.harmonics, harmonics):
+            line.set_xdata([x, x])
+            line.set_visible(period_min <= x <= period_max)
+        ax = self.axs[4]
+        ax.set_xlim(period_min, period_max)
+        ax.set_ylim(0, 1.05 * max(np.nanmax(tls_results.power), 1))
+
+    def _update_folds(self, results):
+        tls_results = results.tls_results
+        flat = results.flat
+        time, flux = _values(flat.time), _values(flat.flux)
+        phase, _ = fold_phase(time, tls_results.period, tls_results.T0)
+        xlim = 1.5 * tls_results.duration / tls_results.period
+        # only points within the plotted window are drawn
+        window = np.abs(phase) <= xlim
+        x, y = decimate(
+            phase[window], flux[window], max_points=self.max_points
+        )
+        # all, even and odd transits binned in one pass
+        bins = fold_and_bin(
+            time,
+            flux,
+            tls_results.period,
+            tls_results.T0,
+            width=results.bin_hr / 24,
+            xlim=xlim,
+        )
+        model = (
+            np.asarray(tls_results.model_folded_phase) - 0.5,
+            tls_results.model_folded_model,
+        )
+        alpha = 0.5 if results.cadence == "long" else 0.1
+        ylim = _get_limits(np.r_[y, tls_results.depth])
+
+        self.fold.set_data(x, y)
+        self.fold.set_alpha(alpha)
+        self.fold_binned.set_data(*get_binned(bins, "all")[:2])
+        self.fold_model.set_data(*model)
+        label = f"{results.bin_hr}-hr bin"
+        self.fold_legend.get_texts()[1].set_text(label)
+
+        self.odd_even.set_data(x, y)
+        self.odd_even.set_alpha(alpha)
+        self.even.set_data(*get_binned(bins, "even")[:2])
+        self.odd.set_data(*get_binned(bins, "odd")[:2])
+        self.odd_even_model.set_data(*model)
+        self.depth.set_ydata([tls_results.depth, tls_results.depth])
+        for ax in self.axs[5:7]:
+            ax.set_xlim(-xlim, xlim)
+            ax.set_ylim(*ylim)
+
+    def _update_tpf(self, results):
+        ax = self.axs[7]
+        tpf = results.get("tpf")
+        visible = tpf is not None
+        for artist in [self.tpf_image, self.aperture, self.gaia, self.target]:
+            artist.set_visible(visible)
+        if not visible:
+            return
+        image = get_median_image(tpf)
+        ny, nx = image.shape
+        extent = (-0.5, nx - 0.5, -0.5, ny - 0.5)
+        self.tpf_image.set_data(image)
+        self.tpf_image.set_extent(extent)
+        self.tpf_image.set_clim(*np.nanpercentile(image, [1, 99]))
+        overlay = np.zeros((ny, nx, 4))
+        aper_mask = results.get("aper_mask")
+        if aper_mask is not None:
+            overlay[np.asarray(aper_mask, dtype=bool)] = (1, 0, 0, 0.3)
+        self.aperture.set_data(overlay)
+        self.aperture.set_extent(extent)
+        gaia_sources = results.get("gaia_sources")
+        xy = np.empty((0, 2))
+        target = np.empty((0, 2))
+        if gaia_sources is not None and len(gaia_sources) > 0:
+            radec = gaia_sources[["ra", "dec"]].values
+            xy = tpf.wcs.all_world2pix(radec, 0)
+            on_tpf = (
+                (xy[:, 0] > -0.5)
+                & (xy[:, 0] < nx - 0.5)
+                & (xy[:, 1] > -0.5)
+                & (xy[:, 1] < ny - 0.5)
+            )
+            is_target = gaia_sources["source_id"].values == results.gaiaid
+            target = xy[is_target & on_tpf]
+            xy = xy[on_tpf & ~is_target]
+        self.gaia.set_offsets(xy)
+        self.target.set_data(target[:, 0], target[:, 1])
+        ax.set_xlim(extent[:2])
+        ax.set_ylim(extent[2:])
+
+    def savefig(self, fp, dpi=None):
+        """
+        save the figure (dpi=self.dpi by default)
+        """
+        self.fig.savefig(fp, dpi=self.dpi if dpi is None else dpi)
+
+
+_templates = {}
+
+
+def get_template(tpf_cmap="viridis"):
+    """
+    FigureTemplate shared by all targets rendered in this process
+    (e.g. in batch workers)
+    """
+    if tpf_cmap not in _templates:
+        _templates[tpf_cmap] = FigureTemplate(tpf_cmap=tpf_cmap)
+    return _templates[tpf_cmap]
+
+
+def render_tql_fast(
+    results,
+    template=None,
+    savefig=False,
+    thumbnail=False,
+    outdir=".",
+    tpf_cmap="viridis",
+    verbose=True,
+):
+    """
+    Render the quick look figure of the output of run_tql by updating a
+    FigureTemplate in place (see render_tql for the full rendering)
+
+    Parameters
+    ----------
+    template : FigureTemplate
+        default=get_template(tpf_cmap)
+    savefig : bool
+        save figure in outdir
+    thumbnail : bool
+        also save a low resolution *_thumb.png
+    tpf_cmap : str
+        colormap of tpf
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        figure of the template (reused by the next target)
+    """
+    if (outdir is not None) & (not os.path.exists(outdir)):
+        os.makedirs(outdir)
+    template = get_template(tpf_cmap) if template is None else template
+    timings = results.get("timings", None)
+    timings = StageTimer() if timings is None else timings
+    with timings.stage("plotting"):
+        template.update(results)
+    if savefig:
+        fp = get_output_prefix(results, outdir)
+        with timings.stage("savefig"):
+            template.savefig(fp + ".png")
+            if thumbnail:
+                template.savefig(fp + "_thumb.png", dpi=THUMBNAIL_DPI)
+        if verbose:
+            print(f"Saved: {fp}.png")
+    return template.fig
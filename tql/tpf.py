@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped access to the cube of a TPF or TESSCut file.
+
+lightkurve materializes the whole (ncadences, ny, nx) cube each time
+tpf.flux is accessed, e.g. to make an aperture mask or a custom
+lightcurve. TpfCube instead maps the binary table of the file in chunks of
+rows (cadences): only one chunk is mapped and in memory at a time, so that
+peak memory does not grow with the cutout area times the number of
+cadences. Aperture sums (of one or many apertures at once) are computed
+chunk by chunk and the median image in blocks of pixel rows.
+"""
+
+import os
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.stats import median_absolute_deviation
+from scipy import ndimage
+
+from chronos.utils import (
+    parse_aperture_mask,
+    make_round_mask,
+    make_square_mask,
+)
+
+# bytes of a tpf mapped at a time
+CHUNK_BYTES = 32 * 2**20
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".zip")
+# WCS keywords of an image column n of the pixel table, e.g. 1CTYP5 for
+# FLUX=column 5 (as lightkurve's tpf.wcs)
+WCS_KEYWORDS = {
+    "1CTYP": "CTYPE1",
+    "2CTYP": "CTYPE2",
+    "1CRPX": "CRPIX1",
+    "2CRPX": "CRPIX2",
+    "1CRVL": "CRVAL1",
+    "2CRVL": "CRVAL2",
+    "1CUNI": "CUNIT1",
+    "2CUNI": "CUNIT2",
+    "1CDLT": "CDELT1",
+    "2CDLT": "CDELT2",
+    "11PC": "PC1_1",
+    "12PC": "PC1_2",
+    "21PC": "PC2_1",
+    "22PC": "PC2_2",
+}
+
+
+class TpfCube:
+    """
+    Read the columns of a TPF or TESSCut file in chunks of cadences through
+    memory maps, e.g.
+
+    >>> cube = TpfCube.from_tpf(tpf)
+    >>> time, flux, flux_err = cube.get_aperture_lc(aper_mask)
+    >>> median_image = cube.get_median_image()
+
+    The WCS of the images (wcs) is read from the header of the table, so
+    that the cube can stand in for the tpf in aperture.get_contratios.
+
+    Parameters
+    ----------
+    fp : str
+        path of an uncompressed fits file
+    quality_mask : array of bool
+        cadences to keep (default=all), e.g. tpf.quality_mask
+    ext : int
+        extension of the pixel table
+    chunk_bytes : int
+        bytes mapped at a time
+    """
+
+    def __init__(self, fp, quality_mask=None, ext=1, chunk_bytes=CHUNK_BYTES):
+        self.fp = fp
+        self.chunk_bytes = chunk_bytes
+        # only the headers are read
+        with fits.open(fp, memmap=False, lazy_load_hdus=True) as hdul:
+            hdu = hdul[ext]
+            self.offset = hdul.fileinfo(ext)["datLoc"]
+            self.nrows = hdu.header["NAXIS2"]
+            # fits tables are big-endian
+            self.dtype = hdu.columns.dtype.newbyteorder(">")
+            errmsg = f"cannot map the table of {fp}"
+            assert self.dtype.itemsize == hdu.header["NAXIS1"], errmsg
+            column = hdu.columns.names.index("FLUX") + 1
+            self.wcs = get_column_wcs(hdu.header, column)
+        if quality_mask is None:
+            quality_mask = np.ones(self.nrows, dtype=bool)
+        assert len(quality_mask) == self.nrows, "quality_mask != cadences"
+        self.quality_mask = np.asarray(quality_mask, dtype=bool)
+        self._median_image = None
+
+    def __repr__(self):
+        return f"TpfCube({self.fp}, shape={self.shape})"
+
+    @classmethod
+    def from_tpf(cls, tpf, chunk_bytes=CHUNK_BYTES):
+        """
+        cube of a lightkurve TargetPixelFile (with its quality mask)
+        """
+        return cls(
+            tpf.path, quality_mask=tpf.quality_mask, chunk_bytes=chunk_bytes
+        )
+
+    @property
+    def shape(self):
+        """
+        (ncadences, ny, nx) of cadences passing the quality mask
+        """
+        return (int(self.quality_mask.sum()),) + self.dtype["FLUX"].shape
+
+    def _read_rows(self, start, stop, columns):
+        mm = np.memmap(
+            self.fp,
+            dtype=self.dtype,
+            mode="r",
+            offset=self.offset + start * self.dtype.itemsize,
+            shape=(stop - start,),
+        )
+        try:
+            # native float copies; the map is closed once mm is deleted
+            return [np.array(mm[col], dtype=float) for col in columns]
+        finally:
+            del mm
+
+    def iter_chunks(self, columns=("FLUX",)):
+        """
+        yield the cadences of columns passing the quality mask in chunks of
+        rows; only one chunk is mapped (and in memory) at a time
+
+        Yields
+        ------
+        chunks : list of array
+            one (nchunk, ...) array per column
+        """
+        nrows = max(1, self.chunk_bytes // self.dtype.itemsize)
+        for start in range(0, self.nrows, nrows):
+            stop = min(start + nrows, self.nrows)
+            good = self.quality_mask[start:stop]
+            if not np.any(good):
+                continue
+            yield [arr[good] for arr in self._read_rows(start, stop, columns)]
+
+    def get_column(self, column="TIME"):
+        """
+        column of scalars (e.g. TIME, QUALITY) of cadences passing the
+        quality mask
+        """
+        return np.concatenate([c for c, in self.iter_chunks((column,))])
+
+    def get_frame(self, n=0):
+        """
+        image of the n-th cadence passing the quality mask
+        """
+        row = np.flatnonzero(self.quality_mask)[n]
+        return self._read_rows(row, row + 1, ["FLUX"])[0][0]
+
+    def get_median_image(self):
+        """
+        median image over cadences computed in blocks of pixel rows whose
+        cadences fit in chunk_bytes (memoized)
+        """
+        if self._median_image is not None:
+            return self._median_image
+        ncadences, ny, nx = self.shape
+        nrows = max(1, self.chunk_bytes // (8 * ncadences * nx))
+        image = np.empty((ny, nx))
+        for y0 in range(0, ny, nrows):
+            y1 = min(y0 + nrows, ny)
+            # copies so that the rest of each chunk is freed
+            block = np.concatenate(
+                [f[:, y0:y1].copy() for f, in self.iter_chunks(("FLUX",))]
+            )
+            image[y0:y1] = np.nanmedian(block, axis=0)
+        self._median_image = image
+        return image
+
+    def get_aperture_lcs(self, aper_masks, bkg_masks=None):
+        """
+        aperture photometry of each cadence in several apertures computed
+        in one pass over the cube (see sum_apertures)
+
+        Parameters
+        ----------
+        aper_masks : array of bool (naper, ny, nx)
+            pixels summed in each aperture
+        bkg_masks : array of bool (naper, ny, nx)
+            pixels whose median per cadence is subtracted from each pixel
+            of the aperture (default=None: no background subtraction)
+
+        Returns
+        -------
+        time : array (ncadences,)
+        flux, flux_err : array (naper, ncadences)
+        """
+        times, fluxes, errors = [], [], []
+        for time, flux, flux_err in self.iter_chunks(
+            ("TIME", "FLUX", "FLUX_ERR")
+        ):
+            f, e = sum_apertures(flux, flux_err, aper_masks, bkg_masks)
+            times.append(time)
+            fluxes.append(f)
+            errors.append(e)
+        return (
+            np.concatenate(times),
+            np.concatenate(fluxes, axis=1),
+            np.concatenate(errors, axis=1),
+        )
+
+    def get_aperture_lc(self, aper_mask, bkg_mask=None):
+        """
+        aperture photometry of each cadence computed in chunks
+
+        Parameters
+        ----------
+        aper_mask : array of bool (ny, nx)
+            pixels summed
+        bkg_mask : array of bool (ny, nx)
+            see get_aperture_lcs
+
+        Returns
+        -------
+        time, flux, flux_err : array
+        """
+        time, flux, flux_err = self.get_aperture_lcs(
+            [aper_mask], None if bkg_mask is None else [bkg_mask]
+        )
+        return time, flux[0], flux_err[0]
+
+
+def sum_apertures(flux, flux_err, aper_masks, bkg_masks=None):
+    """
+    sum of the pixels of each aperture in each cadence as one matrix
+    product of the (ncadences, npix) images and the (npix, naper) masks;
+    nan pixels are ignored (as np.nansum)
+
+    Parameters
+    ----------
+    flux, flux_err : array (ncadences, ny, nx)
+    aper_masks : array of bool (naper, ny, nx)
+    bkg_masks : array of bool (naper, ny, nx)
+        see TpfCube.get_aperture_lcs
+
+    Returns
+    -------
+    flux, flux_err : array (naper, ncadences)
+    """
+    aper_masks = np.asarray(aper_masks, dtype=bool)
+    naper = len(aper_masks)
+    weights = aper_masks.reshape(naper, -1).T.astype(float)
+    images = np.nan_to_num(flux.reshape(len(flux), -1))
+    errors = np.nan_to_num(flux_err.reshape(len(flux_err), -1))
+    f = (images @ weights).T
+    e = np.sqrt(errors**2 @ weights).T
+    if bkg_masks is not None:
+        pixels = flux.reshape(len(flux), -1)
+        npix = weights.sum(axis=0)
+        for n, bkg_mask in enumerate(np.asarray(bkg_masks, dtype=bool)):
+            bkg = np.nanmedian(pixels[:, bkg_mask.ravel()], axis=1)
+            f[n] -= npix[n] * bkg
+    return f, e
+
+
+def get_column_wcs(header, column):
+    """
+    WCS of the images of a column of the pixel table from its header
+    keywords (None if it has none)
+    """
+    keys = {
+        new: header[f"{old}{column}"]
+        for old, new in WCS_KEYWORDS.items()
+        if f"{old}{column}" in header
+    }
+    return WCS(keys) if len(keys) > 0 else None
+
+
+def get_tpf_cube(tpf, chunk_bytes=CHUNK_BYTES):
+    """
+    TpfCube of a lightkurve TargetPixelFile, or None if its file cannot be
+    mapped (e.g. compressed or not saved)
+    """
+    fp = getattr(tpf, "path", None)
+    if (
+        (not isinstance(fp, str))
+        or (not os.path.isfile(fp))
+        or fp.endswith(COMPRESSED_EXTENSIONS)
+    ):
+        return None
+    return TpfCube.from_tpf(tpf, chunk_bytes=chunk_bytes)
+
+
+def get_threshold_mask(median_image, threshold_sigma=5):
+    """
+    pixels brighter than threshold_sigma MADs above the median of the
+    median image, keeping the region closest to the center (as
+    lightkurve's create_threshold_mask)
+    """
+    vals = median_image[np.isfinite(median_image)].flatten()
+    cut = 1.4826 * median_absolute_deviation(vals) * threshold_sigma
+    cut += np.nanmedian(median_image)
+    mask = np.nan_to_num(median_image) > cut
+    labels = ndimage.label(mask)[0]
+    label_args = np.argwhere(labels > 0)
+    if len(label_args) == 0:
+        return mask
+    ny, nx = median_image.shape
+    distances = np.hypot(*(label_args - np.array([ny / 2, nx / 2])).T)
+    y, x = label_args[np.argmin(distances)]
+    return labels == labels[y, x]
+
+
+def get_background_mask(median_image, aper_mask):
+    """
+    pixels outside the aperture fainter than the median of the median image
+    """
+    faint = np.nan_to_num(median_image) < np.nanmedian(median_image)
+    return faint & ~np.asarray(aper_mask, dtype=bool)
+
+
+def get_aperture_mask(
+    tpf,
+    sap_mask="pipeline",
+    aper_radius=1,
+    percentile=90,
+    threshold_sigma=5,
+    cube=None,
+):
+    """
+    aperture mask of a tpf as chronos.utils.parse_aperture_mask, with the
+    images it needs read from the memory-mapped cube instead of tpf.flux
+
+    Parameters
+    ----------
+    cube : TpfCube
+        cube of tpf (see get_tpf_cube); if None and the tpf cannot be
+        mapped, parse_aperture_mask is used
+
+    Returns
+    -------
+    mask : array of bool
+    """
+    if sap_mask == "pipeline":
+        return tpf.pipeline_mask
+    cube = get_tpf_cube(tpf) if cube is None else cube
+    if cube is None:
+        return parse_aperture_mask(
+            tpf,
+            sap_mask=sap_mask,
+            aper_radius=aper_radius,
+            percentile=percentile,
+            threshold_sigma=threshold_sigma,
+        )
+    if sap_mask == "all":
+        return np.ones(cube.shape[1:], dtype=bool)
+    elif sap_mask == "round":
+        return make_round_mask(cube.get_frame(0), radius=aper_radius)
+    elif sap_mask == "square":
+        return make_square_mask(
+            cube.get_frame(0), size=aper_radius, angle=None
+        )
+    elif sap_mask == "threshold":
+        return get_threshold_mask(cube.get_median_image(), threshold_sigma)
+    elif sap_mask == "percentile":
+        median_image = cube.get_median_image()
+        return median_image > np.nanpercentile(median_image, percentile)
+    else:
+        raise ValueError("Unknown aperture mask")
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+Automated vetting of transit candidates from saved tql results
+(c.f. sec 2.3 of Heller et al. 2019).
+
+The metrics of all candidates of a target are computed together from the
+flattened lightcurve, the period, epoch and duration of each candidate and
+the Lomb-Scargle rotation period, which are all saved with the tls
+results, so that the candidates of a whole sector are re-vetted in
+parallel without re-running TLS:
+
+* odd_even_sigma : difference of odd and even transit depths in sigma
+* secondary_depth, secondary_snr : depth of the secondary eclipse window
+  (phase 0.5)
+* shape : depth in the ingress/egress quarters over that in the central
+  half of the transit (~1 for U-shaped (box) transits, ~1/3 for V-shaped)
+* transit_snr_max_frac : fraction of the SNR^2 of all transits in the
+  strongest transit (1/ntransits if consistent, ~1 for single events) and
+  transit_snr_chi2 : reduced chi2 of the individual transit depths
+* rotation_ratio, rotation_harmonic : period / Prot_ls and whether it is
+  close to a harmonic of the rotation period
+
+Depths and errors are relative to the median and robust scatter of the
+out-of-transit flux. For files saved without the flattened lightcurve, only
+the main candidate is vetted, from the folded lightcurve and the odd/even and
+per-transit depths computed by TLS.
+"""
+
+import os
+from glob import glob
+import multiprocessing as mp
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import tables
+
+from tql.fold import fold_phase, fold_and_bin
+
+# flag a candidate if
+ODD_EVEN_SIGMA_MAX = 3.0
+SECONDARY_SNR_MAX = 3.0
+V_SHAPE_MAX = 0.5
+SINGLE_EVENT_MAX = 0.7
+HARMONIC_TOLERANCE = 0.02
+MAX_HARMONIC = 4
+# fewer in-transit points do not make a transit
+MIN_TRANSIT_POINTS = 3
+
+VETTING_COLUMNS = [
+    "filename",
+    "ticid",
+    "sector",
+    "candidate",
+    "SDE",
+    "period",
+    "T0",
+    "duration",
+    "depth",
+    "Prot_ls",
+    "depth_even",
+    "depth_odd",
+    "odd_even_sigma",
+    "secondary_depth",
+    "secondary_snr",
+    "shape",
+    "ntransits",
+    "transit_snr_max_frac",
+    "transit_snr_chi2",
+    "rotation_ratio",
+    "rotation_harmonic",
+    "flags",
+]
+# saved in *_tls.h5 by core.save_tls
+VETTING_KEYS = [
+    "ticid",
+    "sector",
+    "SDE",
+    "period",
+    "T0",
+    "duration",
+    "depth",
+    "time_flat",
+    "flux_flat",
+    "Prot_ls",
+    "candidates",
+]
+# saved by TLS; used if the lightcurves were not saved (older files)
+FOLDED_KEYS = [
+    "folded_phase",
+    "folded_y",
+    "depth_mean_even",
+    "depth_mean_odd",
+    "transit_depths",
+    "transit_depths_uncertainties",
+]
+
+
+def _values(arr):
+    return np.asarray(getattr(arr, "value", arr), dtype=float)
+
+
+def get_rotation_harmonic(period, Prot, tol=HARMONIC_TOLERANCE):
+    """
+    period / Prot and whether it is within tol of n or 1/n
+    (n=1..MAX_HARMONIC)
+    """
+    period = np.asarray(period, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = period / Prot
+        n = np.where(ratio >= 1, np.round(ratio), 1 / np.round(1 / ratio))
+        close = np.abs(ratio / n - 1) < tol
+    harmonic = close & (ratio <= MAX_HARMONIC) & (ratio >= 1 / MAX_HARMONIC)
+    return ratio, harmonic
+
+
+def get_transit_depths(time, flux, period, t0, duration, baseline, noise):
+    """
+    depth and its error of each transit of each candidate
+
+    Returns
+    -------
+    depth, error : array
+        (ncandidates, ncycles); nan where a transit has less than
+        MIN_TRANSIT_POINTS points
+    """
+    phase, cycle = fold_phase(time, period, t0)
+    in_transit = np.abs(phase) < (duration / period / 2)[:, None]
+    cycle = cycle - cycle.min(axis=1, keepdims=True)
+    ncycles = int(cycle.max()) + 1
+    ncand = len(period)
+    idx = (np.arange(ncand)[:, None] * ncycles + cycle)[in_transit]
+    dflux = (baseline[:, None] - flux)[in_transit]
+    size = ncand * ncycles
+    count = np.bincount(idx, minlength=size).reshape(ncand, ncycles)
+    sums = np.bincount(idx, weights=dflux, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        depth = sums.reshape(ncand, ncycles) / count
+        error = noise[:, None] / np.sqrt(count)
+    few = count < MIN_TRANSIT_POINTS
+    depth[few], error[few] = np.nan, np.nan
+    return depth, error
+
+
+def get_transit_consistency(depth, error):
+    """
+    consistency of the individual transits of each candidate
+
+    Parameters
+    ----------
+    depth, error : array
+        (ncandidates, ntransits); nan for transits without data
+
+    Returns
+    -------
+    ntransits, max_frac, chi2 : array
+        number of transits with data, fraction of the SNR^2 of all transits
+        in the strongest one and reduced chi2 of the depths about their
+        weighted mean (nan for single transits)
+    """
+    has_data = np.isfinite(depth) & np.isfinite(error) & (error > 0)
+    ntransits = has_data.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        snr = np.where(has_data, depth / error, 0)
+        snr2 = np.clip(snr, 0, None) ** 2
+        max_frac = snr2.max(axis=1) / snr2.sum(axis=1)
+        w = np.where(has_data, 1 / error**2, 0)
+        d = np.where(has_data, depth, 0)
+        mean_depth = (w * d).sum(axis=1) / w.sum(axis=1)
+        chi2 = (w * (d - mean_depth[:, None]) ** 2).sum(axis=1) / (
+            ntransits - 1
+        )
+    chi2[ntransits < 2] = np.nan
+    return ntransits, max_frac, chi2
+
+
+def get_vetting_metrics(time, flux, period, t0, duration, Prot=np.nan):
+    """
+    Vetting metrics of transit candidates of one lightcurve
+
+    Parameters
+    ----------
+    time, flux : array
+        flattened lightcurve
+    period, t0, duration : float or array
+        orbital period, mid-transit time and duration in days of each
+        candidate
+    Prot : float
+        rotation period in days (e.g. Prot_ls)
+
+    Returns
+    -------
+    metrics : list of dict
+        one per candidate, see VETTING_COLUMNS
+    """
+    time, flux = _values(time), _values(flux)
+    good = np.isfinite(time) & np.isfinite(flux)
+    time, flux = time[good], flux[good]
+    period = np.atleast_1d(np.asarray(period, dtype=float))
+    t0 = np.broadcast_to(np.asarray(t0, dtype=float), period.shape)
+    duration = np.broadcast_to(np.asarray(duration, dtype=float), period.shape)
+
+    # out-of-transit level and robust scatter of each candidate
+    phase, _ = fold_phase(time, period, t0)
+    oot = np.where(
+        np.abs(phase) > (duration / period)[:, None], flux[None, :], np.nan
+    )
+    baseline = np.nanmedian(oot, axis=1)
+    noise = 1.4826 * np.nanmedian(np.abs(oot - baseline[:, None]), axis=1)
+
+    # 4 bins of duration/4 within the transit and the secondary windows
+    bins = fold_and_bin(
+        time, flux, period, t0, width=duration / 4, xlim=duration / period / 2
+    )
+    count = bins["count"]
+    sums = np.nan_to_num(bins["mean"]) * count
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # groups x candidates
+        n = count.sum(axis=2)
+        depth = baseline - sums.sum(axis=2) / n
+        error = noise / np.sqrt(n)
+        # central half and ingress/egress quarters of all transits
+        inner, outer = [
+            baseline - sums[0][:, b].sum(axis=1) / count[0][:, b].sum(axis=1)
+            for b in [[1, 2], [0, 3]]
+        ]
+        shape = np.where(inner > 0, outer / inner, np.nan)
+        odd_even_sigma = np.abs(depth[2] - depth[1]) / np.hypot(
+            error[1], error[2]
+        )
+        secondary_snr = depth[3] / error[3]
+
+    tdepth, terror = get_transit_depths(
+        time, flux, period, t0, duration, baseline, noise
+    )
+    ntransits, max_frac, chi2 = get_transit_consistency(tdepth, terror)
+    ratio, harmonic = get_rotation_harmonic(period, Prot)
+
+    metrics = []
+    for i in range(len(period)):
+        d = dict(
+            depth_even=depth[1, i],
+            depth_odd=depth[2, i],
+            odd_even_sigma=odd_even_sigma[i],
+            secondary_depth=depth[3, i],
+            secondary_snr=secondary_snr[i],
+            shape=shape[i],
+            ntransits=int(ntransits[i]),
+            transit_snr_max_frac=max_frac[i],
+            transit_snr_chi2=chi2[i],
+            rotation_ratio=ratio[i],
+            rotation_harmonic=bool(harmonic[i]),
+        )
+        d["flags"] = ",".join(get_flags(d))
+        metrics.append(d)
+    return metrics
+
+
+def get_flags(metrics):
+    """
+    names of the failed vetting tests of a candidate
+    """
+    flags = []
+    if metrics["odd_even_sigma"] > ODD_EVEN_SIGMA_MAX:
+        flags.append("odd_even")
+    if metrics["secondary_snr"] > SECONDARY_SNR_MAX:
+        flags.append("secondary")
+    if metrics["shape"] < V_SHAPE_MAX:
+        flags.append("v_shape")
+    if (metrics["ntransits"] > 1) and (
+        metrics["transit_snr_max_frac"] > SINGLE_EVENT_MAX
+    ):
+        flags.append("single_event")
+    if metrics["rotation_harmonic"]:
+        flags.append("rotation")
+    return flags
+
+
+def get_folded_metrics(tls_results, Prot=np.nan):
+    """
+    vetting metrics of the main candidate from the folded lightcurve, the
+    odd/even and the per-transit depths of TLS (files saved without the
+    flattened lightcurve)
+    """
+    tls = tls_results
+    # phase in [0, 1) with the transit at 0.5
+    d = get_vetting_metrics(
+        tls["folded_phase"],
+        tls["folded_y"],
+        1.0,
+        0.5,
+        tls["duration"] / tls["period"],
+    )[0]
+    (even, even_err), (odd, odd_err) = [
+        tls[k] for k in ["depth_mean_even", "depth_mean_odd"]
+    ]
+    # TLS depths are flux ratios
+    depth = 1 - np.asarray(tls["transit_depths"], dtype=float)[None, :]
+    error = np.asarray(tls["transit_depths_uncertainties"], dtype=float)
+    ntransits, max_frac, chi2 = get_transit_consistency(depth, error[None])
+    ratio, harmonic = get_rotation_harmonic(tls["period"], Prot)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        odd_even_sigma = np.abs(odd - even) / np.hypot(odd_err, even_err)
+    d.update(
+        depth_even=1 - even,
+        depth_odd=1 - odd,
+        odd_even_sigma=odd_even_sigma,
+        ntransits=int(ntransits[0]),
+        transit_snr_max_frac=max_frac[0],
+        transit_snr_chi2=chi2[0],
+        rotation_ratio=float(ratio),
+        rotation_harmonic=bool(harmonic),
+    )
+    d["flags"] = ",".join(get_flags(d))
+    return d
+
+
+def vet_tls_results(tls_results):
+    """
+    vetting metrics of all candidates of a tls results dict (the output of
+    run_tql or a saved *_tls.h5 file)
+
+    Returns
+    -------
+    rows : list of dict
+        one per candidate, see VETTING_COLUMNS
+    """
+    candidates = tls_results.get("candidates")
+    if not candidates:
+        candidates = [tls_results]
+    Prot = tls_results.get("Prot_ls", np.nan)
+    if isinstance(Prot, (tuple, list)):
+        # (Prot_ls, Prot_ls_err)
+        Prot = Prot[0]
+    Prot = np.nan if Prot is None else float(Prot)
+    keys = ["SDE", "period", "T0", "duration", "depth"]
+    scalars = {
+        k: np.array([c.get(k, np.nan) for c in candidates], dtype=float)
+        for k in keys
+    }
+    if "time_flat" in tls_results:
+        # all candidates at once
+        metrics = get_vetting_metrics(
+            tls_results["time_flat"],
+            tls_results["flux_flat"],
+            scalars["period"],
+            scalars["T0"],
+            scalars["duration"],
+            Prot=Prot,
+        )
+    else:
+        scalars = {k: v[:1] for k, v in scalars.items()}
+        metrics = [get_folded_metrics(tls_results, Prot=Prot)]
+    rows = []
+    for i, d in enumerate(metrics):
+        row = dict(
+            ticid=tls_results.get("ticid"),
+            sector=tls_results.get("sector"),
+            candidate=i,
+            Prot_ls=Prot,
+            **{k: v[i] for k, v in scalars.items()},
+        )
+        row.update(d)
+        rows.append(row)
+    return rows
+
+
+def read_tls_file(fp, keys=VETTING_KEYS):
+    """
+    read only keys (if saved) of a deepdish *_tls.h5 file
+    """
+    import deepdish as dd
+
+    with tables.open_file(fp, mode="r") as h5:
+        # deepdish saves dict subclasses (e.g. tls_results) in /data
+        group = h5.root.data if "data" in h5.root else h5.root
+        saved = set(group._v_children) | set(group._v_attrs._v_attrnamesuser)
+        prefix = group._v_pathname.rstrip("/")
+    keys = [k for k in keys if k in saved]
+    values = dd.io.load(fp, [f"{prefix}/{k}" for k in keys])
+    return dict(zip(keys, values))
+
+
+def vet_tls_file(fp):
+    """
+    vetting metrics of the candidates of a saved *_tls.h5 file
+    """
+    tls_results = read_tls_file(fp)
+    if "time_flat" not in tls_results:
+        tls_results.update(read_tls_file(fp, FOLDED_KEYS))
+    rows = vet_tls_results(tls_results)
+    for row in rows:
+        row["filename"] = fp
+    return rows
+
+
+def vet_store_target(store_file, name):
+    """
+    vetting metrics of a target of a ResultStore (only its main candidate;
+    without Prot_ls)
+    """
+    from tql.store import ResultStore
+
+    with ResultStore(store_file, mode="r") as store:
+        row = store.get_scalars(f"name == {name.encode()!r}").iloc[-1]
+        tls_results = store.get(name, keys=["time_flat", "flux_flat"])
+    tls_results.update(row.to_dict())
+    rows = vet_tls_results(tls_results)
+    for row in rows:
+        row["filename"] = f"{store_file}:{name}"
+    return rows
+
+
+def _vet(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        print(f"Error vetting {args[-1]}: {e}")
+        return []
+
+
+def _to_frame(rows):
+    df = pd.DataFrame(rows, columns=VETTING_COLUMNS)
+    df["rotation_harmonic"] = df["rotation_harmonic"].astype(bool)
+    return df
+
+
+def vet_files(files, ncores=1):
+    """
+    Vet the candidates of saved *_tls.h5 files in parallel
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        one row per candidate, see VETTING_COLUMNS
+    """
+    func = partial(_vet, vet_tls_file)
+    if ncores > 1 and len(files) > 1:
+        with mp.Pool(processes=ncores) as pool:
+            out = pool.map(func, files, chunksize=16)
+    else:
+        out = [func(fp) for fp in files]
+    return _to_frame([row for rows in out for row in rows])
+
+
+def vet_store(store_file, ncores=1):
+    """
+    Vet the targets of a ResultStore (e.g. tql_results.h5) in parallel
+    """
+    from tql.store import ResultStore
+
+    with ResultStore(store_file, mode="r") as store:
+        names = store.names()
+    func = partial(_vet, vet_store_target, store_file)
+    if ncores > 1 and len(names) > 1:
+        with mp.Pool(processes=ncores) as pool:
+            out = pool.map(func, names, chunksize=16)
+    else:
+        out = [func(name) for name in names]
+    return _to_frame([row for rows in out for row in rows])
+
+
+def run_vetting(indir, ncores=1, outfile=None, verbose=True):
+    """
+    Vet the candidates of all *_tls.h5 files and of the ResultStore
+    (tql_results.h5, if any) in indir and save them as csv
+
+    Parameters
+    ----------
+    indir : str
+        output directory of tql
+    ncores : int
+        number of processes
+    outfile : str
+        csv file (default=indir/tql_vetting.csv)
+
+    Returns
+    -------
+    df : pandas.DataFrame
+    """
+    if outfile is None:
+        outfile = os.path.join(indir, "tql_vetting.csv")
+    files = sorted(glob(os.path.join(indir, "*_tls.h5")))
+    store_file = os.path.join(indir, "tql_results.h5")
+    if verbose:
+        print(f"Vetting {len(files)} files in {indir}")
+    dfs = [vet_files(files, ncores=ncores)]
+    if os.path.exists(store_file):
+        dfs.append(vet_store(store_file, ncores=ncores))
+    dfs = [df for df in dfs if len(df) > 0]
+    df = pd.concat(dfs, ignore_index=True) if dfs else _to_frame([])
+    df.to_csv(outfile, index=False)
+    if verbose:
+        print(f"Saved: {outfile}")
+    return df
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of writer processes fed by a bounded queue.
+
+In batch mode, compute workers put the results of each target on the queue
+of a WriterPool and move on to the next TLS search while the writers
+render the figure and save the h5 files. The queue holds at most maxsize
+results: compute workers block on put when it is full (backpressure), so
+that memory stays bounded when writing is slower than computing. The output
+of each task is passed to a callback in a thread of the parent process.
+"""
+
+import queue
+import threading
+import traceback
+import multiprocessing as mp
+
+
+def _writer(func, initializer, tasks, done):
+    if initializer is not None:
+        initializer()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            done.put(func(task))
+    finally:
+        done.put(None)
+
+
+class WriterPool:
+    """
+    Run func on the tasks put on a bounded queue in nworkers processes, e.g.
+
+    >>> pool = WriterPool(write, callback=print, nworkers=2)
+    >>> pool.put(results)  # blocks if maxsize tasks are waiting
+    >>> pool.close()  # waits for all tasks to be written
+
+    The queue can be passed to other processes (e.g. the initializer of a
+    multiprocessing.Pool) which put tasks on it directly.
+
+    Parameters
+    ----------
+    func : callable
+        picklable function of one task; it should catch its own exceptions
+    callback : callable
+        called in the parent process with the output of func
+    nworkers : int
+        number of writer processes
+    maxsize : int
+        maximum number of tasks waiting in the queue (default=2*nworkers)
+    initializer : callable
+        called once in each writer process
+    """
+
+    def __init__(
+        self, func, callback, nworkers=1, maxsize=None, initializer=None
+    ):
+        assert nworkers >= 1, "nworkers should be >= 1"
+        self.callback = callback
+        self.nworkers = nworkers
+        self.maxsize = 2 * nworkers if maxsize is None else maxsize
+        self.queue = mp.Queue(maxsize=self.maxsize)
+        self._done = mp.Queue()
+        self.ndone = 0
+        self.workers = [
+            mp.Process(
+                target=_writer,
+                args=(func, initializer, self.queue, self._done),
+                daemon=True,
+            )
+            for _ in range(nworkers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def __repr__(self):
+        return f"WriterPool(nworkers={self.nworkers}, done={self.ndone})"
+
+    def _collect(self):
+        nstopped = 0
+        while nstopped < self.nworkers:
+            try:
+                out = self._done.get(timeout=1)
+            except queue.Empty:
+                # e.g. writers killed before sending their sentinel
+                if not any(w.is_alive() for w in self.workers):
+                    break
+                continue
+            if out is None:
+                nstopped += 1
+                continue
+            self.ndone += 1
+            try:
+                self.callback(out)
+            except Exception:
+                traceback.print_exc()
+
+    def put(self, task):
+        """
+        queue a task; blocks while maxsize tasks are waiting
+        """
+        self.queue.put(task)
+
+    def close(self):
+        """
+        wait until all queued tasks are written and stop the writers
+        """
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self._collector.join()
+
+    def terminate(self):
+        """
+        stop the writers without waiting for queued tasks
+        """
+        for worker in self.workers:
+            worker.terminate()
+        self._collector.join()